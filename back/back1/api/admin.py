@@ -1,13 +1,187 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
 from django.contrib import admin
-from .models import BiometricRecord, UserTask, GazeRecord
+from django.core.paginator import Paginator
+from django.db import connections, router
+from django.utils.functional import cached_property
+
+from .models import BiometricRecord, Device, TaskEntry, UserTask, GazeRecord
+
+# ===== Changelists for large tables =====
+#
+# BiometricRecord, UserTask and GazeRecord grow to millions of rows, so
+# their changelists avoid anything that scans the table. There is no full
+# COUNT(*), no SELECT DISTINCT over dates and no LIKE. Every query is a
+# range or equality lookup on an index, ordered the way the
+# (timestamp, id) indexes are.
+
+PERIOD_FORMATS = ("%Y", "%Y-%m", "%Y-%m-%d", "%Y-%m-%dT%H")
+MAX_ID = 2 ** 63 - 1    # largest BigAutoField value; a longer number can't be an id
+
+
+def estimate_rows(model):
+    """Cheap row count for a whole table: planner statistics, else the id range."""
+    conn = connections[router.db_for_read(model)]
+    if conn.vendor == "postgresql":
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+                           [model._meta.db_table])
+            row = cursor.fetchone()
+        if row and row[0] > 0:
+            return row[0]
+    # two queries: SQLite only optimises a lone MIN() or MAX() to an index seek
+    ids = model._default_manager.order_by("pk").values_list("pk", flat=True)
+    first, last = ids.first(), ids.last()
+    return 0 if first is None else last - first + 1
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Counts exactly up to FLOW_ADMIN_EXACT_COUNT rows (a bounded
+    ``COUNT(*) ... LIMIT``). Beyond that an unfiltered list uses
+    estimate_rows(), and a filtered one stops at the limit. Narrow it with
+    the drill-down or a search to see the rest.
+    """
+
+    @cached_property
+    def count(self):
+        limit = settings.FLOW_ADMIN_EXACT_COUNT
+        qs = self.object_list
+        exact = qs.order_by()[:limit + 1].count()
+        if exact <= limit:
+            return exact
+        if not qs.query.where:
+            return max(estimate_rows(qs.model), exact)
+        return limit
+
+
+def _period(value):
+    """(start, end, level) in UTC for "2025", "2025-01", "2025-01-05" or "2025-01-05T13"."""
+    for level, fmt in enumerate(PERIOD_FORMATS):
+        try:
+            start = datetime.strptime(value, fmt).replace(tzinfo=dt_timezone.utc)
+            return start, _next_period(start, level), level
+        except (ValueError, OverflowError):     # OverflowError: the period after year 9999
+            continue
+    raise ValueError(f"not a period: {value!r}")
+
+
+def _next_period(start, level):
+    if level == 0:
+        return start.replace(year=start.year + 1)
+    if level == 1:
+        return start.replace(year=start.year + start.month // 12, month=start.month % 12 + 1)
+    return start + (timedelta(days=1) if level == 2 else timedelta(hours=1))
+
+
+def _period_label(start, level):
+    return (f"{start:%Y}", f"{start:%B %Y}", f"{start.day} {start:%b %Y}", f"{start:%d %b %H}:00")[level]
+
+
+class TimestampDrillDown(admin.SimpleListFilter):
+    """
+    Year > month > day > hour navigation on ``timestamp``, like
+    ``date_hierarchy``. date_hierarchy finds the periods that have data
+    with a SELECT DISTINCT over the whole table. Here each candidate
+    period (at most 31) is one indexed EXISTS probe instead.
+    """
+    title = "timestamp"
+    parameter_name = "period"
+
+    def lookups(self, request, model_admin):
+        qs = model_admin.model._default_manager.all()
+        value = self.value()
+        if value:
+            try:
+                start, end, level = _period(value)
+            except ValueError:
+                return []
+            # the way back up, then the current period
+            choices = []
+            for up in range(level):
+                key = f"{start:{PERIOD_FORMATS[up]}}"
+                choices.append((key, f"‹ {_period_label(_period(key)[0], up)}"))
+            choices.append((value, _period_label(start, level)))
+            if level == len(PERIOD_FORMATS) - 1:
+                return choices
+        else:
+            choices, level = [], -1
+            ts = qs.order_by("timestamp").values_list("timestamp", flat=True)
+            first, last = ts.first(), ts.last()
+            if first is None:
+                return []
+            start = datetime(first.year, 1, 1, tzinfo=dt_timezone.utc)
+            end = datetime(last.year + 1, 1, 1, tzinfo=dt_timezone.utc)
+
+        child = start
+        while child < end:
+            following = _next_period(child, level + 1)
+            if qs.filter(timestamp__gte=child, timestamp__lt=following).exists():
+                choices.append((f"{child:{PERIOD_FORMATS[level + 1]}}", _period_label(child, level + 1)))
+            child = following
+        return choices
+
+    def queryset(self, request, queryset):
+        if not self.value():
+            return queryset
+        start, end, _ = _period(self.value())     # ValueError: the admin shows "?e=1"
+        return queryset.filter(timestamp__gte=start, timestamp__lt=end)
+
+
+def _search_period(term):
+    """(start, end) for a period or an ISO date-time prefix down to the second."""
+    try:
+        start, end, _ = _period(term)
+        return start, end
+    except ValueError:
+        pass
+    start = datetime.fromisoformat(term.replace("Z", "+00:00"))
+    if start.tzinfo is None:
+        start = start.replace(tzinfo=dt_timezone.utc)
+    try:
+        return start, start + (timedelta(minutes=1) if len(term) <= 16 else timedelta(seconds=1))
+    except OverflowError:
+        raise ValueError(f"not a period: {term!r}")
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """
+    Changelist settings shared by the time-series tables. The search box
+    only does index lookups: a number is an id, an ISO date or date-time
+    prefix is that period, anything else is an exact device key (so is a
+    number too large to be an id).
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_filter = (TimestampDrillDown,)
+    ordering = ("-timestamp", "-id")
+    search_fields = ("device__key",)    # shows the box; get_search_results does the work
+    search_help_text = "Id, ISO date / time (2025-01-05T13:20) or exact device key."
+    raw_id_fields = ("device",)
+
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        # isascii: "²".isdigit() too; the length check keeps int() cheap
+        if term.isascii() and term.isdigit() and len(term) <= 19 and int(term) <= MAX_ID:
+            return queryset.filter(pk=int(term)), False
+        try:
+            start, end = _search_period(term)
+        except ValueError:
+            return queryset.filter(device__key=term), False
+        return queryset.filter(timestamp__gte=start, timestamp__lt=end), False
+
 
 @admin.register(UserTask)
-class UserTaskAdmin(admin.ModelAdmin):
+class UserTaskAdmin(LargeTableAdmin):
     list_display = ("timestamp", "app", "title", "url", "active", "record")
-    ordering = ("-timestamp",)
+    list_select_related = ("record",)
+    raw_id_fields = ("record", "device")
 
 @admin.register(BiometricRecord)
-class BiometricRecordAdmin(admin.ModelAdmin):
+class BiometricRecordAdmin(LargeTableAdmin):
     list_display = (
         "timestamp",
         "mean_iki_ms",
@@ -19,12 +193,19 @@ class BiometricRecordAdmin(admin.ModelAdmin):
         "idle_time_ms",
         "received_at",
     )
+    raw_id_fields = ("device", "user")
 
-    list_filter = ("timestamp",)
-    ordering = ("-timestamp",)
-    
 @admin.register(GazeRecord)
-class GazeRecordAdmin(admin.ModelAdmin):
+class GazeRecordAdmin(LargeTableAdmin):
     list_display = ("id", "timestamp", "gaze_x", "gaze_y", "screen_w", "screen_h", "received_at")
-    list_filter = ("timestamp",)
-    search_fields = ("timestamp",)
+    raw_id_fields = ("device", "user")
+
+@admin.register(Device)
+class DeviceAdmin(admin.ModelAdmin):
+    list_display = ("key", "label", "user", "created_at")
+    search_fields = ("key", "label")
+
+@admin.register(TaskEntry)
+class TaskEntryAdmin(admin.ModelAdmin):
+    list_display = ("id", "app", "title", "url", "first_seen")
+    search_fields = ("app", "title")
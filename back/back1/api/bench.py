@@ -0,0 +1,138 @@
+"""
+Helpers shared by the ``bench_*`` management commands.
+
+Benchmarks never touch the real database: ``scratch_database()`` creates a
+migrated throwaway database next to it (a temp file for SQLite) and
+destroys it afterwards.
+"""
+import json
+import os
+import random
+import statistics
+import subprocess
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.db import connections, transaction
+
+
+@contextmanager
+def scratch_database(alias="default"):
+    conn = connections[alias]
+    old_name = conn.settings_dict["NAME"]
+    old_test = dict(conn.settings_dict.get("TEST") or {})
+
+    tmp_path = None
+    if conn.vendor == "sqlite":
+        # A file, not the in-memory default, so large fills don't live in RAM
+        # and pragmas behave like production.
+        fd, tmp_path = tempfile.mkstemp(prefix="flow-bench-", suffix=".sqlite3")
+        os.close(fd)
+        conn.settings_dict.setdefault("TEST", {})["NAME"] = tmp_path
+
+    conn.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield conn
+    finally:
+        conn.creation.destroy_test_db(old_name, verbosity=0)
+        conn.settings_dict["TEST"] = old_test
+        for path in (tmp_path, f"{tmp_path}-wal", f"{tmp_path}-shm") if tmp_path else ():
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def fill_table(model, count, overrides, chunk_size=50_000, using="default"):
+    """
+    Insert ``count`` rows into ``model``'s table with raw executemany.
+
+    Every concrete column gets its field default; ``overrides`` maps field
+    names to a function ``i -> python value`` for the columns that should
+    vary per row. Much faster than bulk_create for millions of rows.
+    """
+    conn = connections[using]
+    fields = [f for f in model._meta.concrete_fields if not f.primary_key]
+    columns = ", ".join(conn.ops.quote_name(f.column) for f in fields)
+    placeholders = ", ".join(["%s"] * len(fields))
+    sql = f"INSERT INTO {conn.ops.quote_name(model._meta.db_table)} ({columns}) VALUES ({placeholders})"
+
+    now = datetime.now(dt_timezone.utc)
+    base = []
+    for f in fields:
+        value = now if getattr(f, "auto_now_add", False) else f.get_default()
+        base.append(f.get_db_prep_save(value, conn))
+    varying = [
+        (idx, f, overrides[f.name])
+        for idx, f in enumerate(fields)
+        if f.name in overrides
+    ]
+
+    for start in range(0, count, chunk_size):
+        rows = []
+        for i in range(start, min(start + chunk_size, count)):
+            row = list(base)
+            for idx, f, fn in varying:
+                row[idx] = f.get_db_prep_save(fn(i), conn)
+            rows.append(row)
+        # one commit per chunk, not per row
+        with transaction.atomic(using=using), conn.cursor() as cursor:
+            cursor.executemany(sql, rows)
+
+
+def timestamps(start=None, step_seconds=5.0, jitter=0.5):
+    """Return ``i -> datetime`` for roughly evenly spaced, slightly shuffled rows."""
+    start = start or datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+    rng = random.Random(0)
+    return lambda i: start + timedelta(seconds=i * step_seconds + rng.uniform(-jitter, jitter))
+
+
+def time_calls(fn, repeat, warmup=3):
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t0)
+    return summarize(samples)
+
+
+def summarize(samples):
+    """Latency summary in milliseconds for a list of durations in seconds."""
+    if not samples:
+        return {"n": 0}
+    ms = sorted(s * 1000.0 for s in samples)
+
+    def pct(p):
+        return ms[min(len(ms) - 1, int(round(p / 100.0 * (len(ms) - 1))))]
+
+    return {
+        "n": len(ms),
+        "mean_ms": statistics.fmean(ms),
+        "p50_ms": pct(50),
+        "p95_ms": pct(95),
+        "p99_ms": pct(99),
+        "max_ms": ms[-1],
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_results(path, name, results):
+    payload = {
+        "benchmark": name,
+        "git_revision": git_revision(),
+        "created_at": datetime.now(dt_timezone.utc).isoformat(),
+        "results": results,
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, indent=2)
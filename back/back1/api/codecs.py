@@ -0,0 +1,153 @@
+"""
+Request body decoders for the ingestion endpoints.
+
+Besides JSON, clients may send:
+
+``application/x-flow-heartbeat`` (v1)
+    One little-endian HEARTBEAT_DTYPE struct (64 bytes): unix timestamp
+    (f8), the ten model features in features.NAMES order (f4), then
+    gaze_x, gaze_y, screen_w, screen_h (f4). Any bytes after the struct
+    are a UTF-8 JSON array of task objects.
+
+``application/x-flow-gaze`` (v1)
+    A packed array of little-endian GAZE_DTYPE structs (24 bytes each):
+    timestamp (f8), gaze_x, gaze_y, screen_w, screen_h (f4). Decoded with
+    one ``np.frombuffer`` and validated column-wise.
+
+``application/msgpack``
+    The JSON shapes, MessagePack-encoded. Needs the optional ``msgpack``
+    package. Timestamps may be unix seconds instead of ISO strings.
+
+A ``v`` content-type parameter, when present, must be "1".
+"""
+import json
+from datetime import datetime, timezone as dt_timezone
+
+import numpy as np
+from numpy.lib.recfunctions import structured_to_unstructured
+
+from . import features
+from .models import BiometricRecord, GazeRecord
+from .task_catalogue import Window
+
+HEARTBEAT_TYPE = "application/x-flow-heartbeat"
+GAZE_TYPE = "application/x-flow-gaze"
+MSGPACK_TYPE = "application/msgpack"
+
+HEARTBEAT_DTYPE = np.dtype([
+    ("timestamp", "<f8"),
+    *((f, "<f4") for f in features.NAMES),
+    ("gaze_x", "<f4"), ("gaze_y", "<f4"), ("screen_w", "<f4"), ("screen_h", "<f4"),
+])
+GAZE_DTYPE = np.dtype([
+    ("timestamp", "<f8"),
+    ("gaze_x", "<f4"), ("gaze_y", "<f4"), ("screen_w", "<f4"), ("screen_h", "<f4"),
+])
+GAZE_VALUES = ("gaze_x", "gaze_y", "screen_w", "screen_h")
+
+# unix seconds a datetime can hold, 1970-01-01 up to the end of year 9999
+MIN_UNIX_SECONDS = 0.0
+MAX_UNIX_SECONDS = 253402300799.0
+
+class UnsupportedPayload(Exception):
+    """The body's content type can't be decoded here (answer 415)."""
+
+
+def _check_version(request):
+    version = request.content_params.get("v", "1")
+    if version != "1":
+        raise UnsupportedPayload(f"unsupported {request.content_type} version {version!r}")
+
+
+def _msgpack():
+    try:
+        import msgpack
+    except ImportError:
+        raise UnsupportedPayload("application/msgpack needs the msgpack package on the server")
+    return msgpack
+
+
+def load(request):
+    """Decode a JSON or MessagePack body into Python objects."""
+    if request.content_type == MSGPACK_TYPE:
+        try:
+            return _msgpack().unpackb(request.body, raw=False)
+        except (ValueError, TypeError) as exc:
+            raise ValueError(f"invalid msgpack: {exc}")
+    return json.loads(request.body)
+
+
+def decode_heartbeat(request):
+    """
+    Decode an x-flow-heartbeat body into an unsaved BiometricRecord, its
+    Windows and the raw float32 feature vector.
+    """
+    _check_version(request)
+    body = request.body
+    if len(body) < HEARTBEAT_DTYPE.itemsize:
+        raise ValueError(f"heartbeat struct is {HEARTBEAT_DTYPE.itemsize} bytes, got {len(body)}")
+
+    row = np.frombuffer(body, HEARTBEAT_DTYPE, count=1)
+    X = structured_to_unstructured(row[list(features.NAMES)], dtype=np.float32)
+    errors = features.validate(X)
+    if errors:
+        raise ValueError(errors[0])
+    timestamp = unix_datetime(float(row["timestamp"][0]))
+    record = BiometricRecord(
+        timestamp=timestamp,
+        **features.row_fields(X[0]),
+        **{f: float(row[f][0]) for f in GAZE_VALUES},
+    )
+
+    tail = body[HEARTBEAT_DTYPE.itemsize:]
+    tasks = json.loads(tail) if tail.strip() else []
+    if not isinstance(tasks, list):
+        raise ValueError("heartbeat tail must be a JSON array of tasks")
+    return record, [Window.from_dict(t) for t in tasks], X[0]
+
+
+def decode_gaze(request):
+    """Decode an x-flow-gaze body into a GAZE_DTYPE structured array (no copy)."""
+    _check_version(request)
+    body = request.body
+    if len(body) % GAZE_DTYPE.itemsize:
+        raise ValueError(f"gaze body must be a multiple of {GAZE_DTYPE.itemsize} bytes")
+    return np.frombuffer(body, GAZE_DTYPE)
+
+
+def _in_range(epoch_seconds):
+    return (epoch_seconds >= MIN_UNIX_SECONDS) & (epoch_seconds <= MAX_UNIX_SECONDS)
+
+
+def unix_datetime(seconds):
+    """Aware UTC datetime for unix seconds; ValueError when not finite or out of range."""
+    if isinstance(seconds, bool) or not isinstance(seconds, (int, float)):
+        raise ValueError("timestamp must be a unix time in seconds")
+    if not _in_range(seconds):     # False for NaN as well
+        raise ValueError("timestamp is out of range")
+    return datetime.fromtimestamp(seconds, tz=dt_timezone.utc)
+
+
+def _datetimes(epoch_seconds):
+    us = np.round(np.asarray(epoch_seconds, dtype=np.float64) * 1e6).astype("datetime64[us]")
+    return [t.replace(tzinfo=dt_timezone.utc) for t in us.tolist()]
+
+
+def gaze_records(samples):
+    """
+    Validate a GAZE_DTYPE array column-wise; returns (unsaved GazeRecords,
+    per-index errors) like the JSON path.
+    """
+    values = structured_to_unstructured(samples[["timestamp", *GAZE_VALUES]], dtype=np.float64)
+    finite = np.isfinite(values).all(axis=1)
+    ok = finite & _in_range(values[:, 0])
+    errors = [
+        {"index": int(i), "error": "non-finite value" if not finite[i] else "timestamp is out of range"}
+        for i in np.flatnonzero(~ok)
+    ]
+    good = values[ok]
+    records = [
+        GazeRecord(timestamp=ts, gaze_x=x, gaze_y=y, screen_w=w, screen_h=h)
+        for ts, (x, y, w, h) in zip(_datetimes(good[:, 0]), good[:, 1:].tolist())
+    ]
+    return records, errors
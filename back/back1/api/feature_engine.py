@@ -0,0 +1,234 @@
+"""
+Per-session rolling features for the flow model.
+
+Each session keeps a ring buffer of its last FLOW_FEATURE_WINDOW heartbeats
+and updates rolling mean, standard deviation, EWMA and linear trend for
+all model inputs in O(1) per heartbeat (sliding Welford updates, so no
+re-summing of the window and no history queries to the database). Gaze
+samples received between two heartbeats are summarised into dispersion,
+fixation ratio and mean velocity, then run through the session's
+fixation detector (api/gaze_analysis.py) for fixation, saccade and
+screen-region dwell metrics. Both are appended to the vector.
+
+The extended vector starts with the raw features in features.NAMES order,
+so a model trained on the 10 raw inputs keeps working: the inference code
+only feeds it as many leading columns as its input declares.
+"""
+import copy
+import threading
+from collections import OrderedDict, deque
+
+import numpy as np
+from django.conf import settings
+
+from . import features, gaze_analysis
+
+N_RAW = features.N_FEATURES
+
+GAZE_FEATURES = ("gaze_samples", "gaze_dispersion", "gaze_fixation_ratio", "gaze_mean_velocity")
+
+EXTENDED_FEATURES = (
+    *features.NAMES,
+    *(f"{f}_mean" for f in features.NAMES),
+    *(f"{f}_ewma" for f in features.NAMES),
+    *(f"{f}_std" for f in features.NAMES),
+    *(f"{f}_trend" for f in features.NAMES),
+    *GAZE_FEATURES,
+    *gaze_analysis.METRICS,
+)
+
+
+class RollingWindow:
+    """Sliding mean / variance / EWMA / slope over the last ``size`` vectors."""
+
+    def __init__(self, size, width, alpha):
+        self.size = size
+        self.alpha = alpha
+        self.buf = np.zeros((size, width))
+        self.n = 0
+        self.t = 0          # absolute index of the next row
+        self.pos = 0        # ring buffer slot of the next row
+
+        self.mean = np.zeros(width)
+        self.m2 = np.zeros(width)       # sum of squared deviations
+        self.mean_t = 0.0
+        self.cov_ty = np.zeros(width)   # co-moment of (t, x)
+        self.ewma = None
+
+    def _add(self, t, x):
+        self.n += 1
+        dt = t - self.mean_t
+        self.mean_t += dt / self.n
+        dx = x - self.mean
+        self.mean += dx / self.n
+        self.m2 += dx * (x - self.mean)
+        self.cov_ty += dt * (x - self.mean)
+
+    def _remove(self, t, x):
+        if self.n == 1:
+            self.n = 0
+            self.mean_t = 0.0
+            self.mean[:] = 0.0
+            self.m2[:] = 0.0
+            self.cov_ty[:] = 0.0
+            return
+        self.n -= 1
+        dx = x - self.mean
+        self.mean -= dx / self.n
+        self.m2 -= dx * (x - self.mean)
+        dt = t - self.mean_t
+        self.mean_t -= dt / self.n
+        self.cov_ty -= dt * (x - self.mean)
+
+    def push(self, x):
+        x = np.asarray(x, dtype=np.float64)
+        if self.n == self.size:
+            self._remove(self.t - self.size, self.buf[self.pos])
+        self.buf[self.pos] = x
+        self._add(self.t, x)
+        self.pos = (self.pos + 1) % self.size
+        self.t += 1
+        self.ewma = x.copy() if self.ewma is None else self.alpha * x + (1 - self.alpha) * self.ewma
+
+    def copy(self):
+        clone = copy.copy(self)
+        # the arrays push() updates in place; ewma is replaced, not updated
+        for name in ("buf", "mean", "m2", "cov_ty"):
+            setattr(clone, name, getattr(self, name).copy())
+        return clone
+
+    def std(self):
+        return np.sqrt(np.maximum(self.m2 / self.n, 0.0)) if self.n else np.zeros_like(self.mean)
+
+    def trend(self):
+        """Least-squares slope per heartbeat over the window."""
+        if self.n < 2:
+            return np.zeros_like(self.mean)
+        # sum of (t - mean_t)^2 for n consecutive integers
+        var_t = self.n * (self.n * self.n - 1) / 12.0
+        return self.cov_ty / var_t
+
+
+def summarize_gaze(samples, fixation_velocity):
+    """
+    Aggregate (t, x, y, w, h) gaze samples collected since the last heartbeat.
+
+    Positions are normalised by screen size; velocity is in screen
+    fractions per second and samples below ``fixation_velocity`` count
+    as fixation.
+    """
+    if not samples:
+        return np.zeros(len(GAZE_FEATURES))
+    arr = np.asarray(samples, dtype=np.float64)
+    t = arr[:, 0]
+    w = np.where(arr[:, 3] > 0, arr[:, 3], 1.0)
+    h = np.where(arr[:, 4] > 0, arr[:, 4], 1.0)
+    x = arr[:, 1] / w
+    y = arr[:, 2] / h
+
+    dispersion = float(np.sqrt(x.var() + y.var()))
+    if len(arr) < 2:
+        return np.array([len(arr), dispersion, 1.0, 0.0])
+
+    dt = np.diff(t)
+    dt = np.where(dt > 0, dt, np.nan)
+    velocity = np.hypot(np.diff(x), np.diff(y)) / dt
+    velocity = velocity[np.isfinite(velocity)]
+    if not len(velocity):
+        return np.array([len(arr), dispersion, 1.0, 0.0])
+    return np.array([
+        len(arr),
+        dispersion,
+        float(np.mean(velocity < fixation_velocity)),
+        float(velocity.mean()),
+    ])
+
+
+class _Session:
+    __slots__ = ("window", "gaze", "fixations")
+
+    def __init__(self, window_size, alpha, gaze_max, fixation_params):
+        self.window = RollingWindow(window_size, N_RAW, alpha)
+        self.gaze = deque(maxlen=gaze_max)
+        self.fixations = gaze_analysis.FixationStream(fixation_params)
+
+
+class FeatureEngine:
+    def __init__(self, window_size=12, alpha=0.3, max_sessions=1000,
+                 gaze_max=4096, fixation_velocity=0.5, fixation_params=None):
+        self.window_size = window_size
+        self.alpha = alpha
+        self.max_sessions = max_sessions
+        self.gaze_max = gaze_max
+        self.fixation_velocity = fixation_velocity
+        self.fixation_params = fixation_params or gaze_analysis.Params(velocity=fixation_velocity)
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            window_size=settings.FLOW_FEATURE_WINDOW,
+            alpha=settings.FLOW_FEATURE_EWMA_ALPHA,
+            max_sessions=settings.FLOW_FEATURE_MAX_SESSIONS,
+            fixation_velocity=settings.FLOW_FIXATION_VELOCITY,
+            fixation_params=gaze_analysis.Params.from_settings(),
+        )
+
+    def _session(self, key):
+        # caller holds the lock; least recently used sessions are dropped
+        session = self._sessions.get(key)
+        if session is None:
+            session = _Session(self.window_size, self.alpha, self.gaze_max, self.fixation_params)
+            self._sessions[key] = session
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        else:
+            self._sessions.move_to_end(key)
+        return session
+
+    def add_gaze(self, key, samples):
+        """Buffer (t, x, y, screen_w, screen_h) samples until the next heartbeat."""
+        with self._lock:
+            self._session(key).gaze.extend(samples)
+
+    def snapshot(self, key):
+        """
+        The session's state, for restore() when the heartbeats fed after it
+        turn out not to be stored (a replayed duplicate).
+        """
+        with self._lock:
+            session = self._session(key)
+            return session.window.copy(), list(session.gaze), session.fixations.tail, session.fixations.previous
+
+    def restore(self, key, state):
+        """Undo the update()s since snapshot(); gaze they consumed is buffered again."""
+        window, gaze, tail, previous = state
+        with self._lock:
+            session = self._session(key)
+            newer = list(session.gaze)
+            session.window = window
+            session.gaze.clear()
+            session.gaze.extend(gaze + newer)
+            session.fixations.tail, session.fixations.previous = tail, previous
+
+    def update(self, key, raw):
+        """Push one heartbeat's raw features and return the extended float32 vector."""
+        with self._lock:
+            session = self._session(key)
+            w = session.window
+            w.push(raw)
+            samples = list(session.gaze)
+            gaze = summarize_gaze(samples, self.fixation_velocity)
+            fixations = session.fixations.metrics(samples)
+            session.gaze.clear()
+            return np.concatenate([
+                w.buf[(w.pos - 1) % w.size], w.mean, w.ewma, w.std(), w.trend(), gaze, fixations,
+            ]).astype(np.float32)
+
+    def stats(self):
+        with self._lock:
+            return {"sessions": len(self._sessions), "width": len(EXTENDED_FEATURES)}
+
+
+engine = FeatureEngine.from_settings()
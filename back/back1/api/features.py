@@ -0,0 +1,175 @@
+"""
+The flow model's input schema, declared once.
+
+FEATURES lists the 10 model inputs in the column order the ONNX graph
+expects. For each it gives where the input sits in a JSON heartbeat,
+whether it is stored as an integer, and its valid range. Everything that
+builds or reads feature vectors goes through this module, so the order
+can't drift between the views, the binary codec, inference, re-scoring
+and the training export:
+
+- ``decode()`` turns one or many heartbeat dicts into an N x 10 float32
+  matrix. It gathers one column at a time, not one field per row, and
+  converts the whole batch in one numpy call. It also keeps the decoded
+  values, so records store exactly what was sent, not float32-rounded
+  numbers.
+- ``validate()`` checks a whole matrix at once: finite, in range.
+- ``from_rows()`` builds the same matrix from ``values_list(*NAMES)`` rows.
+- ``row_fields()`` gives the model field values of one matrix row, for
+  the binary struct that only carries float32.
+
+Integer columns are stored truncated, like the old ``int()`` casts.
+
+Missing inputs are 0, as they always were.
+"""
+from typing import NamedTuple
+
+import numpy as np
+
+INT32_MAX = 2 ** 31 - 1
+FLOAT32_MAX = float(np.finfo(np.float32).max)
+
+
+class Feature(NamedTuple):
+    name: str
+    path: tuple         # keys leading to the value in a JSON heartbeat
+    integer: bool       # stored in an IntegerField
+    low: float
+    high: float
+
+
+FEATURES = (
+    Feature("mean_iki_ms", ("typing", "mean_iki_ms"), False, 0, FLOAT32_MAX),
+    Feature("variance_iki", ("typing", "variance_iki"), False, 0, FLOAT32_MAX),
+    Feature("burstiness", ("typing", "burstiness"), False, 0, FLOAT32_MAX),
+    Feature("total_keys", ("typing", "total_keys"), True, 0, INT32_MAX),
+    Feature("backspace_rate", ("typing", "backspace_rate"), False, 0, 1),
+    Feature("backspaces", ("typing", "backspaces"), True, 0, INT32_MAX),
+    Feature("distance_px", ("mouse", "distance_px"), True, 0, INT32_MAX),
+    Feature("click_rate_per_sec", ("mouse", "click_rate_per_sec"), False, 0, FLOAT32_MAX),
+    Feature("mouse_clicks", ("mouse", "mouse_clicks"), True, 0, INT32_MAX),
+    Feature("idle_time_ms", ("idle_time_ms",), True, 0, INT32_MAX),
+)
+
+NAMES = tuple(f.name for f in FEATURES)
+N_FEATURES = len(FEATURES)
+INTEGER = np.array([f.integer for f in FEATURES])
+LOW = np.array([f.low for f in FEATURES], dtype=np.float64)
+HIGH = np.array([f.high for f in FEATURES], dtype=np.float64)
+
+_NUMBER = {int, float}
+SECTIONS = tuple(sorted({f.path[0] for f in FEATURES if len(f.path) > 1}))
+
+
+def empty(n):
+    """A preallocated N x 10 float32 matrix."""
+    return np.zeros((n, N_FEATURES), dtype=np.float32)
+
+
+def _column(payloads, path):
+    """One input across all payloads; 0 where it is missing."""
+    if len(path) == 1:
+        key = path[0]
+        return [p.get(key, 0) for p in payloads]
+    outer, key = path
+    return [p.get(outer, {}).get(key, 0) for p in payloads]
+
+
+class Batch(NamedTuple):
+    """Decoded heartbeats: the float32 model matrix plus what storage needs."""
+    X: np.ndarray       # N x 10 float32, FEATURES order
+    columns: list       # decoded values per feature, as sent
+    errors: dict        # row index -> message; those rows are zeroed
+
+    def fields(self, i):
+        """{field name: value} for row ``i``."""
+        return {
+            f.name: int(col[i]) if f.integer else float(col[i])
+            for f, col in zip(FEATURES, self.columns)
+        }
+
+
+def decode(payloads, out=None):
+    """
+    Decode heartbeat dicts into a Batch. Inputs are gathered a column at a
+    time, then converted into the float32 matrix (``out`` when given) in one
+    go. Rows with a non-numeric, non-finite or out-of-range input are listed
+    in ``errors``; callers reject them.
+    """
+    X = empty(len(payloads)) if out is None else out
+    errors = {}
+    for i, p in enumerate(payloads):
+        if not isinstance(p, dict):
+            errors[i] = "heartbeat must be an object"
+            continue
+        for section in SECTIONS:
+            if not isinstance(p.get(section, {}), dict):
+                errors.setdefault(i, f"{section} must be an object")
+    if errors:
+        payloads = [{} if i in errors else p for i, p in enumerate(payloads)]
+
+    columns = []
+    for feature in FEATURES:
+        values = _column(payloads, feature.path)
+        if not set(map(type, values)) <= _NUMBER:
+            # exact types: bool is an int subclass but never a valid input
+            for i, v in enumerate(values):
+                if type(v) not in _NUMBER:
+                    errors.setdefault(i, f"{feature.name} must be a number")
+                    values[i] = 0
+        columns.append(values)
+
+    # one conversion for the whole batch; float64 so the range check is exact
+    try:
+        X64 = np.array(columns, dtype=np.float64).T
+    except OverflowError:
+        # an int beyond float64
+        for feature, values in zip(FEATURES, columns):
+            for i, v in enumerate(values):
+                if abs(v) > feature.high:
+                    errors.setdefault(i, f"{feature.name} is out of range or not finite")
+                    values[i] = 0
+        X64 = np.array(columns, dtype=np.float64).T
+    X64 = X64.reshape(len(payloads), N_FEATURES)
+
+    for i, message in validate(X64).items():
+        errors.setdefault(i, message)
+    if errors:
+        X64[list(errors)] = 0
+    X[:] = X64
+    return Batch(X, columns, errors)
+
+
+def validate(X):
+    """{row index: message} for rows with a non-finite or out-of-range input."""
+    bad = ~np.isfinite(X) | (X < LOW) | (X > HIGH)
+    if not bad.any():
+        return {}
+    rows = np.flatnonzero(bad.any(axis=1))
+    return {
+        int(i): f"{NAMES[int(np.argmax(bad[i]))]} is out of range or not finite"
+        for i in rows
+    }
+
+
+def decode_one(payload):
+    """(float32 vector, field values) for one heartbeat dict; ValueError when invalid."""
+    batch = decode([payload])
+    if batch.errors:
+        raise ValueError(batch.errors[0])
+    return batch.X[0], batch.fields(0)
+
+
+def from_rows(rows, offset=0):
+    """N x 10 float32 matrix from DB rows whose features start at column ``offset``."""
+    X = np.array([r[offset:offset + N_FEATURES] for r in rows], dtype=np.float32)
+    return X.reshape(-1, N_FEATURES)
+
+
+def row_fields(row):
+    """{field name: value} for one matrix row, integer columns as ints."""
+    values = row.tolist()
+    return {
+        f.name: int(v) if f.integer else v
+        for f, v in zip(FEATURES, values)
+    }
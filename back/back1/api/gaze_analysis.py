@@ -0,0 +1,314 @@
+"""
+Fixation and saccade detection over gaze samples.
+
+Samples are (t, x, y, screen_w, screen_h) rows. Positions are normalised
+by screen size, so thresholds and amplitudes are in screen fractions and
+mean the same thing on every display. Two detectors:
+
+``ivt``  velocity threshold. A sample is part of a fixation when the gaze
+         speed around it (a central difference over
+         FLOW_FIXATION_VELOCITY_WINDOW_MS, which smooths tracker noise) is
+         below FLOW_FIXATION_VELOCITY.
+``idt``  dispersion threshold. A fixation is the longest run of at least
+         FLOW_FIXATION_MIN_MS whose (max x - min x) + (max y - min y) stays
+         within FLOW_FIXATION_DISPERSION.
+
+Both drop fixations shorter than FLOW_FIXATION_MIN_MS. A tracking gap
+longer than FLOW_GAZE_MAX_GAP_MS ends a fixation. A saccade is the move
+between two consecutive fixations that are at most FLOW_SACCADE_MAX_MS
+apart. Its amplitude is the distance between their centroids.
+
+Everything is column-wise NumPy. The only Python loop is I-DT's, and it
+runs once per fixation, not once per sample: which samples can start a
+fixation is decided for all of them at once (range min/max from a sparse
+table), and the loop jumps from one such start to the next.
+
+``FixationStream`` runs a detector over consecutive batches of one gaze
+stream. A fixation still going on at the end of a batch is held back and
+completed with the next batch, so each fixation is reported once, in the
+batch where it ends. ``window_metrics`` turns fixations and saccades into
+the per-window METRICS: counts, mean fixation duration, mean saccade
+amplitude, and the share of fixation time spent in each cell of a 3x3
+screen grid (the same regions as gaze_rollup).
+"""
+from typing import NamedTuple
+
+import numpy as np
+from django.conf import settings
+
+from .gaze_rollup import GRID
+
+METHODS = ("ivt", "idt")
+
+FIXATION_DTYPE = np.dtype([
+    ("start", "f8"), ("end", "f8"),     # unix seconds
+    ("x", "f4"), ("y", "f4"),           # centroid, screen fractions
+    ("samples", "i4"),
+])
+SACCADE_DTYPE = np.dtype([("start", "f8"), ("end", "f8"), ("amplitude", "f4")])
+
+REGIONS = tuple(f"dwell_r{r}c{c}" for r in range(GRID) for c in range(GRID))
+METRICS = ("fixation_count", "fixation_mean_ms", "saccade_count", "saccade_mean_amplitude", *REGIONS)
+
+
+class Params(NamedTuple):
+    method: str = "ivt"
+    velocity: float = 0.5           # screen fractions / s
+    velocity_window: float = 0.08   # s
+    dispersion: float = 0.1         # screen fractions, x and y spread added
+    min_duration: float = 0.1       # s
+    max_gap: float = 0.1            # s
+    max_saccade: float = 0.5        # s
+
+    @classmethod
+    def from_settings(cls, **overrides):
+        params = cls(
+            method=settings.FLOW_FIXATION_METHOD,
+            velocity=settings.FLOW_FIXATION_VELOCITY,
+            velocity_window=settings.FLOW_FIXATION_VELOCITY_WINDOW_MS / 1000,
+            dispersion=settings.FLOW_FIXATION_DISPERSION,
+            min_duration=settings.FLOW_FIXATION_MIN_MS / 1000,
+            max_gap=settings.FLOW_GAZE_MAX_GAP_MS / 1000,
+            max_saccade=settings.FLOW_SACCADE_MAX_MS / 1000,
+        )._replace(**overrides)
+        if params.method not in METHODS:
+            raise ValueError(f"fixation method must be one of {', '.join(METHODS)}")
+        return params
+
+
+def normalise(samples):
+    """(t, x, y) float64 columns from (t, x, y, w, h) rows, sorted by time."""
+    arr = np.asarray(samples, dtype=np.float64).reshape(-1, 5)
+    if len(arr) > 1 and np.any(np.diff(arr[:, 0]) < 0):
+        arr = arr[np.argsort(arr[:, 0], kind="stable")]
+    w = np.where(arr[:, 3] > 0, arr[:, 3], 1.0)
+    h = np.where(arr[:, 4] > 0, arr[:, 4], 1.0)
+    return arr[:, 0], arr[:, 1] / w, arr[:, 2] / h
+
+
+def _gaps(t, max_gap):
+    """gap[i] is True when samples i and i+1 are further apart than max_gap."""
+    return np.diff(t) > max_gap
+
+
+def _ivt(t, x, y, p):
+    n = len(t)
+    gap = _gaps(t, p.max_gap)
+    # central difference over about velocity_window, clipped at the ends
+    dt = np.median(np.diff(t)) if n > 1 else 0.0
+    half = max(1, int(round(p.velocity_window / dt / 2))) if dt > 0 else 1
+    idx = np.arange(n)
+    lo = np.maximum(idx - half, 0)
+    hi = np.minimum(idx + half, n - 1)
+    span = t[hi] - t[lo]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        speed = np.hypot(x[hi] - x[lo], y[hi] - y[lo]) / span
+    slow = np.isfinite(speed) & (speed < p.velocity)
+
+    # runs of slow samples not interrupted by a gap
+    joined = slow[:-1] & slow[1:] & ~gap
+    starts = np.flatnonzero(slow & ~np.r_[False, joined])
+    ends = np.flatnonzero(slow & ~np.r_[joined, False])
+    return starts, ends
+
+
+def _range_ptp(v, lo, hi):
+    """
+    max - min of ``v[lo[k]:hi[k] + 1]`` for every k, from a sparse table
+    of power-of-two windows. Loops over the log2 levels, not the ranges.
+    """
+    level = np.log2(hi - lo + 1).astype(np.int64)
+    highs, lows = [v], [v]
+    for step in (1 << np.arange(int(level.max(initial=0)))):
+        highs.append(np.maximum(highs[-1][:-step], highs[-1][step:]))
+        lows.append(np.minimum(lows[-1][:-step], lows[-1][step:]))
+    out = np.empty(len(lo))
+    for k in np.unique(level):
+        sel = level == k
+        a, b = lo[sel], hi[sel] - (1 << int(k)) + 1
+        out[sel] = np.maximum(highs[k][a], highs[k][b]) - np.minimum(lows[k][a], lows[k][b])
+    return out
+
+
+def _idt(t, x, y, p):
+    n = len(t)
+    # last index reachable from each gap-free segment
+    breaks = np.flatnonzero(_gaps(t, p.max_gap))
+    seg_last = np.r_[breaks, n - 1]
+    limits = seg_last[np.searchsorted(seg_last, np.arange(n))]
+
+    # every sample whose FLOW_FIXATION_MIN_MS window fits before the gap
+    # and stays within the dispersion can start a fixation; test them all
+    # at once, then jump from one candidate to the next
+    first = np.searchsorted(t, t + p.min_duration)
+    fits = np.flatnonzero(first <= limits)
+    spread = _range_ptp(x, fits, first[fits]) + _range_ptp(y, fits, first[fits])
+    candidates = fits[spread <= p.dispersion]
+
+    starts, ends = [], []
+    c = 0
+    while c < len(candidates):
+        i = int(candidates[c])
+        limit, j = limits[i], first[i]
+        # grow while the running spread stays within the threshold, in
+        # doubling chunks so a long segment isn't scanned per fixation
+        k, size = i, max(64, 4 * (j - i + 1))
+        bounds = (x[i], x[i], y[i], y[i])
+        while True:
+            stop = min(limit, k + size - 1)
+            x_hi = np.maximum(np.maximum.accumulate(x[k:stop + 1]), bounds[0])
+            x_lo = np.minimum(np.minimum.accumulate(x[k:stop + 1]), bounds[1])
+            y_hi = np.maximum(np.maximum.accumulate(y[k:stop + 1]), bounds[2])
+            y_lo = np.minimum(np.minimum.accumulate(y[k:stop + 1]), bounds[3])
+            over = np.flatnonzero(x_hi - x_lo + y_hi - y_lo > p.dispersion)
+            if len(over):
+                end = k + int(over[0]) - 1
+                break
+            if stop == limit:
+                end = limit
+                break
+            bounds = (x_hi[-1], x_lo[-1], y_hi[-1], y_lo[-1])
+            k, size = stop + 1, size * 2
+        starts.append(i)
+        ends.append(end)
+        c = int(np.searchsorted(candidates, end + 1))
+    return np.asarray(starts, dtype=np.int64), np.asarray(ends, dtype=np.int64)
+
+
+def detect(t, x, y, params):
+    """
+    Fixations in normalised (t, x, y) columns: a FIXATION_DTYPE array plus
+    the (start, end) sample index of each, both ordered by time.
+    """
+    if len(t) < 2:
+        empty = np.zeros(0, dtype=np.int64)
+        return np.zeros(0, FIXATION_DTYPE), empty, empty
+    starts, ends = (_ivt if params.method == "ivt" else _idt)(t, x, y, params)
+    keep = t[ends] - t[starts] >= params.min_duration
+    starts, ends = starts[keep], ends[keep]
+
+    # centroids from prefix sums: one pass however many fixations there are
+    cx = np.r_[0.0, np.cumsum(x)]
+    cy = np.r_[0.0, np.cumsum(y)]
+    count = ends - starts + 1
+    out = np.zeros(len(starts), FIXATION_DTYPE)
+    out["start"] = t[starts]
+    out["end"] = t[ends]
+    out["x"] = (cx[ends + 1] - cx[starts]) / count
+    out["y"] = (cy[ends + 1] - cy[starts]) / count
+    out["samples"] = count
+    return out, starts, ends
+
+
+def saccades(fixations, params, previous=None):
+    """Moves between consecutive fixations; ``previous`` is the fixation before the first."""
+    if previous is not None:
+        fixations = np.concatenate([np.asarray([previous], FIXATION_DTYPE), fixations])
+    a, b = fixations[:-1], fixations[1:]
+    keep = b["start"] - a["end"] <= params.max_saccade
+    out = np.zeros(int(keep.sum()), SACCADE_DTYPE)
+    out["start"] = a["end"][keep]
+    out["end"] = b["start"][keep]
+    out["amplitude"] = np.hypot(b["x"][keep] - a["x"][keep], b["y"][keep] - a["y"][keep])
+    return out
+
+
+def window_metrics(fixations, saccade_list, fixation_window, saccade_window, n_windows):
+    """
+    METRICS for ``n_windows`` windows: one row per window, given the window
+    index of each fixation and saccade (both assigned by their end).
+    """
+    out = np.zeros((n_windows, len(METRICS)))
+    duration = (fixations["end"] - fixations["start"]).astype(np.float64)
+    n_fix = np.bincount(fixation_window, minlength=n_windows)
+    fix_time = np.bincount(fixation_window, weights=duration, minlength=n_windows)
+    n_sac = np.bincount(saccade_window, minlength=n_windows)
+    amplitude = np.bincount(saccade_window, weights=saccade_list["amplitude"].astype(np.float64),
+                            minlength=n_windows)
+
+    out[:, 0] = n_fix
+    out[:, 1] = np.divide(fix_time * 1000, n_fix, out=np.zeros(n_windows), where=n_fix > 0)
+    out[:, 2] = n_sac
+    out[:, 3] = np.divide(amplitude, n_sac, out=np.zeros(n_windows), where=n_sac > 0)
+
+    if len(fixations):
+        col = np.clip((fixations["x"] * GRID).astype(np.int64), 0, GRID - 1)
+        row = np.clip((fixations["y"] * GRID).astype(np.int64), 0, GRID - 1)
+        cells = fixation_window * GRID * GRID + row * GRID + col
+        dwell = np.bincount(cells, weights=duration, minlength=n_windows * GRID * GRID)
+        dwell = dwell.reshape(n_windows, GRID * GRID)
+        out[:, 4:] = np.divide(dwell, fix_time[:, None], out=np.zeros_like(dwell),
+                               where=fix_time[:, None] > 0)
+    return out
+
+
+def analyse(samples, params, window, since=None):
+    """
+    Fixations, saccades and per-window METRICS for a stored range of
+    samples. Windows are ``window`` seconds long, starting at ``since``
+    (default: the first sample).
+    """
+    t, x, y = normalise(samples)
+    fixations, _, _ = detect(t, x, y, params)
+    moves = saccades(fixations, params)
+    if not len(t):
+        return fixations, moves, np.zeros((0, len(METRICS))), 0.0
+    origin = t[0] if since is None else since
+    n_windows = max(1, int((t[-1] - origin) // window) + 1)
+    index = lambda ends: np.clip(((ends - origin) // window).astype(np.int64), 0, n_windows - 1)
+    table = window_metrics(fixations, moves, index(fixations["end"]), index(moves["end"]), n_windows)
+    return fixations, moves, table, origin
+
+
+class FixationStream:
+    """Fixation detection over consecutive batches of one gaze stream."""
+
+    # a fixation longer than this many samples is cut rather than held back forever
+    MAX_TAIL = 4096
+
+    def __init__(self, params):
+        self.params = params
+        self.tail = np.zeros((0, 5))
+        self.previous = None    # last reported fixation, for the first saccade of a batch
+
+    def feed(self, samples):
+        """
+        Add (t, x, y, w, h) samples. Returns (fixations, saccades) that ended
+        in this batch.
+        """
+        samples = np.asarray(samples, dtype=np.float64).reshape(-1, 5)
+        arr = np.vstack([self.tail, samples]) if len(self.tail) else samples
+        if len(arr) > 1 and np.any(np.diff(arr[:, 0]) < 0):
+            arr = arr[np.argsort(arr[:, 0], kind="stable")]
+        t, x, y = normalise(arr)
+        fixations, starts, ends = detect(t, x, y, self.params)
+
+        # keep enough samples to finish a fixation that is still short, or
+        # still going on at the last sample
+        cut = int(np.searchsorted(t, t[-1] - self.params.min_duration - self.params.velocity_window)) if len(t) else 0
+        if len(fixations) and ends[-1] == len(t) - 1 and len(arr) - starts[-1] <= self.MAX_TAIL:
+            cut = min(cut, int(starts[-1]))
+            fixations, ends = fixations[:-1], ends[:-1]
+        if len(ends):
+            cut = max(cut, int(ends[-1]) + 1)
+        self.tail = arr[cut:][-self.MAX_TAIL:]
+
+        moves = saccades(fixations, self.params, self.previous)
+        if len(fixations):
+            self.previous = fixations[-1]
+        return fixations, moves
+
+    def metrics(self, samples):
+        """METRICS for the fixations and saccades that ended in this batch."""
+        fixations, moves = self.feed(samples)
+        return window_metrics(
+            fixations, moves,
+            np.zeros(len(fixations), dtype=np.int64), np.zeros(len(moves), dtype=np.int64), 1,
+        )[0]
+
+
+def fixation_payload(fixations):
+    return [
+        {"start": s, "end": e, "duration_ms": (e - s) * 1000, "x": x, "y": y, "samples": n}
+        for s, e, x, y, n in fixations.tolist()
+    ]
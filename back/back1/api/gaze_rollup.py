@@ -0,0 +1,316 @@
+"""
+Retention tiers for gaze data.
+
+Raw GazeRecord rows are rolled up into per-second (GazeSecond) and
+per-minute (GazeMinute) buckets per device and user. Buckets store sums
+(count, x, y, x², y²) and a 3x3 screen-region histogram, so late samples
+and minute roll-ups merge by adding. Mean position and dispersion are
+derived when read.
+
+``rollup()`` walks raw rows past a RollupState high-water id, so it can run
+as often as wanted (cron, ``manage.py rollup_gaze``). Ids are not commit
+order: on Postgres a transaction can commit a lower id after a higher one
+was read. So the mark only moves over rows received more than
+FLOW_ROLLUP_LAG_S ago, and stops below the first younger row (see
+``settled()``); a transaction still open after the lag is the one case it
+can miss. ``prune()`` deletes
+rolled-up raw rows older than FLOW_GAZE_RAW_RETENTION_DAYS and second
+buckets older than FLOW_GAZE_SECOND_RETENTION_DAYS in small batches, each
+in its own short transaction. Minute buckets are kept.
+
+``query_range()`` answers a time range from the cheapest tier that covers
+it at a useful resolution. Raw rows not rolled up yet are aggregated on
+the fly, so aggregate tiers don't lag behind ingestion.
+"""
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import numpy as np
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Min, Q
+from django.utils import timezone
+
+from .models import GazeMinute, GazeRecord, GazeSecond, RollupState
+
+GRID = 3
+ROLLUP_NAME = "gaze"
+TIERS = {"second": (GazeSecond, 1), "minute": (GazeMinute, 60)}
+
+SOURCE_FIELDS = ("id", "timestamp", "device_id", "user_id", "gaze_x", "gaze_y", "screen_w", "screen_h")
+RAW_FIELDS = ("id", "timestamp", "gaze_x", "gaze_y", "screen_w", "screen_h")
+
+# columns of a stats row: count, sum_x, sum_y, sum_xx, sum_yy, screen_w, screen_h, regions...
+SUM_FIELDS = ("count", "sum_x", "sum_y", "sum_xx", "sum_yy")
+MAX_COLS = [5, 6]   # screen size: kept as the max, not summed
+N_STATS = 7 + GRID * GRID
+STAT_FIELDS = (*SUM_FIELDS, "screen_w", "screen_h", "regions")
+
+
+def _row_stats(x, y, w, h):
+    """One stats row per sample."""
+    stats = np.zeros((len(x), N_STATS))
+    stats[:, 0] = 1
+    stats[:, 1] = x
+    stats[:, 2] = y
+    stats[:, 3] = x * x
+    stats[:, 4] = y * y
+    stats[:, 5] = w
+    stats[:, 6] = h
+    cx = np.clip((x / np.where(w > 0, w, 1) * GRID).astype(np.int64), 0, GRID - 1)
+    cy = np.clip((y / np.where(h > 0, h, 1) * GRID).astype(np.int64), 0, GRID - 1)
+    stats[np.arange(len(x)), 7 + cy * GRID + cx] = 1
+    return stats
+
+
+def _combine(keys, stats):
+    """Merge stats rows with equal (device, user, bucket) keys."""
+    if not len(keys):
+        return keys, stats
+    order = np.lexsort(keys.T[::-1])
+    keys, stats = keys[order], stats[order]
+    starts = np.flatnonzero(np.r_[True, np.any(keys[1:] != keys[:-1], axis=1)])
+    out = np.add.reduceat(stats, starts, axis=0)
+    out[:, MAX_COLS] = np.maximum.reduceat(stats[:, MAX_COLS], starts, axis=0)
+    return keys[starts], out
+
+
+def aggregate(rows, width):
+    """
+    Bucket raw rows (SOURCE_FIELDS order) into ``width``-second buckets.
+
+    Returns (keys, stats): keys is an int64 (n, 3) array of
+    (device_id, user_id, bucket epoch) with -1 for a missing id.
+    """
+    if not rows:
+        return np.zeros((0, 3), dtype=np.int64), np.zeros((0, N_STATS))
+    _, ts, dev, usr, x, y, w, h = zip(*rows)
+    epoch = np.array([t.timestamp() for t in ts])
+    keys = np.column_stack([
+        np.array([-1 if d is None else d for d in dev], dtype=np.int64),
+        np.array([-1 if u is None else u for u in usr], dtype=np.int64),
+        (np.floor(epoch / width) * width).astype(np.int64),
+    ])
+    stats = _row_stats(*(np.asarray(v, dtype=np.float64) for v in (x, y, w, h)))
+    return _combine(keys, stats)
+
+
+def coarsen(keys, stats, width):
+    """Re-bucket aggregated rows into wider ``width``-second buckets."""
+    keys = keys.copy()
+    keys[:, 2] = keys[:, 2] // width * width
+    return _combine(keys, stats)
+
+
+def _stats_of(obj):
+    return np.array([
+        *(getattr(obj, f) for f in SUM_FIELDS), obj.screen_w, obj.screen_h,
+        *(obj.regions or [0] * (GRID * GRID)),
+    ], dtype=np.float64)
+
+
+def _bucket_dt(epoch):
+    return datetime.fromtimestamp(int(epoch), tz=dt_timezone.utc)
+
+
+def _id(value):
+    return -1 if value is None else value
+
+
+def _merge(model, keys, stats):
+    """Add aggregated buckets into ``model``'s table. Caller holds a transaction."""
+    if not len(keys):
+        return
+    device_ids = set(keys[:, 0].tolist())
+    scope = Q(device_id__in=[d for d in device_ids if d >= 0])
+    if -1 in device_ids:
+        scope |= Q(device__isnull=True)
+    existing = {
+        (_id(obj.device_id), _id(obj.user_id), int(obj.bucket.timestamp())): obj
+        for obj in model.objects.filter(
+            scope,
+            bucket__gte=_bucket_dt(keys[:, 2].min()),
+            bucket__lte=_bucket_dt(keys[:, 2].max()),
+        )
+    }
+
+    new, changed = [], []
+    for key, row in zip(map(tuple, keys.tolist()), stats):
+        obj = existing.get(key)
+        if obj is None:
+            obj = model(
+                bucket=_bucket_dt(key[2]),
+                device_id=None if key[0] < 0 else key[0],
+                user_id=None if key[1] < 0 else key[1],
+            )
+            new.append(obj)
+        else:
+            base = _stats_of(obj)
+            merged = base + row
+            merged[MAX_COLS] = np.maximum(base[MAX_COLS], row[MAX_COLS])
+            row = merged
+            changed.append(obj)
+        obj.count = int(row[0])
+        obj.sum_x, obj.sum_y, obj.sum_xx, obj.sum_yy = (float(v) for v in row[1:5])
+        obj.screen_w, obj.screen_h = float(row[5]), float(row[6])
+        obj.regions = [int(n) for n in row[7:]]
+
+    model.objects.bulk_create(new, batch_size=1000)
+    model.objects.bulk_update(changed, STAT_FIELDS, batch_size=1000)
+
+
+def settled(model, after_id, now=None):
+    """
+    Rows of ``model`` past ``after_id`` that are safe to fold into a roll-up.
+
+    Only rows received at least FLOW_ROLLUP_LAG_S ago, and only up to the
+    first id that is younger: every id below that bound was assigned
+    before the lag started, so its transaction has committed by now.
+    """
+    cutoff = (now or timezone.now()) - timedelta(seconds=settings.FLOW_ROLLUP_LAG_S)
+    rows = model.objects.filter(id__gt=after_id)
+    young = rows.filter(received_at__gte=cutoff).aggregate(first=Min("id"))["first"]
+    rows = rows.filter(received_at__lt=cutoff)
+    return rows if young is None else rows.filter(id__lt=young)
+
+
+def rollup(chunk_size=None, now=None):
+    """Aggregate settled raw gaze rows past the high-water mark; returns rows processed."""
+    chunk_size = chunk_size or settings.FLOW_GAZE_ROLLUP_CHUNK
+    state, _ = RollupState.objects.get_or_create(name=ROLLUP_NAME)
+    source = settled(GazeRecord, state.last_id, now)
+    total = 0
+    while True:
+        with transaction.atomic():
+            state = RollupState.objects.select_for_update().get(name=ROLLUP_NAME)
+            rows = list(
+                source.filter(id__gt=state.last_id)
+                .order_by("id")
+                .values_list(*SOURCE_FIELDS)[:chunk_size]
+            )
+            if not rows:
+                return total
+            keys, stats = aggregate(rows, TIERS["second"][1])
+            _merge(GazeSecond, keys, stats)
+            _merge(GazeMinute, *coarsen(keys, stats, TIERS["minute"][1]))
+            state.last_id = rows[-1][0]
+            state.save(update_fields=["last_id", "updated_at"])
+        total += len(rows)
+
+
+def watermark():
+    return RollupState.objects.filter(name=ROLLUP_NAME).values_list("last_id", flat=True).first() or 0
+
+
+def _delete_batches(model, column, cutoff, batch_size, pause, max_id=None):
+    """
+    DELETE in batches of ``batch_size`` rows, one short transaction each.
+
+    Raw SQL on purpose: Model.delete() would load every row to send
+    post_delete signals, which nothing needs for expired history.
+    """
+    table = connection.ops.quote_name(model._meta.db_table)
+    column = connection.ops.quote_name(column)
+    where = f"{column} < %s" + (" AND id <= %s" if max_id is not None else "")
+    sql = f"DELETE FROM {table} WHERE id IN (SELECT id FROM {table} WHERE {where} ORDER BY id LIMIT %s)"
+    params = [connection.ops.adapt_datetimefield_value(cutoff)]
+    if max_id is not None:
+        params.append(max_id)
+    params.append(batch_size)
+
+    deleted = 0
+    while True:
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            n = cursor.rowcount
+        deleted += n
+        if n < batch_size:
+            return deleted
+        if pause:
+            time.sleep(pause)
+
+
+def prune(batch_size=None, pause_ms=0, now=None):
+    """Drop expired raw rows (only ones already rolled up) and second buckets."""
+    now = now or timezone.now()
+    batch_size = batch_size or settings.FLOW_GAZE_PRUNE_BATCH
+    pause = pause_ms / 1000.0
+    return {
+        "raw": _delete_batches(
+            GazeRecord, "timestamp",
+            now - timedelta(days=settings.FLOW_GAZE_RAW_RETENTION_DAYS),
+            batch_size, pause, max_id=watermark(),
+        ),
+        "second": _delete_batches(
+            GazeSecond, "bucket",
+            now - timedelta(days=settings.FLOW_GAZE_SECOND_RETENTION_DAYS),
+            batch_size, pause,
+        ),
+    }
+
+
+def choose_tier(since, until, now=None):
+    """Finest tier that still holds ``since`` and keeps the answer small."""
+    now = now or timezone.now()
+    span = (until - since).total_seconds()
+    if (since >= now - timedelta(days=settings.FLOW_GAZE_RAW_RETENTION_DAYS)
+            and span <= settings.FLOW_GAZE_RAW_MAX_SPAN_S):
+        return "raw"
+    if (since >= now - timedelta(days=settings.FLOW_GAZE_SECOND_RETENTION_DAYS)
+            and span <= settings.FLOW_GAZE_SECOND_MAX_SPAN_S):
+        return "second"
+    return "minute"
+
+
+def _bucket_payload(epoch, row):
+    n = row[0]
+    mean_x, mean_y = row[1] / n, row[2] / n
+    var = max(row[3] / n - mean_x * mean_x, 0.0) + max(row[4] / n - mean_y * mean_y, 0.0)
+    return {
+        "bucket": _bucket_dt(epoch),
+        "count": int(n),
+        "mean_x": mean_x,
+        "mean_y": mean_y,
+        "dispersion": float(np.sqrt(var)),
+        "screen_w": row[5],
+        "screen_h": row[6],
+        "regions": [int(c) for c in row[7:]],
+    }
+
+
+def query_range(filters, since, until, tier):
+    """
+    Gaze between ``since`` and ``until`` for the read scope ``filters``
+    (see identity.read_scope). ``tier`` is "raw", "second" or "minute".
+
+    Raw answers are capped at FLOW_GAZE_PAGE_MAX samples.
+    """
+    raw = GazeRecord.objects.filter(**filters, timestamp__gte=since, timestamp__lt=until)
+
+    if tier == "raw":
+        limit = settings.FLOW_GAZE_PAGE_MAX
+        rows = list(raw.order_by("timestamp", "id").values_list(*RAW_FIELDS)[:limit + 1])
+        return {
+            "resolution": tier,
+            "gaze": [dict(zip(RAW_FIELDS, r)) for r in rows[:limit]],
+            "truncated": len(rows) > limit,
+        }
+
+    model, width = TIERS[tier]
+    start = _bucket_dt(since.timestamp() // width * width)
+    stored = list(
+        model.objects.filter(**filters, bucket__gte=start, bucket__lt=until)
+        .values_list("bucket", *SUM_FIELDS, "screen_w", "screen_h", "regions")
+    )
+    stored_keys = np.array([[0, 0, int(r[0].timestamp())] for r in stored], dtype=np.int64).reshape(-1, 3)
+    stored_stats = np.array([[*r[1:8], *r[8]] for r in stored], dtype=np.float64).reshape(-1, N_STATS)
+
+    # samples the roll-up hasn't reached yet
+    tail_keys, tail_stats = aggregate(list(raw.filter(id__gt=watermark()).values_list(*SOURCE_FIELDS)), width)
+    tail_keys[:, :2] = 0
+
+    keys, stats = _combine(np.vstack([stored_keys, tail_keys]), np.vstack([stored_stats, tail_stats]))
+    return {
+        "resolution": tier,
+        "buckets": [_bucket_payload(k[2], row) for k, row in zip(keys.tolist(), stats.tolist())],
+    }
@@ -0,0 +1,220 @@
+"""
+Hourly and daily flow-history aggregates.
+
+Each heartbeat stands for FLOW_HEARTBEAT_SECONDS of activity. ``compact()``
+folds heartbeats past a RollupState high-water id into FlowHour and FlowDay
+rows per device and user: time per state_prediction, sums of the model
+features (means are derived on read) and seconds per active app. All of
+these are sums, so a late heartbeat just adds to its bucket. Like the gaze
+roll-up it only takes heartbeats received FLOW_ROLLUP_LAG_S ago or more
+(``gaze_rollup.settled()``), so an id committed out of order isn't skipped.
+
+``query()`` reads the aggregate rows for a range and adds the heartbeats
+the compaction hasn't reached yet, so answers are current. Its cost
+depends on the number of buckets in the range, not on how much raw data
+there is.
+
+Deleting raw heartbeats does not subtract them from the aggregates.
+"""
+from collections import Counter
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+
+from .gaze_rollup import settled
+from .models import FEATURE_FIELDS, BiometricRecord, FlowDay, FlowHour, RollupState, UserTask
+from .task_catalogue import catalogue
+
+ROLLUP_NAME = "history"
+GRANULARITIES = {"hour": (FlowHour, 3600), "day": (FlowDay, 86400)}
+
+SOURCE_FIELDS = ("id", "timestamp", "device_id", "user_id", "state_prediction", "task_refs", *FEATURE_FIELDS)
+AGG_FIELDS = ("heartbeats", "seconds_by_state", "metric_sums", "app_seconds")
+
+
+class Bucket:
+    """In-memory partial aggregate; same shape as a FlowAggregate row."""
+    __slots__ = ("heartbeats", "states", "sums", "apps")
+
+    def __init__(self, heartbeats=0, states=None, sums=None, apps=None):
+        self.heartbeats = heartbeats
+        self.states = Counter(states or {})
+        self.sums = Counter(sums or {})
+        self.apps = Counter(apps or {})
+
+    @classmethod
+    def from_row(cls, obj):
+        return cls(obj.heartbeats, obj.seconds_by_state, obj.metric_sums, obj.app_seconds)
+
+    def add(self, other):
+        self.heartbeats += other.heartbeats
+        self.states.update(other.states)
+        self.sums.update(other.sums)
+        self.apps.update(other.apps)
+        return self
+
+    def store(self, obj):
+        obj.heartbeats = self.heartbeats
+        obj.seconds_by_state = dict(self.states)
+        obj.metric_sums = dict(self.sums)
+        obj.app_seconds = dict(self.apps.most_common(settings.FLOW_HISTORY_MAX_APPS))
+
+    def payload(self, top_apps=10):
+        n = self.heartbeats
+        return {
+            "heartbeats": n,
+            "seconds_by_state": dict(self.states),
+            "means": {f: self.sums[f] / n if n else 0.0 for f in FEATURE_FIELDS},
+            "top_apps": [{"app": app, "seconds": s} for app, s in self.apps.most_common(top_apps)],
+        }
+
+
+def _bucket_dt(epoch):
+    return datetime.fromtimestamp(epoch, tz=dt_timezone.utc)
+
+
+def _active_apps(rows):
+    """{record id: [app, ...]} of the active windows, from task_refs or legacy UserTask rows."""
+    active, legacy = {}, []
+    for row in rows:
+        pk, refs = row[0], row[5]
+        if refs is None:
+            legacy.append(pk)
+        else:
+            active[pk] = [entry for entry, is_active in refs if is_active]
+
+    names = catalogue.contents({entry for ids in active.values() for entry in ids})
+    apps = {pk: [names[e][0] for e in ids if e in names] for pk, ids in active.items()}
+    if legacy:
+        tasks = UserTask.objects.filter(record_id__in=legacy, active=True)
+        for record_id, app in tasks.values_list("record_id", "app"):
+            apps.setdefault(record_id, []).append(app)
+    return apps
+
+
+def summarize(rows, width):
+    """
+    Fold heartbeat rows (SOURCE_FIELDS order) into
+    {(device_id, user_id, bucket epoch): Bucket}.
+    """
+    seconds = settings.FLOW_HEARTBEAT_SECONDS
+    apps = _active_apps(rows) if rows else {}
+
+    out = {}
+    for pk, ts, device_id, user_id, state, _, *metrics in rows:
+        key = (device_id, user_id, int(ts.timestamp()) // width * width)
+        bucket = out.get(key)
+        if bucket is None:
+            bucket = out[key] = Bucket()
+        bucket.heartbeats += 1
+        bucket.states[state or "unknown"] += seconds
+        for field, value in zip(FEATURE_FIELDS, metrics):
+            bucket.sums[field] += value
+        for app in apps.get(pk, ()):
+            bucket.apps[app] += seconds
+    return out
+
+
+def coarsen(buckets, width):
+    out = {}
+    for (device_id, user_id, epoch), bucket in buckets.items():
+        key = (device_id, user_id, epoch // width * width)
+        out.setdefault(key, Bucket()).add(bucket)
+    return out
+
+
+def _merge(model, buckets):
+    """Add partial buckets into ``model``'s table. Caller holds a transaction."""
+    if not buckets:
+        return
+    device_ids = {k[0] for k in buckets}
+    scope = Q(device_id__in=[d for d in device_ids if d is not None])
+    if None in device_ids:
+        scope |= Q(device__isnull=True)
+    epochs = [k[2] for k in buckets]
+    existing = {
+        (obj.device_id, obj.user_id, int(obj.bucket.timestamp())): obj
+        for obj in model.objects.filter(
+            scope, bucket__gte=_bucket_dt(min(epochs)), bucket__lte=_bucket_dt(max(epochs)),
+        )
+    }
+
+    new, changed = [], []
+    for key, bucket in buckets.items():
+        obj = existing.get(key)
+        if obj is None:
+            obj = model(bucket=_bucket_dt(key[2]), device_id=key[0], user_id=key[1])
+            new.append(obj)
+        else:
+            bucket = Bucket.from_row(obj).add(bucket)
+            changed.append(obj)
+        bucket.store(obj)
+
+    model.objects.bulk_create(new, batch_size=1000)
+    model.objects.bulk_update(changed, AGG_FIELDS, batch_size=1000)
+
+
+def compact(chunk_size=None, now=None):
+    """Fold settled heartbeats past the high-water mark into the aggregates; returns rows processed."""
+    chunk_size = chunk_size or settings.FLOW_HISTORY_CHUNK
+    state, _ = RollupState.objects.get_or_create(name=ROLLUP_NAME)
+    source = settled(BiometricRecord, state.last_id, now)
+    total = 0
+    while True:
+        with transaction.atomic():
+            state = RollupState.objects.select_for_update().get(name=ROLLUP_NAME)
+            rows = list(
+                source.filter(id__gt=state.last_id)
+                .order_by("id")
+                .values_list(*SOURCE_FIELDS)[:chunk_size]
+            )
+            if not rows:
+                return total
+            hours = summarize(rows, GRANULARITIES["hour"][1])
+            _merge(FlowHour, hours)
+            _merge(FlowDay, coarsen(hours, GRANULARITIES["day"][1]))
+            state.last_id = rows[-1][0]
+            state.save(update_fields=["last_id", "updated_at"])
+        total += len(rows)
+
+
+def rebuild(now=None):
+    """Drop the aggregates and compact everything again (e.g. after re-scoring)."""
+    with transaction.atomic():
+        FlowHour.objects.all().delete()
+        FlowDay.objects.all().delete()
+        RollupState.objects.filter(name=ROLLUP_NAME).update(last_id=0)
+    return compact(now=now)
+
+
+def watermark():
+    return RollupState.objects.filter(name=ROLLUP_NAME).values_list("last_id", flat=True).first() or 0
+
+
+def query(filters, since, until, granularity):
+    """
+    Buckets between ``since`` and ``until`` for the read scope ``filters``
+    (device_id and/or user_id), oldest first, plus range totals.
+    """
+    model, width = GRANULARITIES[granularity]
+    start = _bucket_dt(int(since.timestamp()) // width * width)
+
+    by_epoch = {}
+    for obj in model.objects.filter(**filters, bucket__gte=start, bucket__lt=until):
+        by_epoch.setdefault(int(obj.bucket.timestamp()), Bucket()).add(Bucket.from_row(obj))
+
+    # heartbeats the compaction hasn't reached yet
+    tail = BiometricRecord.objects.filter(
+        **filters, id__gt=watermark(), timestamp__gte=start, timestamp__lt=until,
+    ).values_list(*SOURCE_FIELDS)
+    for (_, _, epoch), bucket in summarize(list(tail), width).items():
+        by_epoch.setdefault(epoch, Bucket()).add(bucket)
+
+    total = Bucket()
+    buckets = []
+    for epoch in sorted(by_epoch):
+        total.add(by_epoch[epoch])
+        buckets.append({"bucket": _bucket_dt(epoch), **by_epoch[epoch].payload()})
+    return {"granularity": granularity, "buckets": buckets, "total": total.payload()}
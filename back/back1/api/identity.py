@@ -0,0 +1,167 @@
+"""
+Who a request belongs to: user, device and session.
+
+Ingestion identifies the device by the ``X-Flow-Device`` header (or a
+``device_id`` field in the payload) and the session by ``X-Flow-Session``
+(or ``session_id``). The user is the authenticated request user, else
+the user the device is registered to. Device keys map to ids through a
+bounded in-process cache, so steady-state ingestion doesn't query the
+Device table.
+
+Read endpoints take ``?device=<key>``, ``?user=<id>`` and
+``?session=<id>`` (together with ``device``) to scope their queries.
+A user id is guessable, so ``?user=`` is only for that user when logged
+in, or for staff. With FLOW_PUBLIC_READS (the default) reads are otherwise
+open: a device key alone reads that device's data, and requests that carry
+no identity get everyone's data, as before. Without it every read needs a
+login: an unscoped read is the caller's own data (all data for staff) and
+``?device=`` needs the device owner's login.
+"""
+import threading
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.exceptions import PermissionDenied
+
+from .models import Device
+
+_devices = OrderedDict()   # key -> (device id, user id)
+_lock = threading.Lock()
+
+
+class Identity(NamedTuple):
+    device_id: Optional[int] = None
+    device_key: str = ""
+    user_id: Optional[int] = None
+    session_id: str = ""
+
+    def apply(self, *objs):
+        """Stamp identity onto unsaved records (BiometricRecord, GazeRecord, UserTask)."""
+        for obj in objs:
+            obj.device_id = self.device_id
+            if hasattr(obj, "user_id"):
+                obj.user_id = self.user_id
+            if hasattr(obj, "session_id"):
+                obj.session_id = self.session_id
+
+    @property
+    def feature_key(self):
+        """Feature-engine session key."""
+        return f"{self.device_key}:{self.session_id or 'default'}"
+
+
+def scopes_for(device_id, user_id):
+    """Cache / live-stream scopes a record with this identity belongs to."""
+    scopes = [""]
+    if device_id is not None:
+        scopes.append(f"d:{device_id}")
+    if user_id is not None:
+        scopes.append(f"u:{user_id}")
+    return scopes
+
+
+def all_scopes():
+    """Every scope a cache entry can exist under: global, each device, each user."""
+    yield ""
+    for device_id in Device.objects.values_list("id", flat=True).iterator():
+        yield f"d:{device_id}"
+    for user_id in get_user_model().objects.values_list("id", flat=True).iterator():
+        yield f"u:{user_id}"
+
+
+def device_for_key(key, user_id=None):
+    """Return (device id, user id) for a device key, registering new devices."""
+    with _lock:
+        hit = _devices.get(key)
+        if hit is not None:
+            _devices.move_to_end(key)
+    if hit is not None and (user_id is None or hit[1] is not None):
+        return hit
+
+    device, _ = Device.objects.get_or_create(key=key, defaults={"user_id": user_id})
+    if device.user_id is None and user_id is not None:
+        # first authenticated request claims an anonymous device
+        Device.objects.filter(pk=device.pk, user__isnull=True).update(user_id=user_id)
+        device.user_id = user_id
+
+    with _lock:
+        _devices[key] = (device.pk, device.user_id)
+        while len(_devices) > settings.FLOW_DEVICE_CACHE_SIZE:
+            _devices.popitem(last=False)
+    return device.pk, device.user_id
+
+
+def forget_device(key):
+    with _lock:
+        _devices.pop(key, None)
+
+
+def _clean(value, limit=64):
+    return str(value).strip()[:limit] if value not in (None, "") else ""
+
+
+def from_request(request, data=None):
+    """Resolve the identity of an ingestion request. Touches the DB only for unseen devices."""
+    data = data if isinstance(data, dict) else {}
+    key = _clean(request.headers.get("X-Flow-Device") or data.get("device_id"))
+    session = _clean(request.headers.get("X-Flow-Session") or data.get("session_id"))
+    user = getattr(request, "user", None)
+    user_id = user.pk if user is not None and user.is_authenticated else None
+
+    if not key:
+        return Identity(None, "", user_id, session)
+    device_id, device_user = device_for_key(key, user_id)
+    return Identity(device_id, key, user_id or device_user, session)
+
+
+def _may_read(caller, user_id):
+    """Whether ``caller`` (an authenticated user or None) may read ``user_id``'s data."""
+    return caller is not None and (caller.is_staff or (user_id is not None and caller.pk == user_id))
+
+
+def read_scope(request):
+    """
+    Turn ?device= / ?user= / ?session= into (filter kwargs, cache scope).
+
+    The scope is None for session-level reads, which are not cached.
+    Raises Device.DoesNotExist for an unknown device key, ValueError for a
+    malformed user id and PermissionDenied when the caller may not read
+    what was asked for (see FLOW_PUBLIC_READS).
+    """
+    key = request.GET.get("device")
+    user = request.GET.get("user")
+    session = request.GET.get("session")
+    caller = getattr(request, "user", None)
+    caller = caller if caller is not None and caller.is_authenticated else None
+    private = not settings.FLOW_PUBLIC_READS
+
+    filters = {}
+    scope = ""
+    if key:
+        with _lock:
+            hit = _devices.get(key)
+        device_id, owner = hit if hit else Device.objects.values_list("pk", "user_id").get(key=key)
+        if private and not _may_read(caller, owner):
+            raise PermissionDenied("this device's data needs its owner's login")
+        filters["device_id"] = device_id
+        scope = f"d:{device_id}"
+    if user:
+        user_id = int(user)
+        if not _may_read(caller, user_id):
+            raise PermissionDenied("?user= needs that user's login")
+        filters["user_id"] = user_id
+        scope = f"u:{user_id}" if not key else scope
+    if session:
+        if not key:
+            raise ValueError("session requires device")
+        filters["session_id"] = session
+        scope = None
+    if private and not filters:
+        if caller is None:
+            raise PermissionDenied("reads need a login")
+        if not caller.is_staff:
+            filters["user_id"] = caller.pk
+            scope = f"u:{caller.pk}"
+    return filters, scope
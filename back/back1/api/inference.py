@@ -0,0 +1,224 @@
+"""
+Micro-batching scheduler for the flow-state ONNX model.
+
+Request threads submit one feature vector each and block on a Future.
+A single worker thread collects whatever is queued (up to
+``max_batch_size`` rows or ``max_wait_ms`` after the first row arrives),
+runs one ``sess.run`` on the stacked N x 10 matrix and hands every caller
+its own row back as ``(label, model_version)``.
+
+If a shadow model is installed it is run on the same matrix after the
+callers have been answered, so it never adds to request latency. A
+ShadowScorer tracks its latency and agreement with the live model; the
+views share one (``shadow_scorer``) between the batcher and the async
+ingest writers, and ``stats()`` reports it.
+Run times, batch sizes and queue waits also go to the Prometheus
+histograms in ``metrics``.
+
+``close()`` stops taking rows, answers everything already queued and then
+stops the worker; the views call it when the process exits.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+from . import metrics
+
+_CLOSE = object()   # queue sentinel: the rows before it are the last ones
+
+class ShadowScorer:
+    """Run the shadow model on batches the live model scored; track latency and agreement."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # reset whenever the shadow version changes
+        self.version = None
+        self.rows = 0
+        self.agree = 0
+        self.seconds = 0.0
+        self.batches = 0
+        self.errors = 0
+
+    def score(self, shadow, X, live_labels):
+        started = time.perf_counter()
+        try:
+            labels = shadow.run(X[:, :shadow.n_features])
+        except Exception:
+            labels = None
+        elapsed = time.perf_counter() - started
+        if labels is not None:
+            metrics.inference_seconds.observe(elapsed, "shadow")
+            metrics.inference_batch_rows.observe(len(labels), "shadow")
+
+        with self._lock:
+            if shadow.version != self.version:
+                self.version = shadow.version
+                self.rows = self.agree = self.batches = 0
+                self.errors = 0
+                self.seconds = 0.0
+            if labels is None:
+                self.errors += 1
+                return
+            self.batches += 1
+            self.seconds += elapsed
+            self.rows += len(labels)
+            self.agree += int(np.sum(np.asarray(labels) == np.asarray(live_labels)))
+
+    def stats(self):
+        with self._lock:
+            if self.version is None:
+                return None
+            return {
+                "version": self.version,
+                "rows": self.rows,
+                "agreement_rate": self.agree / self.rows if self.rows else None,
+                "mean_run_ms": 1000.0 * self.seconds / self.batches if self.batches else 0.0,
+                "errors": self.errors,
+            }
+
+
+shadow_scorer = ShadowScorer()
+
+
+class InferenceBatcher:
+    def __init__(self, get_model, get_shadow=None, max_batch_size=32, max_wait_ms=2.0,
+                 shadow_scorer=None):
+        # Called from the worker thread, so the model loads lazily there
+        self.get_model = get_model
+        self.get_shadow = get_shadow or (lambda: None)
+        self.shadow = shadow_scorer or ShadowScorer()
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+
+        # Stats: batch size -> number of batches, plus totals for averages
+        self.batch_sizes = {}
+        self.batches = 0
+        self.rows = 0
+        self.run_seconds = 0.0
+        self.wait_seconds = 0.0
+
+    def submit(self, features):
+        """Queue one feature vector; returns a Future resolving to (label, version)."""
+        row = np.asarray(features, dtype=np.float32)
+        fut = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("inference batcher is closed")
+            self._queue.put((row, fut, time.perf_counter()))
+        self._ensure_worker()
+        return fut
+
+    def predict(self, features, timeout=None):
+        return self.submit(features).result(timeout=timeout)
+
+    def close(self, timeout=None):
+        """
+        Stop taking rows (``submit`` raises RuntimeError), answer the rows
+        already queued, then stop the worker. Waits up to ``timeout``
+        seconds for it to finish.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(_CLOSE)
+        # rows may be queued by a submit() that hasn't started the worker yet
+        self._ensure_worker()
+        self._thread.join(timeout)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000.0,
+                "queue_depth": self._queue.qsize(),
+                "batches": self.batches,
+                "rows": self.rows,
+                "mean_batch_size": self.rows / self.batches if self.batches else 0.0,
+                "mean_run_ms": 1000.0 * self.run_seconds / self.batches if self.batches else 0.0,
+                "mean_queue_wait_ms": 1000.0 * self.wait_seconds / self.rows if self.rows else 0.0,
+                "batch_size_histogram": {
+                    str(size): count for size, count in sorted(self.batch_sizes.items())
+                },
+                "shadow": self.shadow.stats(),
+            }
+
+    def _ensure_worker(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._closed and self._thread is not None:
+                return      # the worker ran until close()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="flow-inference", daemon=True
+                )
+                self._thread.start()
+
+    def _collect(self):
+        """The next batch, and whether close() was reached after it."""
+        first = self._queue.get()
+        if first is _CLOSE:
+            return [], True
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                if remaining <= 0:
+                    item = self._queue.get_nowait()
+                else:
+                    item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is _CLOSE:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self):
+        while True:
+            batch, closing = self._collect()
+            if batch:
+                self._score(batch)
+            if closing:
+                return
+
+    def _score(self, batch):
+        started = time.perf_counter()
+        try:
+            model = self.get_model()
+            X = np.stack([row for row, _, _ in batch])
+            labels = model.run(X[:, :model.n_features])
+        except Exception as exc:
+            for _, fut, _ in batch:
+                fut.set_exception(exc)
+            return
+        finished = time.perf_counter()
+
+        for (_, fut, _), label in zip(batch, labels):
+            fut.set_result((label, model.version))
+
+        n = len(batch)
+        with self._lock:
+            self.batch_sizes[n] = self.batch_sizes.get(n, 0) + 1
+            self.batches += 1
+            self.rows += n
+            self.run_seconds += finished - started
+            self.wait_seconds += sum(started - queued for _, _, queued in batch)
+        metrics.inference_seconds.observe(finished - started, "live")
+        metrics.inference_batch_rows.observe(n, "live")
+        for _, _, queued in batch:
+            metrics.inference_queue_seconds.observe(started - queued)
+
+        shadow = self.get_shadow()
+        if shadow is not None:
+            self.shadow.score(shadow, X, labels)
@@ -0,0 +1,279 @@
+"""
+In-process write queue for the async ingestion endpoints.
+
+The async views only parse and validate, put the unsaved objects on an
+asyncio.Queue and return 202. Writer tasks running on the server's event
+loop drain the queue in batches: heartbeats in a batch are scored with one
+``sess.run`` on the stacked feature matrix, then everything is written with
+bulk_create in one transaction on the ORM's sync thread.
+
+A batch that fails to write is logged and retried one item at a time, so
+a bad row only loses itself, not the rest of the batch. Items that still
+fail are logged and counted as ``failed``.
+
+A heartbeat queued with a client id is stored with its ClientReceipt, and
+the id stays in ``pending`` until then, so a replay that arrives while the
+first delivery is still queued is recognised too. Heartbeats are also run
+through the shadow model, if one is installed, after the write.
+
+When the queue is full, ``submit()`` waits up to FLOW_INGEST_PUT_TIMEOUT
+and then reports failure so the view can answer 503 (backpressure).
+``drain()`` is called from the ASGI lifespan shutdown so queued items are
+flushed before the worker exits.
+
+Only meaningful under ASGI: without a long-lived event loop the writer
+tasks would die with the request, so the views write inline instead.
+"""
+import asyncio
+import bisect
+import logging
+import time
+
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, transaction
+
+from . import latest_cache, metrics, model_registry
+from .inference import shadow_scorer
+from .models import BiometricRecord, ClientReceipt, GazeRecord
+from .task_catalogue import catalogue
+
+logger = logging.getLogger(__name__)
+
+# Flush latency histogram bucket upper bounds, in milliseconds
+FLUSH_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, float("inf"))
+
+
+def write_batch(heartbeats, gaze, receipts=()):
+    """
+    Score and store a batch synchronously.
+
+    ``heartbeats`` is a list of (record, windows, features) as built by
+    the views; ``gaze`` a list of unsaved GazeRecords. ``receipts`` are
+    (ClientReceipt, record or None) pairs stored in the same transaction;
+    an already-used client id raises IntegrityError and nothing is stored.
+    """
+    labels = None
+    if heartbeats:
+        model = model_registry.get_model()
+        X = np.array([features for _, _, features in heartbeats], dtype=np.float32)
+        with metrics.inference_seconds.time("live"):
+            labels = model.run(X[:, :model.n_features])
+        metrics.inference_batch_rows.observe(len(X), "live")
+        for (record, _, _), label in zip(heartbeats, labels):
+            record.state_prediction = label
+            record.model_version = model.version
+
+    created = 0
+    with transaction.atomic():
+        if heartbeats:
+            with metrics.stage("ingest_writer", "catalogue"):
+                created = catalogue.assign([(record, windows) for record, windows, _ in heartbeats])
+        with metrics.stage("ingest_writer", "insert"):
+            if heartbeats:
+                BiometricRecord.objects.bulk_create([r for r, _, _ in heartbeats])
+            if gaze:
+                GazeRecord.objects.bulk_create(gaze)
+            if receipts:
+                for receipt, record in receipts:
+                    receipt.record_id = record.pk if record is not None else None
+                ClientReceipt.objects.bulk_create([r for r, _ in receipts])
+    metrics.rows_written.inc("task_entry", amount=created)
+    metrics.rows_written.inc("biometric_record", amount=len(heartbeats))
+    metrics.rows_written.inc("gaze_record", amount=len(gaze))
+
+    with metrics.stage("ingest_writer", "cache"):
+        if heartbeats:
+            record, windows, _ = max(heartbeats, key=lambda h: h[0].timestamp)
+            latest_cache.record_heartbeat(record, windows)
+        latest_cache.record_gaze(gaze)
+
+    shadow = model_registry.get_shadow() if labels is not None else None
+    if shadow is not None:
+        shadow_scorer.score(shadow, X, labels)
+
+
+def unpack(items):
+    """
+    Split queued ("heartbeat", (record, windows, features, client_id)) and
+    ("gaze", GazeRecord) items into write_batch()'s (heartbeats, gaze, receipts).
+    """
+    heartbeats, gaze, receipts = [], [], []
+    for kind, item in items:
+        if kind == "heartbeat":
+            record, windows, features, client_id = item
+            heartbeats.append((record, windows, features))
+            if client_id:
+                receipts.append((ClientReceipt(client_id=client_id, kind=kind, count=1), record))
+        else:
+            gaze.append(item)
+    return heartbeats, gaze, receipts
+
+
+def write_each(items):
+    """
+    Fallback after a failed batch: one write_batch() per queued item.
+    Returns the number of items accounted for; failures are logged.
+    """
+    written = 0
+    for kind, item in items:
+        try:
+            write_batch(*unpack([(kind, item)]))
+            written += 1
+        except IntegrityError:
+            if kind == "heartbeat" and item[3] and ClientReceipt.objects.filter(client_id=item[3]).exists():
+                # a replay queued before its first delivery was written
+                written += 1
+            else:
+                logger.exception("dropping a queued %s that could not be written", kind)
+        except Exception:
+            logger.exception("dropping a queued %s that could not be written", kind)
+    return written
+
+
+class IngestPipeline:
+    def __init__(self, maxsize=10000, batch_size=500, flush_interval_ms=50,
+                 writers=1, put_timeout_ms=100):
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.writers = writers
+        self.put_timeout = put_timeout_ms / 1000.0
+
+        self._queue = None
+        self._tasks = []
+        self._closing = False
+        self.pending = set()    # client ids of queued heartbeats
+
+        self.enqueued = 0
+        self.rejected = 0
+        self.written = 0
+        self.failed = 0
+        self.flushes = 0
+        self.flush_seconds = 0.0
+        self.flush_histogram = [0] * len(FLUSH_BUCKETS_MS)
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            maxsize=settings.FLOW_INGEST_QUEUE_SIZE,
+            batch_size=settings.FLOW_INGEST_BATCH_SIZE,
+            flush_interval_ms=settings.FLOW_INGEST_FLUSH_MS,
+            writers=settings.FLOW_INGEST_WRITERS,
+            put_timeout_ms=settings.FLOW_INGEST_PUT_TIMEOUT_MS,
+        )
+
+    def _ensure_started(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.maxsize)
+        self._tasks = [t for t in self._tasks if not t.done()]
+        while len(self._tasks) < self.writers:
+            self._tasks.append(asyncio.get_running_loop().create_task(self._writer()))
+
+    async def submit(self, kind, items):
+        """
+        Queue ("heartbeat", (record, windows, features, client_id)) or
+        ("gaze", GazeRecord) items.
+
+        Returns False if the queue stayed full for put_timeout, or the
+        pipeline is shutting down; nothing is queued in that case.
+        """
+        if self._closing:
+            return False
+        self._ensure_started()
+        if self._queue.maxsize - self._queue.qsize() < len(items):
+            # wait for room for the whole request, then give up
+            deadline = time.monotonic() + self.put_timeout
+            while self._queue.maxsize - self._queue.qsize() < len(items):
+                if time.monotonic() >= deadline or len(items) > self._queue.maxsize:
+                    self.rejected += len(items)
+                    return False
+                await asyncio.sleep(0.005)
+        for item in items:
+            self._queue.put_nowait((kind, item))
+            if kind == "heartbeat" and item[3]:
+                self.pending.add(item[3])
+        self.enqueued += len(items)
+        return True
+
+    async def _collect(self):
+        batch = [await self._queue.get()]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _writer(self):
+        while True:
+            batch = await self._collect()
+
+            started = time.perf_counter()
+            try:
+                try:
+                    await sync_to_async(write_batch)(*unpack(batch))
+                    written = len(batch)
+                except Exception:
+                    logger.exception("writing a batch of %d queued items failed; retrying one by one", len(batch))
+                    written = await sync_to_async(write_each)(batch)
+                self.written += written
+                self.failed += len(batch) - written
+            finally:
+                self.pending.difference_update(item[3] for kind, item in batch if kind == "heartbeat")
+                elapsed = time.perf_counter() - started
+                self.flushes += 1
+                self.flush_seconds += elapsed
+                self.flush_histogram[bisect.bisect_left(FLUSH_BUCKETS_MS, elapsed * 1000.0)] += 1
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def drain(self, timeout=30.0):
+        """Stop accepting items, flush what is queued, then stop the writers."""
+        self._closing = True
+        if self._queue is not None:
+            try:
+                await asyncio.wait_for(self._queue.join(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def stats(self):
+        return {
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "queue_max": self.maxsize,
+            "writers": len([t for t in self._tasks if not t.done()]),
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "rejected": self.rejected,
+            "failed": self.failed,
+            "flushes": self.flushes,
+            "mean_flush_ms": 1000.0 * self.flush_seconds / self.flushes if self.flushes else 0.0,
+            "flush_histogram_ms": {
+                ("+Inf" if b == float("inf") else str(b)): n
+                for b, n in zip(FLUSH_BUCKETS_MS, self.flush_histogram)
+            },
+        }
+
+
+pipeline = IngestPipeline.from_settings()
+
+
+async def lifespan(scope, receive, send):
+    """ASGI lifespan handler: drain the write queue on shutdown."""
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await pipeline.drain()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
@@ -0,0 +1,231 @@
+"""
+Write-through cache of the latest state, tasks and gaze sample.
+
+Ingestion stores the already-serialised JSON body plus an ETag in the
+``FLOW_LATEST_CACHE`` cache alias (local memory by default, Redis when
+FLOW_REDIS_URL is set), so the polling endpoints answer from memory and
+unchanged polls get a 304 without a body being built. A cache miss (cold
+start, TTL expiry) falls back to the database and repopulates the entry.
+The local-memory backend is per process, so with several workers its TTL
+bounds how long one worker can miss another's writes; keep it short.
+
+Entries only move forward in time: a late or replayed heartbeat older
+than the cached one does not replace it.
+
+Payloads are built from a record's values as the database returns them
+(see _column_values), so an entry written through from a freshly ingested
+record and one rebuilt from the database on a miss have the same body and
+ETag.
+
+Every entry exists per scope (see identity.scopes_for): the global one
+plus one per device and per user, all written through on ingestion.
+Session-level reads are not cached.
+"""
+import hashlib
+import json
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils import timezone
+
+from . import identity, live
+from .models import BiometricRecord, GazeRecord, UserTask
+
+STATE = "state"
+TASKS = "tasks"
+GAZE = "gaze"
+
+
+def _cache():
+    return caches[settings.FLOW_LATEST_CACHE]
+
+
+def _key(name, scope=""):
+    return f"flow:latest:{name}:{scope}" if scope else f"flow:latest:{name}"
+
+
+STATE_FIELDS = (
+    "timestamp", "received_at",
+    # Typing metrics
+    "mean_iki_ms", "variance_iki", "burstiness", "total_keys", "backspace_rate", "backspaces",
+    # Mouse metrics
+    "distance_px", "click_rate_per_sec", "mouse_clicks",
+    # System metrics
+    "idle_time_ms",
+    # ML output
+    "state_prediction", "model_version",
+    # gaze
+    "gaze_x", "gaze_y", "screen_w", "screen_h",
+)
+GAZE_FIELDS = ("timestamp", "gaze_x", "gaze_y", "screen_w", "screen_h", "received_at")
+
+
+def _utc(value):
+    """An aware UTC datetime, as the database returns it (naive ones are saved in TIME_ZONE)."""
+    if timezone.is_naive(value):
+        value = timezone.make_aware(value)
+    return value.astimezone(dt_timezone.utc)
+
+
+def _column_values(record, names):
+    """
+    ``names`` of ``record`` converted by their model fields the way a read
+    from the database would give them: 1920 in a FloatField is 1920.0, a
+    numpy label in a CharField a str, a datetime UTC.
+    """
+    values = {}
+    for name in names:
+        value = record._meta.get_field(name).to_python(getattr(record, name))
+        values[name] = _utc(value) if isinstance(value, datetime) else value
+    return values
+
+
+def state_payload(record):
+    return _column_values(record, STATE_FIELDS)
+
+
+def tasks_payload(timestamp, windows):
+    """The heartbeat's windows (task_catalogue.Window), each stamped with its time."""
+    timestamp = _utc(timestamp) if timestamp is not None else None
+    return {
+        "tasks": [
+            {
+                "timestamp": timestamp,
+                "app": w.app,
+                "title": w.title,
+                "url": w.url,
+                "active": w.active,
+            }
+            for w in windows
+        ]
+    }
+
+
+def gaze_payload(rec):
+    return _column_values(rec, GAZE_FIELDS)
+
+
+def _entry(payload, timestamp=None):
+    body = json.dumps(payload, cls=DjangoJSONEncoder).encode()
+    etag = '"%s"' % hashlib.blake2b(body, digest_size=12).hexdigest()
+    return (etag, timestamp.timestamp() if timestamp else None, body)
+
+
+def put(name, payload, timestamp=None, scope=""):
+    """Serialise and cache ``payload``; returns the (etag, timestamp, body) entry."""
+    entry = _entry(payload, timestamp)
+    _cache().set(_key(name, scope), entry, settings.FLOW_LATEST_CACHE_TTL)
+    return entry
+
+
+def put_if_newer(name, payload, timestamp, scope=""):
+    """Cache ``payload`` unless the cached entry is newer; returns the entry or None."""
+    current = _cache().get(_key(name, scope))
+    if current is not None and current[1] is not None and current[1] > timestamp.timestamp():
+        return None
+    return put(name, payload, timestamp, scope)
+
+
+def get_body(name, scope=""):
+    entry = _cache().get(_key(name, scope))
+    return entry[2] if entry else None
+
+
+def invalidate(*names, scopes=("",)):
+    _cache().delete_many([_key(n, s) for n in names or (STATE, TASKS, GAZE) for s in scopes])
+
+
+def clear(*names, batch_size=1000):
+    """
+    Drop the ``names`` entries (default all) in every scope, after bulk
+    changes such as re-scoring. Only flow:latest keys are deleted; the
+    model activations sharing the cache are left alone.
+
+    With the local-memory backend this only reaches the calling process.
+    Run from a management command it doesn't touch the servers' caches,
+    which catch up as their entries expire (FLOW_LATEST_CACHE_TTL).
+    """
+    keys = []
+    for scope in identity.all_scopes():
+        keys.extend(_key(n, scope) for n in names or (STATE, TASKS, GAZE))
+        if len(keys) >= batch_size:
+            _cache().delete_many(keys)
+            keys = []
+    if keys:
+        _cache().delete_many(keys)
+
+
+def record_heartbeat(record, windows):
+    """Called after a heartbeat is committed; also pushes it live."""
+    state, task_list = state_payload(record), tasks_payload(record.timestamp, windows)
+    for scope in identity.scopes_for(record.device_id, record.user_id):
+        entry = put_if_newer(STATE, state, record.timestamp, scope)
+        if entry:
+            tasks_entry = put(TASKS, task_list, record.timestamp, scope)
+            live.broadcaster.publish(STATE, entry[2], scope)
+            live.broadcaster.publish(TASKS, tasks_entry[2], scope)
+
+
+def record_gaze(records):
+    """Called after gaze samples are committed; caches the newest one per scope."""
+    newest = {}
+    for rec in records:
+        for scope in identity.scopes_for(rec.device_id, rec.user_id):
+            if scope not in newest or rec.timestamp > newest[scope].timestamp:
+                newest[scope] = rec
+    for scope, rec in newest.items():
+        entry = put_if_newer(GAZE, gaze_payload(rec), rec.timestamp, scope)
+        if entry:
+            live.broadcaster.publish_gaze(entry[2], scope)
+
+
+def _matches(request, etag):
+    header = request.headers.get("If-None-Match", "")
+    if header.strip() == "*":
+        return True
+    return etag in (tag.strip().removeprefix("W/") for tag in header.split(","))
+
+
+def respond(request, name, build, scope=""):
+    """
+    Serve ``name`` from the cache, or from ``build()`` on a miss.
+
+    ``build()`` returns (payload, timestamp) or None when there is no data,
+    in which case None is returned and the caller answers 404. A ``scope``
+    of None skips the cache and always builds.
+    """
+    entry = _cache().get(_key(name, scope)) if scope is not None else None
+    if entry is None:
+        built = build()
+        if built is None:
+            return None
+        entry = put(name, *built, scope=scope) if scope is not None else _entry(*built)
+
+    etag, _, body = entry
+    if _matches(request, etag):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(body, content_type="application/json")
+    response["ETag"] = etag
+    response["Cache-Control"] = "no-cache"
+    return response
+
+
+@receiver(post_delete, sender=BiometricRecord)
+def _biometric_deleted(sender, instance, **kwargs):
+    invalidate(STATE, TASKS, scopes=identity.scopes_for(instance.device_id, instance.user_id))
+
+
+@receiver(post_delete, sender=UserTask)
+def _task_deleted(sender, instance, **kwargs):
+    invalidate(TASKS, scopes=identity.scopes_for(instance.device_id, None))
+
+
+@receiver(post_delete, sender=GazeRecord)
+def _gaze_deleted(sender, instance, **kwargs):
+    invalidate(GAZE, scopes=identity.scopes_for(instance.device_id, instance.user_id))
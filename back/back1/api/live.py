@@ -0,0 +1,113 @@
+"""
+In-memory fan-out of live updates to Server-Sent Events subscribers.
+
+Each connected dashboard gets a small asyncio.Queue on the event loop that
+serves it. ``publish()`` may be called from any thread (sync views, the
+ORM thread used by the async writer). Every event is encoded once, and
+only one ``call_soon_threadsafe`` is made per event loop, however many
+subscribers that loop has. A slow subscriber drops its oldest events
+rather than holding up the others, which is fine here because every event
+carries the full latest state.
+
+Subscribers pick a scope ("" for everything, "d:<device id>" or
+"u:<user id>"); publishers pass the scopes a record belongs to. Gaze
+updates are downsampled to at most one per FLOW_LIVE_GAZE_INTERVAL_MS per
+scope.
+
+Fan-out is per process: dashboards only see writes handled by the worker
+they are connected to.
+"""
+import asyncio
+import threading
+import time
+
+from django.conf import settings
+
+
+class Subscriber:
+    __slots__ = ("loop", "queue", "dropped", "scope")
+
+    def __init__(self, loop, maxsize, scope=""):
+        self.loop = loop
+        self.scope = scope
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.dropped = 0
+
+    def offer(self, message):
+        # runs on self.loop
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(message)
+
+
+class Broadcaster:
+    def __init__(self, queue_size=16, gaze_interval_ms=100):
+        self.queue_size = queue_size
+        self.gaze_interval = gaze_interval_ms / 1000.0
+        self._groups = {}           # (loop, scope) -> set of subscribers
+        self._lock = threading.Lock()
+        self._last_gaze = {}
+        self.published = 0
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            queue_size=settings.FLOW_LIVE_QUEUE_SIZE,
+            gaze_interval_ms=settings.FLOW_LIVE_GAZE_INTERVAL_MS,
+        )
+
+    def subscribe(self, scope=""):
+        """Register a subscriber for ``scope`` on the running event loop."""
+        loop = asyncio.get_running_loop()
+        sub = Subscriber(loop, self.queue_size, scope)
+        with self._lock:
+            self._groups.setdefault((loop, scope), set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            group = (sub.loop, sub.scope)
+            subs = self._groups.get(group)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del self._groups[group]
+
+    @property
+    def subscribers(self):
+        with self._lock:
+            return sum(len(subs) for subs in self._groups.values())
+
+    def publish(self, event, data, scope=""):
+        """Send one SSE event; ``data`` is an already-serialised JSON body (bytes)."""
+        with self._lock:
+            targets = [(group, tuple(subs)) for group, subs in self._groups.items()
+                       if group[1] == scope]
+        if not targets:
+            return
+
+        message = b"event: " + event.encode() + b"\ndata: " + data + b"\n\n"
+        self.published += 1
+        for group, subs in targets:
+            try:
+                group[0].call_soon_threadsafe(_deliver, subs, message)
+            except RuntimeError:
+                # loop closed under us; its subscribers are gone
+                with self._lock:
+                    self._groups.pop(group, None)
+
+    def publish_gaze(self, data, scope=""):
+        now = time.monotonic()
+        if now - self._last_gaze.get(scope, 0.0) < self.gaze_interval:
+            return
+        self._last_gaze[scope] = now
+        self.publish("gaze", data, scope)
+
+
+def _deliver(subs, message):
+    for sub in subs:
+        sub.offer(message)
+
+
+broadcaster = Broadcaster.from_settings()
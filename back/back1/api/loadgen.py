@@ -0,0 +1,139 @@
+"""
+Synthetic clients for load tests (``manage.py bench_load``).
+
+Each SyntheticDevice produces what one Electron client would: a heartbeat
+every 5 s whose metrics follow a flow / neutral / distracted state that
+persists for a while, the open windows of a small desktop, and a 30 Hz
+gaze stream made of fixations and saccades. Everything is seeded, so two
+runs send the same requests.
+"""
+import json
+import random
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import numpy as np
+
+from . import codecs
+from .models import FEATURE_FIELDS
+
+START = datetime(2025, 1, 1, tzinfo=dt_timezone.utc)
+STATES = ("flow", "neutral", "distracted")
+APPS = ("code", "chrome", "slack", "terminal", "figma", "outlook", "spotify", "notion")
+
+# per state: (low, high) for the uniform draws below
+PROFILES = {
+    "flow": {
+        "mean_iki_ms": (110, 190), "burstiness": (0.2, 0.6), "total_keys": (25, 70),
+        "backspace_rate": (0.01, 0.08), "distance_px": (100, 1500), "mouse_clicks": (0, 3),
+        "idle_time_ms": (0, 600), "switch": 0.05,
+    },
+    "neutral": {
+        "mean_iki_ms": (160, 320), "burstiness": (0.4, 1.0), "total_keys": (5, 35),
+        "backspace_rate": (0.05, 0.15), "distance_px": (800, 4000), "mouse_clicks": (1, 6),
+        "idle_time_ms": (200, 2500), "switch": 0.2,
+    },
+    "distracted": {
+        "mean_iki_ms": (250, 600), "burstiness": (0.8, 2.0), "total_keys": (0, 15),
+        "backspace_rate": (0.05, 0.3), "distance_px": (2000, 9000), "mouse_clicks": (2, 12),
+        "idle_time_ms": (1000, 5000), "switch": 0.6,
+    },
+}
+
+
+class SyntheticDevice:
+    def __init__(self, key, seed=0, gaze_hz=30, screen=(1920, 1080)):
+        self.key = key
+        self.rng = random.Random(f"{seed}:{key}")
+        self.gaze_hz = gaze_hz
+        self.screen = screen
+        self.state = "neutral"
+        self.t = START
+        n_windows = self.rng.randint(5, 25)
+        self.windows = [
+            {
+                "app": self.rng.choice(APPS),
+                "title": f"Document {w} - {self.rng.randint(1, 999)}",
+                "url": f"https://example.com/{key}/{w}" if self.rng.random() < 0.5 else "",
+            }
+            for w in range(n_windows)
+        ]
+        self.active = 0
+        self.fix = (screen[0] / 2, screen[1] / 2)
+        self.fix_left = 0.0
+
+    def _step_state(self):
+        if self.rng.random() > 0.9:
+            self.state = self.rng.choice(STATES)
+
+    def heartbeat(self):
+        """Next 5 s heartbeat, in the JSON shape the biometric view takes."""
+        self._step_state()
+        p = PROFILES[self.state]
+        u = lambda name: self.rng.uniform(*p[name])
+        keys = int(u("total_keys"))
+        backspace_rate = u("backspace_rate")
+        iki = u("mean_iki_ms")
+        clicks = int(u("mouse_clicks"))
+        if self.rng.random() < p["switch"]:
+            self.active = self.rng.randrange(len(self.windows))
+        self.t += timedelta(seconds=5)
+        return {
+            "timestamp": self.t.isoformat().replace("+00:00", "Z"),
+            "device_id": self.key,
+            "typing": {
+                "mean_iki_ms": iki,
+                "variance_iki": (iki * u("burstiness")) ** 2,
+                "burstiness": u("burstiness"),
+                "total_keys": keys,
+                "backspace_rate": backspace_rate,
+                "backspaces": int(keys * backspace_rate),
+            },
+            "mouse": {
+                "distance_px": int(u("distance_px")),
+                "click_rate_per_sec": clicks / 5.0,
+                "mouse_clicks": clicks,
+            },
+            "idle_time_ms": int(u("idle_time_ms")),
+            "tasks": [dict(w, active=i == self.active) for i, w in enumerate(self.windows)],
+        }
+
+    def gaze(self, n):
+        """Next ``n`` gaze samples as a GAZE_DTYPE array: fixations joined by saccades."""
+        out = np.zeros(n, codecs.GAZE_DTYPE)
+        dt = 1.0 / self.gaze_hz
+        w, h = self.screen
+        t0 = self.t.timestamp()
+        for i in range(n):
+            if self.fix_left <= 0:
+                # saccade to a new fixation target
+                self.fix = (self.rng.uniform(0, w), self.rng.uniform(0, h))
+                self.fix_left = self.rng.uniform(0.15, 0.6)
+            self.fix_left -= dt
+            out[i] = (
+                t0 + i * dt,
+                min(max(self.rng.gauss(self.fix[0], 12), 0), w),
+                min(max(self.rng.gauss(self.fix[1], 12), 0), h),
+                w, h,
+            )
+        self.t += timedelta(seconds=n * dt)
+        return out
+
+
+def gaze_json(samples, device_key):
+    return {
+        "device_id": device_key,
+        "gaze": [
+            dict(zip(("timestamp", "gaze_x", "gaze_y", "screen_w", "screen_h"), row))
+            for row in samples.tolist()
+        ],
+    }
+
+
+def heartbeat_struct(hb):
+    """Pack a JSON-shaped heartbeat as an x-flow-heartbeat body (tasks in the JSON tail)."""
+    flat = {**hb["typing"], **hb["mouse"], "idle_time_ms": hb["idle_time_ms"]}
+    row = np.zeros(1, codecs.HEARTBEAT_DTYPE)
+    row["timestamp"] = datetime.fromisoformat(hb["timestamp"].replace("Z", "+00:00")).timestamp()
+    for f in FEATURE_FIELDS:
+        row[f] = flat.get(f, 0)
+    return row.tobytes() + json.dumps(hb["tasks"]).encode()
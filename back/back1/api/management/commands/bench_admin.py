@@ -0,0 +1,132 @@
+import time
+from datetime import timedelta
+from urllib.parse import urlencode
+
+from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import RequestFactory
+
+from api.bench import fill_table, scratch_database, time_calls, timestamps, write_results
+from api.models import BiometricRecord, GazeRecord, UserTask
+
+
+class LegacyGazeRecordAdmin(admin.ModelAdmin):
+    """The changelist before the large-table settings: full COUNT(*)s, LIKE search."""
+    list_display = ("id", "timestamp", "gaze_x", "gaze_y", "screen_w", "screen_h", "received_at")
+    list_filter = ("timestamp",)
+    search_fields = ("timestamp",)
+
+
+class LegacyUserTaskAdmin(admin.ModelAdmin):
+    list_display = ("timestamp", "app", "title", "url", "active", "record")
+    ordering = ("-timestamp",)
+
+
+START = timestamps()(0)
+DAY = START + timedelta(days=1)
+# what DateFieldListFilter puts in its links
+LEGACY_DAY = {"timestamp__gte": f"{DAY:%Y-%m-%d %H:%M:%S+00:00}",
+              "timestamp__lt": f"{DAY + timedelta(days=1):%Y-%m-%d %H:%M:%S+00:00}"}
+
+# per changelist: (label, legacy query, current query)
+PAGES = {
+    GazeRecord: [
+        ("first page", {}, {}),
+        ("one day", LEGACY_DAY, {"period": f"{DAY:%Y-%m-%d}"}),
+        ("one day, page 5", {**LEGACY_DAY, "p": 5}, {"period": f"{DAY:%Y-%m-%d}", "p": 5}),
+        ("search id", {"q": 123456}, {"q": 123456}),
+        ("search minute", {"q": f"{DAY:%Y-%m-%d %H:%M}"}, {"q": f"{DAY:%Y-%m-%dT%H:%M}"}),
+    ],
+    UserTask: [
+        ("first page", {}, {}),
+    ],
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Time the admin changelists of GazeRecord and UserTask on a scratch "
+        "database, with the large-table admin (api/admin.py) and the old one."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=1_000_000,
+                            help="Gaze rows, spread over 10 days (heartbeats: a tenth).")
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument("--out", help="Write results as JSON to this path.")
+
+    @staticmethod
+    def _timed(durations):
+        def wrapper(execute, sql, params, many, context):
+            t0 = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                durations.append(time.perf_counter() - t0)
+        return wrapper
+
+    def handle(self, *args, **opts):
+        results = []
+        current = {model: type(admin.site._registry[model]) for model in PAGES}
+        legacy = {GazeRecord: LegacyGazeRecordAdmin, UserTask: LegacyUserTaskAdmin}
+        factory = RequestFactory()
+
+        with scratch_database():
+            self.stdout.write(f"filling {opts['rows']:,} gaze rows...")
+            gaze_ts = timestamps(step_seconds=10 * 86400 / opts["rows"], jitter=0.01)
+            fill_table(GazeRecord, opts["rows"], {
+                "timestamp": gaze_ts,
+                "gaze_x": lambda i: float(i % 1920),
+                "gaze_y": lambda i: float(i % 1080),
+                "screen_w": lambda i: 1920.0,
+                "screen_h": lambda i: 1080.0,
+            })
+            heartbeats = opts["rows"] // 10
+            bio_ts = timestamps(step_seconds=100 * 86400 / opts["rows"])
+            fill_table(BiometricRecord, heartbeats, {"timestamp": bio_ts})
+            fill_table(UserTask, heartbeats, {
+                "timestamp": bio_ts,
+                "app": lambda i: "code",
+                "title": lambda i: f"window {i % 20}",
+                "record": lambda i: i + 1,
+            })
+            with connection.cursor() as cursor:
+                cursor.execute("ANALYZE")
+
+            user = get_user_model().objects.create_superuser("bench", "", "bench")
+            for name, classes in (("legacy", legacy), ("current", current)):
+                for model, pages in PAGES.items():
+                    model_admin = classes[model](model, admin.site)
+                    url = f"/admin/api/{model._meta.model_name}/"
+                    for label, old_query, new_query in pages:
+                        query = urlencode(old_query if name == "legacy" else new_query)
+
+                        def fetch():
+                            request = factory.get(f"{url}?{query}")
+                            request.user = user
+                            response = model_admin.changelist_view(request)
+                            if hasattr(response, "render"):
+                                response.render()
+                            return response
+
+                        fetch()
+                        sql = []
+                        with connection.execute_wrapper(self._timed(sql)):
+                            status = fetch().status_code
+                        stats = time_calls(fetch, opts["repeat"], warmup=0)
+                        stats.update({
+                            "admin": name, "model": model.__name__, "page": label,
+                            "rows": opts["rows"], "queries": len(sql),
+                            "sql_ms": sum(sql) * 1000, "status": status,
+                        })
+                        results.append(stats)
+                        self.stdout.write(
+                            f"{name:<8} {model.__name__:<11} {label:<16} p50={stats['p50_ms']:8.1f}ms "
+                            f"(SQL {stats['sql_ms']:8.1f}ms in {len(sql):3d} queries)  HTTP {status}"
+                        )
+
+        if opts["out"]:
+            write_results(opts["out"], "bench_admin", results)
+            self.stdout.write(f"results written to {opts['out']}")
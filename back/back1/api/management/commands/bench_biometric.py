@@ -0,0 +1,139 @@
+import json
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.test import RequestFactory
+
+from api import views
+from api.bench import scratch_database, summarize, write_results
+from api.models import FEATURE_FIELDS, BiometricRecord, UserTask
+
+
+def legacy_biometric(request):
+    """
+    The original write path: create, predict, save() again, then one
+    UserTask INSERT per open window.
+    """
+    data = json.loads(request.body)
+    record, windows, _ = views._build_heartbeat(data)
+    record.save()
+    features = [getattr(record, f) for f in FEATURE_FIELDS]
+    record.state_prediction, record.model_version = views.predict_flow(features)
+    record.save()
+    for w in windows:
+        UserTask(record=record, timestamp=record.timestamp, **w._asdict()).save()
+    return record
+
+
+def heartbeat(i, windows, rng):
+    ts = datetime(2025, 1, 1, tzinfo=dt_timezone.utc) + timedelta(seconds=5 * i)
+    return {
+        "timestamp": ts.isoformat().replace("+00:00", "Z"),
+        "typing": {
+            "mean_iki_ms": rng.uniform(80, 400),
+            "variance_iki": rng.uniform(0, 20000),
+            "burstiness": rng.uniform(0, 2),
+            "total_keys": rng.randint(0, 60),
+            "backspace_rate": rng.uniform(0, 0.3),
+            "backspaces": rng.randint(0, 10),
+        },
+        "mouse": {
+            "distance_px": rng.randint(0, 5000),
+            "click_rate_per_sec": rng.uniform(0, 2),
+            "mouse_clicks": rng.randint(0, 10),
+        },
+        "idle_time_ms": rng.randint(0, 5000),
+        "tasks": [
+            {
+                "app": f"app-{w % 7}",
+                "title": f"Window {w} - some document title",
+                "url": f"https://example.com/page/{w}" if w % 2 else "",
+                "active": w == 0,
+            }
+            for w in range(windows)
+        ],
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Load-test the biometric write path on a scratch database: the "
+        "single-transaction view against the legacy create/save/per-task path."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=500)
+        parser.add_argument("--windows", default="20,50",
+                            help="Comma-separated open-window counts per heartbeat.")
+        parser.add_argument("--concurrency", type=int, default=1)
+        parser.add_argument("--out", help="Write results as JSON to this path.")
+
+    def run(self, handler, payloads, concurrency):
+        factory = RequestFactory()
+        latencies = []
+        lock = threading.Lock()
+        it = iter(payloads)
+
+        def worker():
+            local = []
+            while True:
+                with lock:
+                    body = next(it, None)
+                if body is None:
+                    break
+                request = factory.post("/api/biometric/", body, content_type="application/json")
+                t0 = time.perf_counter()
+                handler(request)
+                local.append(time.perf_counter() - t0)
+            with lock:
+                latencies.extend(local)
+            connections.close_all()
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - started
+        return elapsed, latencies
+
+    def handle(self, *args, **opts):
+        results = []
+        rng = random.Random(0)
+
+        with scratch_database():
+            # load the model outside the timed section
+            views.predict_flow([0.0] * len(FEATURE_FIELDS))
+
+            for windows in (int(w) for w in opts["windows"].split(",")):
+                payloads = [
+                    json.dumps(heartbeat(i, windows, rng)) for i in range(opts["requests"])
+                ]
+                for name, handler in (("legacy", legacy_biometric), ("current", views.biometric)):
+                    UserTask.objects.all().delete()
+                    BiometricRecord.objects.all().delete()
+
+                    elapsed, latencies = self.run(handler, payloads, opts["concurrency"])
+                    stats = summarize(latencies)
+                    stats.update({
+                        "path": name,
+                        "windows": windows,
+                        "concurrency": opts["concurrency"],
+                        "requests_per_sec": len(latencies) / elapsed,
+                        "rows_per_sec": (len(latencies) * (windows + 1)) / elapsed,
+                    })
+                    results.append(stats)
+                    self.stdout.write(
+                        f"{windows:>3} windows {name:<8} {stats['requests_per_sec']:8.1f} req/s  "
+                        f"p50={stats['p50_ms']:.2f}ms p95={stats['p95_ms']:.2f}ms "
+                        f"p99={stats['p99_ms']:.2f}ms"
+                    )
+
+        if opts["out"]:
+            write_results(opts["out"], "bench_biometric", results)
+            self.stdout.write(f"results written to {opts['out']}")
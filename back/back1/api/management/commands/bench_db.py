@@ -0,0 +1,146 @@
+import multiprocessing
+import random
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connections, transaction
+
+from api.bench import fill_table, scratch_database, summarize, timestamps, write_results
+from api.models import BiometricRecord
+from api.task_catalogue import Window, catalogue, windows_for
+from back1 import database
+
+# SQLite as Django configures it out of the box: rollback journal, deferred
+# transactions, 5 s busy timeout
+DEFAULT_OPTIONS = {"init_command": "PRAGMA journal_mode=DELETE"}
+
+
+def _write_one(rng, windows):
+    ts = datetime(2025, 1, 1, tzinfo=dt_timezone.utc) + timedelta(seconds=rng.uniform(0, 86400 * 30))
+    with transaction.atomic():
+        # read-then-write, like the roll-ups' merge: under a deferred
+        # transaction this read lock has to be upgraded to write
+        BiometricRecord.objects.filter(timestamp__lt=ts).order_by("-timestamp").first()
+        record = BiometricRecord(
+            timestamp=ts,
+            mean_iki_ms=rng.uniform(80, 400),
+            total_keys=rng.randint(0, 60),
+            state_prediction="flow",
+        )
+        catalogue.assign([(record, [
+            Window(f"app-{w % 7}", f"Window {w} - {rng.randint(1, 50)}", "", w == 0) for w in range(windows)
+        ])])
+        record.save()
+
+
+def _read_one(rng, windows):
+    last = BiometricRecord.objects.order_by("-timestamp").first()
+    if last is not None:
+        windows_for(last)
+
+
+def _worker(role, seconds, windows, seed, start, results):
+    rng = random.Random(seed)
+    op = _write_one if role == "writer" else _read_one
+    latencies, errors = [], 0
+    start.wait()
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        t0 = time.perf_counter()
+        try:
+            op(rng, windows)
+        except OperationalError:
+            # "database is locked": busy timeout expired or a deferred
+            # transaction could not upgrade its lock
+            errors += 1
+            continue
+        latencies.append(time.perf_counter() - t0)
+    connections.close_all()
+    results.put((role, latencies, errors))
+
+
+class Command(BaseCommand):
+    help = (
+        "Run concurrent writer and reader processes against a scratch database "
+        "and report throughput, latency and lock errors per role. On SQLite, "
+        "compares Django's default configuration with back1/database.py."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--writers", type=int, default=4)
+        parser.add_argument("--readers", type=int, default=4)
+        parser.add_argument("--seconds", type=float, default=10.0)
+        parser.add_argument("--windows", type=int, default=20, help="Open windows per written heartbeat.")
+        parser.add_argument("--rows", type=int, default=20_000, help="Heartbeats preloaded before the run.")
+        parser.add_argument("--profiles", default="default,tuned",
+                            help="SQLite only: comma-separated subset of default,tuned.")
+        parser.add_argument("--out", help="Write results as JSON to this path.")
+
+    def run_profile(self, opts):
+        fill_table(BiometricRecord, opts["rows"], {"timestamp": timestamps(), "state_prediction": lambda i: "flow"})
+        # children open their own connections
+        connections.close_all()
+
+        ctx = multiprocessing.get_context("fork")
+        start, results = ctx.Event(), ctx.Queue()
+        roles = ["writer"] * opts["writers"] + ["reader"] * opts["readers"]
+        procs = [
+            ctx.Process(target=_worker, args=(role, opts["seconds"], opts["windows"], i, start, results))
+            for i, role in enumerate(roles)
+        ]
+        for p in procs:
+            p.start()
+        start.set()
+        collected = [results.get() for _ in procs]
+        for p in procs:
+            p.join()
+
+        out = {}
+        for role in ("writer", "reader"):
+            latencies = [s for r, lat, _ in collected if r == role for s in lat]
+            errors = sum(e for r, _, e in collected if r == role)
+            stats = summarize(latencies)
+            stats.update({
+                "role": role,
+                "processes": roles.count(role),
+                "ops_per_sec": len(latencies) / opts["seconds"],
+                "errors": errors,
+            })
+            out[role] = stats
+        return out
+
+    def handle(self, *args, **opts):
+        conn = connections["default"]
+        if conn.vendor == "sqlite":
+            tuned = database.sqlite_config(conn.settings_dict["NAME"])["OPTIONS"]
+            profiles = {"default": DEFAULT_OPTIONS, "tuned": tuned}
+            names = [p for p in opts["profiles"].split(",") if p in profiles]
+        else:
+            profiles = {conn.vendor: conn.settings_dict["OPTIONS"]}
+            names = [conn.vendor]
+
+        original = conn.settings_dict["OPTIONS"]
+        results = []
+        try:
+            for name in names:
+                conn.close()
+                conn.settings_dict["OPTIONS"] = dict(profiles[name])
+                with scratch_database():
+                    by_role = self.run_profile(opts)
+                for role, stats in by_role.items():
+                    stats["profile"] = name
+                    results.append(stats)
+                    self.stdout.write(
+                        f"{name:<8} {role:<7} x{stats['processes']}  {stats['ops_per_sec']:8.1f} ops/s  "
+                        f"p50={stats.get('p50_ms', 0):.2f}ms p95={stats.get('p95_ms', 0):.2f}ms "
+                        f"p99={stats.get('p99_ms', 0):.2f}ms max={stats.get('max_ms', 0):.0f}ms  "
+                        f"errors={stats['errors']}"
+                    )
+        finally:
+            conn.close()
+            conn.settings_dict["OPTIONS"] = original
+
+        if opts["out"]:
+            write_results(opts["out"], "bench_db", results)
+            self.stdout.write(f"results written to {opts['out']}")
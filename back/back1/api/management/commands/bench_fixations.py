@@ -0,0 +1,57 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from api import gaze_analysis
+from api.bench import summarize, write_results
+from api.loadgen import SyntheticDevice
+
+
+class Command(BaseCommand):
+    help = (
+        "Time the streaming fixation detectors on synthetic gaze, one heartbeat "
+        "window per call, and report how many users at --hz one core keeps up with."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--hz", type=int, default=120, help="Gaze sampling rate.")
+        parser.add_argument("--seconds", type=int, default=600, help="Gaze per run.")
+        parser.add_argument("--window", type=float, default=5.0, help="Seconds per heartbeat window.")
+        parser.add_argument("--out", help="Write results as JSON to this path.")
+
+    def handle(self, *args, **opts):
+        gaze = SyntheticDevice("bench", gaze_hz=opts["hz"]).gaze(opts["hz"] * opts["seconds"])
+        samples = np.column_stack([gaze[f] for f in gaze.dtype.names]).astype(np.float64)
+        per_window = max(1, int(opts["hz"] * opts["window"]))
+        batches = [samples[i:i + per_window] for i in range(0, len(samples), per_window)]
+
+        results = []
+        for method in gaze_analysis.METHODS:
+            stream = gaze_analysis.FixationStream(gaze_analysis.Params.from_settings(method=method))
+            latencies, fixations = [], 0
+            for batch in batches:
+                t0 = time.perf_counter()
+                fixations += int(stream.metrics(batch)[0])
+                latencies.append(time.perf_counter() - t0)
+
+            stats = summarize(latencies)
+            busy = sum(latencies)
+            stats.update({
+                "method": method,
+                "hz": opts["hz"],
+                "fixations_per_sec": fixations / opts["seconds"],
+                "samples_per_sec": len(samples) / busy,
+                "users_per_core": len(samples) / busy / opts["hz"],
+            })
+            results.append(stats)
+            self.stdout.write(
+                f"{method}  {stats['samples_per_sec'] / 1000:8.0f}k samples/s  "
+                f"{stats['users_per_core']:7.0f} users at {opts['hz']} Hz per core  "
+                f"p50={stats['p50_ms']:.2f}ms p99={stats['p99_ms']:.2f}ms per window  "
+                f"{stats['fixations_per_sec']:.1f} fixations/s"
+            )
+
+        if opts["out"]:
+            write_results(opts["out"], "bench_fixations", results)
+            self.stdout.write(f"results written to {opts['out']}")
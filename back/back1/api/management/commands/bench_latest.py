@@ -0,0 +1,105 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from api.bench import fill_table, scratch_database, time_calls, timestamps, write_results
+from api.models import BiometricRecord, GazeRecord, UserTask
+
+# Indexes added in 0010; --without-indexes drops them to get a baseline
+TIMESTAMP_INDEXES = [
+    (BiometricRecord, "bio_ts_desc_idx"),
+    (UserTask, "task_ts_desc_idx"),
+    (GazeRecord, "gaze_ts_id_desc_idx"),
+]
+
+
+def latest_state():
+    return BiometricRecord.objects.order_by("-timestamp").first()
+
+
+def latest_tasks():
+    last = BiometricRecord.objects.order_by("-timestamp").first()
+    return list(last.tasks.all()) if last else []
+
+
+def latest_gaze():
+    return GazeRecord.objects.order_by("-timestamp").first()
+
+
+QUERIES = {
+    "latest_state": latest_state,
+    "latest_tasks": latest_tasks,
+    "latest_gaze": latest_gaze,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Time the latest_state / latest_tasks / latest_gaze queries on a "
+        "scratch database grown to each of --sizes rows per table."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes", default="10000,100000,1000000",
+            help="Comma-separated row counts, e.g. 10000,100000,1000000,10000000",
+        )
+        parser.add_argument("--repeat", type=int, default=200)
+        parser.add_argument("--without-indexes", action="store_true",
+                            help="Drop the timestamp indexes to measure the old layout.")
+        parser.add_argument("--explain", action="store_true",
+                            help="Print the query plan for each query.")
+        parser.add_argument("--out", help="Write results as JSON to this path.")
+
+    def handle(self, *args, **opts):
+        sizes = sorted(int(s) for s in opts["sizes"].split(","))
+        results = []
+
+        with scratch_database():
+            if opts["without_indexes"]:
+                with connection.schema_editor() as editor:
+                    for model, name in TIMESTAMP_INDEXES:
+                        index = next(i for i in model._meta.indexes if i.name == name)
+                        editor.remove_index(model, index)
+
+            bio_ts = timestamps(step_seconds=5.0)
+            gaze_ts = timestamps(step_seconds=1 / 30, jitter=0.01)
+            filled = 0
+
+            for size in sizes:
+                self.stdout.write(f"filling to {size:,} rows per table...")
+                grow = size - filled
+                offset = filled
+                fill_table(BiometricRecord, grow, {"timestamp": lambda i: bio_ts(offset + i)})
+                fill_table(GazeRecord, grow, {
+                    "timestamp": lambda i: gaze_ts(offset + i),
+                    "gaze_x": lambda i: float(i % 1920),
+                    "gaze_y": lambda i: float(i % 1080),
+                    "screen_w": lambda i: 1920.0,
+                    "screen_h": lambda i: 1080.0,
+                })
+                # roughly one task per heartbeat, attached to its record
+                fill_table(UserTask, grow, {
+                    "timestamp": lambda i: bio_ts(offset + i),
+                    "app": lambda i: "code",
+                    "title": lambda i: f"window {i % 20}",
+                    "record": lambda i: offset + i + 1,
+                })
+                filled = size
+                with connection.cursor() as cursor:
+                    cursor.execute("ANALYZE")
+
+                for name, fn in QUERIES.items():
+                    stats = time_calls(fn, opts["repeat"])
+                    stats.update({"query": name, "rows": size, "indexed": not opts["without_indexes"]})
+                    results.append(stats)
+                    self.stdout.write(
+                        f"  {name:<13} p50={stats['p50_ms']:.3f}ms p95={stats['p95_ms']:.3f}ms "
+                        f"p99={stats['p99_ms']:.3f}ms"
+                    )
+                    if opts["explain"]:
+                        qs = (GazeRecord if name == "latest_gaze" else BiometricRecord).objects
+                        self.stdout.write("    " + qs.order_by("-timestamp")[:1].explain())
+
+        if opts["out"]:
+            write_results(opts["out"], "bench_latest", results)
+            self.stdout.write(f"results written to {opts['out']}")
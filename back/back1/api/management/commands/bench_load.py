@@ -0,0 +1,251 @@
+import http.client
+import json
+import threading
+import time
+from collections import Counter
+from contextlib import nullcontext
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from api import codecs, loadgen, views
+from api.bench import scratch_database, summarize, write_results
+from api.models import FEATURE_FIELDS, BiometricRecord, GazeRecord, TaskEntry
+
+SCENARIOS = (
+    "biometric", "biometric_binary", "async_biometric",
+    "gaze", "gaze_binary", "async_gaze",
+    "latest_state", "predict",
+)
+DEFAULT_SCENARIOS = "biometric,biometric_binary,gaze,gaze_binary,latest_state,predict"
+
+
+def build_requests(scenario, count, devices, gaze_batch):
+    """
+    Pre-build ``count`` requests as (method, path, body, content_type,
+    headers, rows written) so generating payloads isn't timed.
+    """
+    out = []
+    for i in range(count):
+        dev = devices[i % len(devices)]
+        if scenario in ("biometric", "async_biometric", "biometric_binary", "predict"):
+            hb = dev.heartbeat()
+            rows = 1 + len(hb["tasks"])
+            if scenario == "biometric_binary":
+                out.append(("POST", "/api/biometric/", loadgen.heartbeat_struct(hb),
+                            codecs.HEARTBEAT_TYPE, {"X-Flow-Device": dev.key}, rows))
+            elif scenario == "predict":
+                flat = {**hb["typing"], **hb["mouse"], "idle_time_ms": hb["idle_time_ms"]}
+                out.append(("CALL", None, [float(flat.get(f, 0)) for f in FEATURE_FIELDS], None, None, 0))
+            else:
+                path = "/api/async/biometric/" if scenario.startswith("async") else "/api/biometric/"
+                out.append(("POST", path, json.dumps(hb).encode(), "application/json", {}, rows))
+        elif scenario in ("gaze", "async_gaze", "gaze_binary"):
+            samples = dev.gaze(gaze_batch)
+            if scenario == "gaze_binary":
+                out.append(("POST", "/api/gaze/", samples.tobytes(), codecs.GAZE_TYPE,
+                            {"X-Flow-Device": dev.key}, gaze_batch))
+            else:
+                path = "/api/async/gaze/" if scenario.startswith("async") else "/api/gaze/"
+                body = json.dumps(loadgen.gaze_json(samples, dev.key)).encode()
+                out.append(("POST", path, body, "application/json", {}, gaze_batch))
+        elif scenario == "latest_state":
+            out.append(("GET", "/api/latest_state/", b"", None, {}, 0))
+    return out
+
+
+def client_sender():
+    client = Client()
+
+    def send(method, path, body, content_type, headers):
+        if method == "CALL":
+            views.predict_flow(body)
+            return 200
+        if method == "GET":
+            return client.get(path, headers=headers).status_code
+        return client.generic(method, path, body, content_type=content_type, headers=headers).status_code
+
+    return send
+
+
+def http_sender(url):
+    parts = urlsplit(url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+    prefix = parts.path.rstrip("/")
+
+    def send(method, path, body, content_type, headers):
+        if method == "CALL":
+            raise CommandError("the predict scenario only runs in-process (without --url)")
+        headers = dict(headers)
+        if content_type:
+            headers["Content-Type"] = content_type
+        conn.request(method, prefix + path, body=body or None, headers=headers)
+        response = conn.getresponse()
+        response.read()
+        return response.status
+
+    return send
+
+
+def db_rows():
+    return sum(m.objects.count() for m in (BiometricRecord, TaskEntry, GazeRecord))
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay synthetic heartbeats, task lists and gaze streams against the "
+        "ingestion and read endpoints, in-process (Django test client on a "
+        "scratch database) or over HTTP (--url), and report latency "
+        "percentiles, requests/s and DB rows/s per scenario."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--scenarios", default=DEFAULT_SCENARIOS,
+                            help=f"Comma-separated, from: {', '.join(SCENARIOS)}.")
+        parser.add_argument("--requests", type=int, default=300, help="Requests per scenario.")
+        parser.add_argument("--concurrency", type=int, default=1)
+        parser.add_argument("--rate", type=float, default=0,
+                            help="Target requests/s per scenario (0 = as fast as possible).")
+        parser.add_argument("--devices", type=int, default=10, help="Simulated clients.")
+        parser.add_argument("--gaze-batch", type=int, default=150,
+                            help="Gaze samples per request (150 = 5 s at 30 Hz).")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--url", help="Target a running server, e.g. http://127.0.0.1:8000.")
+        parser.add_argument("--out", help="Write results as JSON to this path.")
+        parser.add_argument("--baseline", help="Compare against a previous --out file.")
+        parser.add_argument("--threshold", type=float, default=10.0,
+                            help="Percent change in req/s or p95 flagged as a regression.")
+        parser.add_argument("--fail-on-regression", action="store_true")
+
+    def run(self, make_sender, requests, concurrency, rate):
+        latencies = []
+        statuses = Counter()
+        rows_ok = 0
+        lock = threading.Lock()
+        it = iter(enumerate(requests))
+
+        def worker():
+            nonlocal rows_ok
+            send = make_sender()
+            local, local_status, local_rows = [], Counter(), 0
+            while True:
+                with lock:
+                    item = next(it, None)
+                if item is None:
+                    break
+                i, (method, path, body, content_type, headers, rows) = item
+                if rate:
+                    # open-loop pacing: request i is due at i / rate
+                    delay = started + i / rate - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                t0 = time.perf_counter()
+                try:
+                    status = send(method, path, body, content_type, headers)
+                except CommandError:
+                    raise
+                except Exception as exc:
+                    status = type(exc).__name__
+                local.append(time.perf_counter() - t0)
+                local_status[str(status)] += 1
+                if isinstance(status, int) and status < 300:
+                    local_rows += rows
+            with lock:
+                latencies.extend(local)
+                statuses.update(local_status)
+                rows_ok += local_rows
+            connections.close_all()
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return time.perf_counter() - started, latencies, statuses, rows_ok
+
+    def handle(self, *args, **opts):
+        scenarios = [s.strip() for s in opts["scenarios"].split(",") if s.strip()]
+        unknown = set(scenarios) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f"unknown scenarios: {', '.join(sorted(unknown))}")
+        url = opts["url"]
+        if url and "predict" in scenarios:
+            scenarios.remove("predict")
+            self.stdout.write("skipping predict: it only runs in-process")
+
+        results = []
+        if not url:
+            # lets the test client through ALLOWED_HOSTS, as under manage.py test
+            setup_test_environment()
+        try:
+            with (nullcontext() if url else scratch_database()):
+                self.run_scenarios(scenarios, url, opts, results)
+        finally:
+            if not url:
+                teardown_test_environment()
+
+        if opts["out"]:
+            write_results(opts["out"], "bench_load", results)
+            self.stdout.write(f"results written to {opts['out']}")
+        if opts["baseline"]:
+            self.compare(opts["baseline"], results, opts["threshold"], opts["fail_on_regression"])
+
+    def run_scenarios(self, scenarios, url, opts, results):
+        if not url:
+            # load the model outside the timed section
+            views.predict_flow([0.0] * len(FEATURE_FIELDS))
+
+        for scenario in scenarios:
+            devices = [
+                loadgen.SyntheticDevice(f"{scenario}-{d}", seed=opts["seed"])
+                for d in range(opts["devices"])
+            ]
+            requests = build_requests(scenario, opts["requests"], devices, opts["gaze_batch"])
+            make_sender = (lambda: http_sender(url)) if url else client_sender
+            before = None if url else db_rows()
+
+            elapsed, latencies, statuses, rows_ok = self.run(
+                make_sender, requests, opts["concurrency"], opts["rate"],
+            )
+            # in-process we can count what landed; over HTTP, trust the 2xx responses
+            rows = rows_ok if url else db_rows() - before
+            stats = summarize(latencies)
+            stats.update({
+                "scenario": scenario,
+                "transport": "http" if url else "client",
+                "concurrency": opts["concurrency"],
+                "target_rate": opts["rate"] or None,
+                "requests_per_sec": len(latencies) / elapsed,
+                "rows_per_sec": rows / elapsed,
+                "statuses": dict(statuses),
+            })
+            results.append(stats)
+            self.stdout.write(
+                f"{scenario:<17} {stats['requests_per_sec']:8.1f} req/s "
+                f"{stats['rows_per_sec']:9.1f} rows/s  p50={stats['p50_ms']:.2f}ms "
+                f"p95={stats['p95_ms']:.2f}ms p99={stats['p99_ms']:.2f}ms  {dict(statuses)}"
+            )
+
+    def compare(self, path, results, threshold, fail):
+        with open(path, encoding="utf-8") as f:
+            baseline = {r["scenario"]: r for r in json.load(f)["results"]}
+        regressions = []
+        for r in results:
+            old = baseline.get(r["scenario"])
+            if not old:
+                continue
+            rps = 100.0 * (r["requests_per_sec"] / old["requests_per_sec"] - 1)
+            p95 = 100.0 * (r["p95_ms"] / old["p95_ms"] - 1)
+            flagged = rps < -threshold or p95 > threshold
+            if flagged:
+                regressions.append(r["scenario"])
+            self.stdout.write(
+                f"{r['scenario']:<17} req/s {rps:+6.1f}%  p95 {p95:+6.1f}%"
+                + ("  REGRESSION" if flagged else "")
+            )
+        if regressions and fail:
+            raise CommandError(f"regressed vs {path}: {', '.join(regressions)}")
@@ -0,0 +1,69 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from api.models import BiometricRecord, UserTask
+from api.task_catalogue import Window, catalogue
+
+
+class Command(BaseCommand):
+    help = (
+        "Convert heartbeats stored before the window catalogue: fill task_refs "
+        "from their UserTask rows and, with --delete, drop those rows. Safe to "
+        "interrupt and re-run; converted records are skipped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=5000, help="Heartbeats per transaction.")
+        parser.add_argument("--delete", action="store_true",
+                            help="Delete the converted UserTask rows.")
+
+    def delete_tasks(self, record_ids):
+        """
+        Plain DELETE of the records' UserTask rows. QuerySet.delete() would
+        load every row to send post_delete signals, and the cache entries
+        those invalidate are still valid: the windows didn't change.
+        """
+        table = connection.ops.quote_name(UserTask._meta.db_table)
+        column = connection.ops.quote_name(UserTask._meta.get_field("record").column)
+        placeholders = ", ".join(["%s"] * len(record_ids))
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {table} WHERE {column} IN ({placeholders})", record_ids)
+            return cursor.rowcount
+
+    def handle(self, *args, **opts):
+        records = converted = created = deleted = 0
+        last_id = 0
+        while True:
+            with transaction.atomic():
+                chunk = list(
+                    BiometricRecord.objects.filter(id__gt=last_id, task_refs__isnull=True)
+                    .order_by("id").only("id")[:opts["chunk_size"]]
+                )
+                if not chunk:
+                    break
+                ids = [r.id for r in chunk]
+                windows = {pk: [] for pk in ids}
+                rows = (
+                    UserTask.objects.filter(record_id__in=ids)
+                    .order_by("record_id", "id")
+                    .values_list("record_id", "app", "title", "url", "active")
+                )
+                for record_id, app, title, url, active in rows:
+                    windows[record_id].append(
+                        Window.from_dict({"app": app, "title": title, "url": url, "active": active})
+                    )
+                    converted += 1
+
+                created += catalogue.assign([(r, windows[r.id]) for r in chunk])
+                BiometricRecord.objects.bulk_update(chunk, ["task_refs"], batch_size=1000)
+                if opts["delete"]:
+                    deleted += self.delete_tasks(ids)
+
+            records += len(chunk)
+            last_id = ids[-1]
+            self.stdout.write(f"  {records} heartbeats, {converted} windows")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"converted {records} heartbeats ({converted} windows, "
+            f"{created} new catalogue entries), deleted {deleted} UserTask rows"
+        ))
@@ -0,0 +1,150 @@
+import json
+import os
+from itertools import islice
+from pathlib import Path
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from api import features
+from api.models import BiometricRecord, GazeRecord, TaskEntry, UserTask
+
+STATE_FILE = "_state.json"
+
+# dataset name -> (model, exported columns, partition column); "id" must come first
+DATASETS = {
+    "biometrics": (
+        BiometricRecord,
+        ("id", "timestamp", "user_id", "device_id", "session_id", *features.NAMES,
+         "state_prediction", "model_version", "gaze_x", "gaze_y", "screen_w", "screen_h",
+         "task_refs"),
+        "timestamp",
+    ),
+    # window catalogue; biometrics.task_ids / active_task_ids point here
+    "task_entries": (
+        TaskEntry,
+        ("id", "first_seen", "app", "title", "url"),
+        "first_seen",
+    ),
+    # per-heartbeat window rows written before the catalogue
+    "tasks": (
+        UserTask,
+        ("id", "record_id", "device_id", "timestamp", "app", "title", "url", "active"),
+        "timestamp",
+    ),
+    "gaze": (
+        GazeRecord,
+        ("id", "timestamp", "user_id", "device_id", "session_id",
+         "gaze_x", "gaze_y", "screen_w", "screen_h"),
+        "timestamp",
+    ),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Incrementally export training data as Parquet or Arrow IPC, "
+        "partitioned by day. Only rows newer than the last run are written."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--out", default="exports", help="Output directory.")
+        parser.add_argument("--format", choices=("parquet", "arrow"), default="parquet")
+        parser.add_argument("--chunk-size", type=int, default=50_000)
+        parser.add_argument("--with-tasks", action="store_true",
+                            help="Also export the window catalogue (join on task_ids) "
+                                 "and legacy UserTask rows (join on record_id).")
+        parser.add_argument("--with-gaze", action="store_true",
+                            help="Also export GazeRecord rows (join on timestamp).")
+        parser.add_argument("--reset", action="store_true",
+                            help="Forget the high-water marks and export everything again.")
+
+    def handle(self, *args, **opts):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise CommandError("export_training needs pyarrow: pip install pyarrow")
+
+        out = Path(opts["out"])
+        out.mkdir(parents=True, exist_ok=True)
+        state_path = out / STATE_FILE
+        state = {} if opts["reset"] or not state_path.exists() else json.loads(state_path.read_text())
+
+        names = ["biometrics"]
+        if opts["with_tasks"]:
+            names += ["task_entries", "tasks"]
+        if opts["with_gaze"]:
+            names.append("gaze")
+
+        for name in names:
+            model, columns, partition = DATASETS[name]
+            high_water = state.get(name, 0)
+            rows = (
+                model.objects.filter(id__gt=high_water)
+                .order_by("id")
+                .values_list(*columns)
+                .iterator(chunk_size=opts["chunk_size"])
+            )
+
+            exported = 0
+            while True:
+                chunk = list(islice(rows, opts["chunk_size"]))
+                if not chunk:
+                    break
+                self.write_chunk(out / name, columns, partition, chunk, opts["format"])
+                exported += len(chunk)
+                # advance the mark only once the chunk is safely on disk
+                state[name] = chunk[-1][0]
+                self.save_state(state_path, state)
+
+            self.stdout.write(f"{name}: exported {exported} rows (high-water id {state.get(name, 0)})")
+
+    def write_chunk(self, root, columns, partition, chunk, fmt):
+        import pyarrow as pa
+
+        arrays = {}
+        for col, values in zip(columns, zip(*chunk)):
+            if col in ("timestamp", "first_seen"):
+                arrays[col] = pa.array(values, type=pa.timestamp("us", tz="UTC"))
+            elif col == "task_refs":
+                # [[entry id, active], ...] -> two list columns; null for pre-catalogue rows
+                ids = pa.list_(pa.int64())
+                arrays["task_ids"] = pa.array(
+                    [None if refs is None else [e for e, _ in refs] for refs in values], type=ids)
+                arrays["active_task_ids"] = pa.array(
+                    [None if refs is None else [e for e, a in refs if a] for refs in values], type=ids)
+            elif col in ("user_id", "device_id", "record_id"):
+                # nullable keys; typed so all-null chunks keep the same schema
+                arrays[col] = pa.array(values, type=pa.int64())
+            else:
+                arrays[col] = pa.array(values)
+        table = pa.table(arrays)
+
+        days = arrays[partition].to_numpy(zero_copy_only=False).astype("datetime64[D]")
+        unique_days, inverse = np.unique(days, return_inverse=True)
+        first_id, last_id = chunk[0][0], chunk[-1][0]
+
+        for i, day in enumerate(unique_days):
+            part = table.take(pa.array(np.flatnonzero(inverse == i)))
+            part_dir = root / f"date={day}"
+            part_dir.mkdir(parents=True, exist_ok=True)
+            path = part_dir / f"part-{first_id:012d}-{last_id:012d}.{fmt}"
+            self.write_table(part, path, fmt)
+
+    def write_table(self, table, path, fmt):
+        tmp = path.with_suffix(path.suffix + ".tmp")
+        if fmt == "parquet":
+            import pyarrow.parquet as pq
+
+            pq.write_table(table, tmp, compression="zstd")
+        else:
+            import pyarrow as pa
+
+            with pa.OSFile(str(tmp), "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp, path)
+
+    def save_state(self, path, state):
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(state, indent=2))
+        os.replace(tmp, path)
@@ -0,0 +1,24 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api.models import ClientReceipt
+
+
+class Command(BaseCommand):
+    help = (
+        "Forget client ids older than FLOW_RECEIPT_RETENTION_DAYS. Replays older "
+        "than that are no longer recognised as duplicates. Run it from cron."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=float, default=None,
+                            help="Retention in days (default FLOW_RECEIPT_RETENTION_DAYS).")
+
+    def handle(self, *args, **opts):
+        days = opts["days"] if opts["days"] is not None else settings.FLOW_RECEIPT_RETENTION_DAYS
+        cutoff = timezone.now() - timedelta(days=days)
+        deleted = ClientReceipt.objects.filter(received_at__lt=cutoff)._raw_delete(ClientReceipt.objects.db)
+        self.stdout.write(f"deleted {deleted} receipts received before {cutoff.isoformat()}")
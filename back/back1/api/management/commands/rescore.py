@@ -0,0 +1,173 @@
+import json
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from api import features, history, latest_cache, model_registry
+from api.models import BiometricRecord
+
+# ids per UPDATE ... WHERE id IN (...), under SQLite's bound-parameter limit
+UPDATE_BATCH = 5000
+
+_worker_model = None
+
+
+def _init_worker(version):
+    global _worker_model
+    import django
+    from django.apps import apps
+
+    if not apps.ready:   # spawn start method
+        django.setup()
+    _worker_model = model_registry.load_model(version)
+
+
+def _score(X):
+    return _worker_model.run(X)
+
+
+def _chunks(qs, last_id, size):
+    """Yield (ids, old labels, N x 10 float32 matrix) chunks in id order."""
+    while True:
+        rows = list(
+            qs.filter(id__gt=last_id)
+            .order_by("id")
+            .values_list("id", "state_prediction", *features.NAMES)[:size]
+        )
+        if not rows:
+            return
+        ids = np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows))
+        old = np.array([r[1] for r in rows], dtype=object)
+        X = features.from_rows(rows, offset=2)
+        last_id = rows[-1][0]
+        yield ids, old, X
+
+
+def _write(ids, labels, version):
+    """One UPDATE per distinct label (and UPDATE_BATCH ids), in one transaction."""
+    with transaction.atomic():
+        for label in np.unique(labels):
+            selected = ids[labels == label].tolist()
+            for i in range(0, len(selected), UPDATE_BATCH):
+                BiometricRecord.objects.filter(id__in=selected[i:i + UPDATE_BATCH]).update(
+                    state_prediction=str(label), model_version=version,
+                )
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-score stored BiometricRecords with a model version and write the "
+        "predictions back. Resumable: progress is checkpointed after every chunk."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--model", default=None,
+                            help="Model version (file stem in FLOW_MODEL_DIR); default: the served model.")
+        parser.add_argument("--chunk-size", type=int, default=20_000)
+        parser.add_argument("--workers", type=int, default=0,
+                            help="Score in this many worker processes (0 = in this process).")
+        parser.add_argument("--checkpoint", default=None,
+                            help="Checkpoint file (default .rescore-<version>.json; removed once the run completes).")
+        parser.add_argument("--reset", action="store_true", help="Ignore the checkpoint and start over.")
+        parser.add_argument("--only-stale", action="store_true",
+                            help="Skip rows already scored by this version.")
+        parser.add_argument("--rebuild-history", action="store_true",
+                            help="Rebuild the flow-history aggregates afterwards (time per state changes).")
+
+    def handle(self, *args, **opts):
+        try:
+            model = model_registry.load_model(opts["model"])
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        if model.n_features and model.n_features > features.N_FEATURES:
+            raise CommandError(
+                f"{model.version} takes {model.n_features} inputs; rolling features "
+                "only exist at ingestion time, so it can't be re-scored offline"
+            )
+
+        checkpoint = Path(opts["checkpoint"] or f".rescore-{model.version}.json")
+        state = {}
+        if checkpoint.exists() and not opts["reset"]:
+            state = json.loads(checkpoint.read_text())
+            if state.get("version") != model.version:
+                state = {}
+        last_id = state.get("last_id", 0)
+        done = state.get("rows", 0)
+        if last_id:
+            self.stdout.write(f"resuming {model.version} after id {last_id} ({done} rows done)")
+
+        qs = BiometricRecord.objects.all()
+        if opts["only_stale"]:
+            qs = qs.exclude(model_version=model.version)
+        chunks = _chunks(qs, last_id, opts["chunk_size"])
+
+        workers = opts["workers"]
+        pool = None
+        if workers > 0:
+            methods = multiprocessing.get_all_start_methods()
+            pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("fork" if "fork" in methods else "spawn"),
+                initializer=_init_worker,
+                initargs=(model.name,),
+            )
+
+        started = time.perf_counter()
+        rows = changed = 0
+        try:
+            pending = deque()
+            while True:
+                # keep up to 2 chunks per worker in flight; write back in id order
+                while len(pending) < max(2 * workers, 1):
+                    chunk = next(chunks, None)
+                    if chunk is None:
+                        break
+                    ids, old, X = chunk
+                    X = X[:, :model.n_features]
+                    scored = pool.submit(_score, X) if pool else model.run(X)
+                    pending.append((ids, old, scored))
+                if not pending:
+                    break
+
+                ids, old, scored = pending.popleft()
+                labels = scored.result() if pool else scored
+                _write(ids, labels, model.version)
+
+                rows += len(ids)
+                changed += int(np.count_nonzero(old != labels.astype(object)))
+                last_id = int(ids[-1])
+                tmp = checkpoint.with_suffix(".tmp")
+                tmp.write_text(json.dumps({"version": model.version, "last_id": last_id, "rows": done + rows}))
+                os.replace(tmp, checkpoint)
+
+                elapsed = time.perf_counter() - started
+                self.stdout.write(f"  {done + rows} rows (last id {last_id}), {rows / elapsed:,.0f} rows/s")
+        finally:
+            if pool:
+                pool.shutdown(cancel_futures=True)
+        # finished: the next run (e.g. after the model file changes) starts over
+        checkpoint.unlink(missing_ok=True)
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"re-scored {rows} rows with {model.version} in {elapsed:.1f}s "
+            f"({rows / elapsed if elapsed else 0:,.0f} rows/s), {changed} predictions changed"
+        ))
+
+        if rows:
+            latest_cache.clear(latest_cache.STATE)
+            if not settings.FLOW_REDIS_URL:
+                self.stdout.write(
+                    "latest-state cache is per process (FLOW_REDIS_URL unset): running servers "
+                    f"show the new predictions within FLOW_LATEST_CACHE_TTL ({settings.FLOW_LATEST_CACHE_TTL}s)"
+                )
+        if opts["rebuild_history"]:
+            self.stdout.write(f"rebuilt flow history from {history.rebuild()} heartbeats")
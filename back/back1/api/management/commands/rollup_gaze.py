@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api import gaze_rollup
+
+
+class Command(BaseCommand):
+    help = (
+        "Roll raw gaze samples up into per-second and per-minute buckets, "
+        "then prune expired raw rows and second buckets. Safe to run from cron."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=None,
+                            help="Raw rows aggregated per transaction (default FLOW_GAZE_ROLLUP_CHUNK).")
+        parser.add_argument("--batch-size", type=int, default=None,
+                            help="Rows per prune DELETE (default FLOW_GAZE_PRUNE_BATCH).")
+        parser.add_argument("--pause-ms", type=float, default=0,
+                            help="Sleep between prune batches to give writers the lock.")
+        parser.add_argument("--no-prune", action="store_true", help="Only roll up.")
+
+    def handle(self, *args, **opts):
+        started = time.perf_counter()
+        rows = gaze_rollup.rollup(opts["chunk_size"])
+        self.stdout.write(
+            f"rolled up {rows} raw rows in {time.perf_counter() - started:.2f}s "
+            f"(high-water id {gaze_rollup.watermark()})"
+        )
+
+        if not opts["no_prune"]:
+            started = time.perf_counter()
+            deleted = gaze_rollup.prune(opts["batch_size"], opts["pause_ms"])
+            self.stdout.write(
+                f"pruned {deleted['raw']} raw rows and {deleted['second']} second buckets "
+                f"in {time.perf_counter() - started:.2f}s"
+            )
@@ -0,0 +1,316 @@
+"""
+Prometheus metrics for the ingestion and inference hot paths.
+
+Counters and histograms live in this process and are rendered in the
+Prometheus text format by ``GET /metrics``. Request handlers time their
+stages with ``stage()``:
+
+    with metrics.stage("biometric", "parse"):
+        ...
+
+Gauges (queue depths, shadow agreement) aren't stored here. The metrics
+view reads them from the batcher, ingest pipeline and live broadcaster
+when it is scraped.
+
+Everything is per process. With several workers, scrape each one, or
+expect each scrape to show only the worker that answered it.
+
+``profiler`` is a sampling profiler that can be switched on in a live
+worker (``/api/profile/``, staff only). It samples the Python stack
+of every thread at a fixed interval and keeps the counts as folded
+stacks, the input format of flamegraph.pl and speedscope.
+"""
+import asyncio
+import bisect
+import functools
+import math
+import sys
+import threading
+import time
+from collections import Counter as _Counter
+
+INF = float("inf")
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, INF)
+SIZE_BUCKETS = (128, 512, 2048, 8192, 32768, 131072, 524288, 2097152, INF)
+ROW_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, INF)
+
+_registry = []
+
+
+def _format_labels(names, values, extra=""):
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value):
+    if value == INF:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}")
+        return lines
+
+
+class _Timer:
+    __slots__ = ("hist", "labels", "started")
+
+    def __init__(self, hist, labels):
+        self.hist = hist
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.hist.observe(time.perf_counter() - self.started, *self.labels)
+        return False
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self._series = {}   # labels -> [bucket counts..., sum]
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, *labels):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * len(self.buckets) + [0.0]
+            series[i] += 1
+            series[-1] += value
+
+    def time(self, *labels):
+        return _Timer(self, labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._series.items())
+        for key, series in items:
+            total = 0
+            for bound, n in zip(self.buckets, series):
+                total += n
+                le = 'le="' + _format_value(float(bound)) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {total}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(series[-1])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {total}")
+        return lines
+
+
+requests = Counter(
+    "flow_requests_total", "Ingestion requests by endpoint and response status.",
+    ("endpoint", "status"),
+)
+stage_seconds = Histogram(
+    "flow_stage_seconds", "Time spent in each stage of a request, in seconds.",
+    ("endpoint", "stage"),
+)
+payload_bytes = Histogram(
+    "flow_payload_bytes", "Request body size by endpoint and content type.",
+    ("endpoint", "content_type"), SIZE_BUCKETS,
+)
+# content_type label values; anything else a client sends is "other", so
+# the header can't mint new series
+CONTENT_TYPES = {
+    "application/json": "json",
+    "application/x-ndjson": "ndjson",
+    "application/jsonl": "ndjson",
+    "application/msgpack": "msgpack",
+    "application/x-flow-heartbeat": "struct",
+    "application/x-flow-gaze": "struct",
+}
+inference_seconds = Histogram(
+    "flow_inference_seconds", "Wall time of one sess.run call, in seconds.",
+    ("role",),
+)
+inference_batch_rows = Histogram(
+    "flow_inference_batch_rows", "Rows per sess.run call.", ("role",), ROW_BUCKETS,
+)
+inference_queue_seconds = Histogram(
+    "flow_inference_queue_seconds", "Time a row waited in the micro-batcher before its batch ran.",
+)
+rows_written = Counter("flow_rows_written_total", "Rows inserted, by table.", ("table",))
+
+
+def stage(endpoint, name):
+    """Context manager timing one stage of ``endpoint`` into flow_stage_seconds."""
+    return stage_seconds.time(endpoint, name)
+
+
+def instrument(endpoint):
+    """
+    View decorator: counts requests by status, times the whole view as
+    stage "total" and records POST body sizes. Works for sync and async views.
+    """
+    def record(request, response, started):
+        stage_seconds.observe(time.perf_counter() - started, endpoint, "total")
+        requests.inc(endpoint, str(response.status_code))
+
+    def observe_body(request):
+        if request.method == "POST":
+            content_type = CONTENT_TYPES.get(request.content_type, "other")
+            payload_bytes.observe(len(request.body), endpoint, content_type)
+
+    def decorator(view):
+        if asyncio.iscoroutinefunction(view):
+            @functools.wraps(view)
+            async def wrapper(request, *args, **kwargs):
+                started = time.perf_counter()
+                observe_body(request)
+                response = await view(request, *args, **kwargs)
+                record(request, response, started)
+                return response
+        else:
+            @functools.wraps(view)
+            def wrapper(request, *args, **kwargs):
+                started = time.perf_counter()
+                observe_body(request)
+                response = view(request, *args, **kwargs)
+                record(request, response, started)
+                return response
+        return wrapper
+    return decorator
+
+
+def gauge(name, help, samples, labels=()):
+    """Render a gauge family from [(label values, value), ...] read at scrape time."""
+    lines = [f"# HELP {name} {help}", f"# TYPE {name} gauge"]
+    for key, value in samples:
+        if value is None or (isinstance(value, float) and math.isnan(value)):
+            continue
+        lines.append(f"{name}{_format_labels(labels, key)} {_format_value(value)}")
+    return lines
+
+
+def render(extra=()):
+    """The whole registry plus ``extra`` pre-rendered lines, in Prometheus text format."""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    lines.extend(extra)
+    return "\n".join(lines) + "\n"
+
+
+# ===== Sampling profiler =====
+
+class SamplingProfiler:
+    """
+    Samples every thread's Python stack each ``interval_ms`` from a
+    background thread and counts identical stacks. Costs one
+    ``sys._current_frames()`` walk per sample, so a 10 ms interval is
+    cheap enough for a production worker for a few minutes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self.stacks = _Counter()
+        self.samples = 0
+        self.started_at = None
+        self.stopped_at = None
+        self.interval_ms = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, seconds=30, interval_ms=10):
+        """Start a fresh profile for ``seconds``; False if one is already running."""
+        with self._lock:
+            if self.running:
+                return False
+            self.stacks = _Counter()
+            self.samples = 0
+            self.interval_ms = interval_ms
+            self.started_at = time.time()
+            self.stopped_at = None
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, args=(seconds, interval_ms / 1000.0),
+                name="flow-profiler", daemon=True,
+            )
+            self._thread.start()
+            return True
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self, seconds, interval):
+        me = threading.get_ident()
+        deadline = time.monotonic() + seconds
+        while not self._stop.wait(interval) and time.monotonic() < deadline:
+            frames = sys._current_frames()
+            sample = _Counter()
+            for thread_id, frame in frames.items():
+                if thread_id != me:
+                    sample[_fold(frame)] += 1
+            with self._lock:
+                self.stacks.update(sample)
+                self.samples += 1
+        self.stopped_at = time.time()
+
+    def folded(self):
+        """Collapsed stacks, one "frame;frame;... count" line each, hottest first."""
+        with self._lock:
+            items = self.stacks.most_common()
+        return "".join(f"{stack} {n}\n" for stack, n in items)
+
+    def status(self):
+        with self._lock:
+            return {
+                "running": self.running,
+                "samples": self.samples,
+                "interval_ms": self.interval_ms,
+                "started_at": self.started_at,
+                "stopped_at": self.stopped_at,
+                "distinct_stacks": len(self.stacks),
+            }
+
+
+def _fold(frame):
+    parts = []
+    while frame is not None:
+        code = frame.f_code
+        parts.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(parts))
+
+
+profiler = SamplingProfiler()
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_gazerecord'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='biometricrecord',
+            name='model_version',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+    ]
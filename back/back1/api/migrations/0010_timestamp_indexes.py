@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_biometricrecord_model_version'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='biometricrecord',
+            index=models.Index(fields=['-timestamp'], name='bio_ts_desc_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='biometricrecord',
+            index=models.Index(fields=['state_prediction', 'timestamp'], name='bio_state_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='gazerecord',
+            index=models.Index(fields=['-timestamp', '-id'], name='gaze_ts_id_desc_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='usertask',
+            index=models.Index(fields=['-timestamp'], name='task_ts_desc_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='usertask',
+            index=models.Index(fields=['record', 'timestamp'], name='task_record_ts_idx'),
+        ),
+    ]
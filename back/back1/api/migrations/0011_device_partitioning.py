@@ -0,0 +1,89 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:49
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_timestamp_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='biometricrecord',
+            name='session_id',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='biometricrecord',
+            name='user',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='gazerecord',
+            name='session_id',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='gazerecord',
+            name='user',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.CreateModel(
+            name='Device',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('label', models.CharField(blank=True, max_length=200)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='flow_devices', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='biometricrecord',
+            name='device',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.device'),
+        ),
+        migrations.AddField(
+            model_name='gazerecord',
+            name='device',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.device'),
+        ),
+        migrations.AddField(
+            model_name='usertask',
+            name='device',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.device'),
+        ),
+        migrations.AddIndex(
+            model_name='biometricrecord',
+            index=models.Index(fields=['user', '-timestamp'], name='bio_user_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='biometricrecord',
+            index=models.Index(fields=['device', '-timestamp'], name='bio_device_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='biometricrecord',
+            index=models.Index(fields=['device', 'session_id', '-timestamp'], name='bio_session_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='gazerecord',
+            index=models.Index(fields=['user', '-timestamp', '-id'], name='gaze_user_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='gazerecord',
+            index=models.Index(fields=['device', '-timestamp', '-id'], name='gaze_device_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='gazerecord',
+            index=models.Index(fields=['device', 'session_id', '-timestamp', '-id'], name='gaze_session_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='usertask',
+            index=models.Index(fields=['device', '-timestamp'], name='task_device_ts_idx'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:55
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_gaze_rollups'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FlowDay',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.DateTimeField()),
+                ('heartbeats', models.IntegerField(default=0)),
+                ('seconds_by_state', models.JSONField(default=dict)),
+                ('metric_sums', models.JSONField(default=dict)),
+                ('app_seconds', models.JSONField(default=dict)),
+                ('device', models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.device')),
+                ('user', models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['bucket'], name='flow_day_bucket_idx'), models.Index(fields=['device', 'bucket'], name='flow_day_device_idx'), models.Index(fields=['user', 'bucket'], name='flow_day_user_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='FlowHour',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.DateTimeField()),
+                ('heartbeats', models.IntegerField(default=0)),
+                ('seconds_by_state', models.JSONField(default=dict)),
+                ('metric_sums', models.JSONField(default=dict)),
+                ('app_seconds', models.JSONField(default=dict)),
+                ('device', models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.device')),
+                ('user', models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['bucket'], name='flow_hour_bucket_idx'), models.Index(fields=['device', 'bucket'], name='flow_hour_device_idx'), models.Index(fields=['user', 'bucket'], name='flow_hour_user_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 21:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_flow_history'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaskEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(max_length=32, unique=True)),
+                ('app', models.CharField(max_length=200)),
+                ('title', models.CharField(max_length=500)),
+                ('url', models.CharField(blank=True, max_length=1000)),
+                ('first_seen', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='biometricrecord',
+            name='task_refs',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
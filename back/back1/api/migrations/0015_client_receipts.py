@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 21:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_task_catalogue'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClientReceipt',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('client_id', models.CharField(max_length=64, unique=True)),
+                ('kind', models.CharField(max_length=16)),
+                ('record_id', models.BigIntegerField(blank=True, null=True)),
+                ('count', models.IntegerField(default=0)),
+                ('received_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,308 @@
+"""
+Lazy loading and hot-swapping of the flow-state ONNX model.
+
+Nothing here touches onnxruntime until the first prediction (or an
+explicit ``warm_up()`` from the WSGI/ASGI entry points), so management
+commands that never predict don't pay the import and model-load cost.
+
+Models are addressed by name, the file stem of an ``.onnx`` file in
+FLOW_MODEL_DIR. A loaded model's ``version`` is the name plus a short
+hash of the file's contents ("flow_model@3fa2c1d9e0b4"). Records store
+that version, so predictions from a replaced file with the same name can
+still be told apart. ``activate()`` loads a model in a background thread,
+warms it up and only then swaps it in as the live or shadow model, so
+requests never wait on a model load.
+
+Activations are published to the FLOW_LATEST_CACHE cache. Every worker
+checks that cache at most every FLOW_MODEL_SYNC_SECONDS and loads what
+another worker activated. With the local-memory default (no
+FLOW_REDIS_URL) the cache is per process, so an activation only reaches
+the worker that handled it.
+
+Settings:
+  FLOW_MODEL_PATH            path to the .onnx file served at start-up
+  FLOW_MODEL_DIR             directory other versions are loaded from
+  FLOW_ONNX_PROVIDERS        execution providers, in priority order
+  FLOW_ONNX_SESSION_OPTIONS  dict of SessionOptions overrides, see below
+  FLOW_MODEL_WARMUP          load + run a dummy batch at worker start
+  FLOW_MODEL_SYNC_SECONDS    how often workers look for activations by others
+"""
+import hashlib
+import logging
+import re
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+_GRAPH_OPT_LEVELS = {
+    "disable": "ORT_DISABLE_ALL",
+    "basic": "ORT_ENABLE_BASIC",
+    "extended": "ORT_ENABLE_EXTENDED",
+    "all": "ORT_ENABLE_ALL",
+}
+
+_EXECUTION_MODES = {
+    "sequential": "ORT_SEQUENTIAL",
+    "parallel": "ORT_PARALLEL",
+}
+
+_VERSION_RE = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.-]*$")
+
+_live = None
+_shadow = None
+_lock = threading.Lock()
+
+# Outcome of the most recent activate() call, for status()
+_last_load = {}
+
+_SHARED_KEY = "flow:models:active"
+# the shared activations this process has applied, and when it last looked
+_synced = {"state": {}, "checked": None}
+_sync_lock = threading.Lock()
+
+
+class LoadedModel:
+    """An InferenceSession plus the bits of metadata callers need."""
+
+    def __init__(self, name, session, load_seconds=0.0, digest=""):
+        self.name = name
+        self.version = f"{name}@{digest}" if digest else name
+        self.session = session
+        self.load_seconds = load_seconds
+        self.loaded_at = time.time()
+
+        inp = session.get_inputs()[0]
+        self.input_name = inp.name
+        self.n_features = inp.shape[1] if isinstance(inp.shape[1], int) else None
+
+    def run(self, X):
+        """Return the label column for an N x n_features float32 matrix."""
+        return self.session.run(None, {self.input_name: X})[0]
+
+    def warm_up(self):
+        width = self.n_features or 10
+        self.run(np.zeros((1, width), dtype=np.float32))
+
+    def describe(self):
+        return {
+            "name": self.name,
+            "version": self.version,
+            "n_features": self.n_features,
+            "load_ms": round(self.load_seconds * 1000.0, 2),
+            "loaded_at": self.loaded_at,
+        }
+
+
+def session_options():
+    """Build ort.SessionOptions from settings.FLOW_ONNX_SESSION_OPTIONS."""
+    import onnxruntime as ort
+
+    conf = getattr(settings, "FLOW_ONNX_SESSION_OPTIONS", {})
+    opts = ort.SessionOptions()
+
+    if "intra_op_num_threads" in conf:
+        opts.intra_op_num_threads = int(conf["intra_op_num_threads"])
+    if "inter_op_num_threads" in conf:
+        opts.inter_op_num_threads = int(conf["inter_op_num_threads"])
+    if "graph_optimization_level" in conf:
+        level = _GRAPH_OPT_LEVELS[conf["graph_optimization_level"]]
+        opts.graph_optimization_level = getattr(ort.GraphOptimizationLevel, level)
+    if "execution_mode" in conf:
+        mode = _EXECUTION_MODES[conf["execution_mode"]]
+        opts.execution_mode = getattr(ort.ExecutionMode, mode)
+    if "enable_mem_arena" in conf:
+        opts.enable_cpu_mem_arena = bool(conf["enable_mem_arena"])
+    if "enable_mem_pattern" in conf:
+        opts.enable_mem_pattern = bool(conf["enable_mem_pattern"])
+
+    return opts
+
+
+def load_session(path=None):
+    """Create a new InferenceSession; does not touch the registry."""
+    import onnxruntime as ort
+
+    path = str(path or settings.FLOW_MODEL_PATH)
+    providers = getattr(settings, "FLOW_ONNX_PROVIDERS", None) or None
+    return ort.InferenceSession(path, sess_options=session_options(), providers=providers)
+
+
+def default_version():
+    return Path(settings.FLOW_MODEL_PATH).stem
+
+
+def file_digest(path):
+    """Short hash of a model file's contents."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()[:12]
+
+
+def version_path(version):
+    """Resolve a version name to its .onnx file inside FLOW_MODEL_DIR."""
+    if version == default_version():
+        return Path(settings.FLOW_MODEL_PATH)
+    if not _VERSION_RE.match(version or ""):
+        raise ValueError(f"invalid model version {version!r}")
+    path = Path(settings.FLOW_MODEL_DIR) / f"{version}.onnx"
+    if not path.is_file():
+        raise ValueError(f"model version {version!r} not found")
+    return path
+
+
+def load_model(version=None):
+    """Load a model by name (default: FLOW_MODEL_PATH)."""
+    name = version or default_version()
+    path = version_path(name)
+    started = time.perf_counter()
+    digest = file_digest(path)
+    session = load_session(path)
+    return LoadedModel(name, session, time.perf_counter() - started, digest)
+
+
+def get_model():
+    """Return the live model, loading the default version on first use."""
+    global _live
+    if _live is None:
+        with _lock:
+            if _live is None:
+                _live = load_model()
+    sync()
+    return _live
+
+
+def get_shadow():
+    """Return the shadow model, or None when no candidate is being scored."""
+    return _shadow
+
+
+def get_session():
+    return get_model().session
+
+
+def warm_up():
+    """Load the live model and run one dummy row so the first request is fast."""
+    model = get_model()
+    model.warm_up()
+    return model
+
+
+def _swap(model, role):
+    global _live, _shadow
+    with _lock:
+        if role == "live":
+            _live = model
+        else:
+            _shadow = model
+
+
+def _shared_cache():
+    return caches[settings.FLOW_LATEST_CACHE]
+
+
+def _publish(role, version):
+    """Tell the other workers to load ``version`` (None: no shadow) as ``role``."""
+    entry = {"version": version, "at": time.time()} if version else None
+    try:
+        cache = _shared_cache()
+        state = dict(cache.get(_SHARED_KEY) or {})
+        state[role] = entry
+        cache.set(_SHARED_KEY, state, timeout=None)
+    except Exception:
+        logger.exception("could not publish the %s model activation", role)
+        return
+    _synced["state"][role] = entry     # applied here already
+
+
+def sync():
+    """
+    Apply activations other workers published since the last look. Runs
+    at most every FLOW_MODEL_SYNC_SECONDS; the load itself happens in the
+    background like any activate().
+    """
+    now = time.monotonic()
+    checked = _synced["checked"]
+    if checked is not None and now - checked < settings.FLOW_MODEL_SYNC_SECONDS:
+        return
+    if not _sync_lock.acquire(blocking=False):
+        return      # another thread is looking
+    try:
+        _synced["checked"] = now
+        state = _shared_cache().get(_SHARED_KEY) or {}
+        _apply(state)
+    except Exception:
+        logger.exception("could not apply the shared model activations")
+    finally:
+        _sync_lock.release()
+
+
+def _apply(state):
+    for role in ("live", "shadow"):
+        if role not in state or state[role] == _synced["state"].get(role):
+            continue
+        entry = _synced["state"][role] = state[role]
+        if entry is None:
+            clear_shadow(publish=False)
+            continue
+        try:
+            activate(entry["version"], role=role, publish=False)
+        except ValueError:
+            logger.exception("can't load the %s model another worker activated", role)
+
+
+def activate(version, role="live", background=True, publish=True):
+    """
+    Load ``version`` and install it as the live or shadow model.
+
+    The new session is loaded and warmed up before the swap; until then
+    the previous model keeps serving. ``publish`` makes the other workers
+    follow (see sync()). Returns the loader thread when ``background`` is
+    true, otherwise the LoadedModel.
+    """
+    if role not in ("live", "shadow"):
+        raise ValueError("role must be 'live' or 'shadow'")
+    version_path(version)  # fail fast on bad names
+    if publish:
+        _publish(role, version)
+
+    def _load():
+        _last_load.update({"version": version, "role": role, "state": "loading", "error": None})
+        try:
+            model = load_model(version)
+            model.warm_up()
+        except Exception as exc:
+            _last_load.update({"state": "failed", "error": str(exc)})
+            raise
+        _swap(model, role)
+        _last_load.update({"state": "active"})
+        return model
+
+    if not background:
+        return _load()
+
+    thread = threading.Thread(target=_load, name=f"flow-model-load-{version}", daemon=True)
+    thread.start()
+    return thread
+
+
+def clear_shadow(publish=True):
+    _swap(None, "shadow")
+    if publish:
+        _publish("shadow", None)
+
+
+def status():
+    live, shadow = _live, _shadow
+    return {
+        "live": live.describe() if live else {"version": default_version(), "loaded": False},
+        "shadow": shadow.describe() if shadow else None,
+        "last_load": dict(_last_load) or None,
+    }
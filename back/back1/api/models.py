@@ -1,8 +1,44 @@
+from django.conf import settings
 from django.db import models
 
+from . import features
+
+# Inputs to the flow model, in the column order the ONNX graph expects
+# (declared in features.FEATURES)
+FEATURE_FIELDS = features.NAMES
+
+
+class Device(models.Model):
+    """A client (Electron app, gaze tracker) identified by the key it sends."""
+    key = models.CharField(max_length=64, unique=True)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        related_name="flow_devices",
+        null=True,
+        blank=True,
+    )
+    label = models.CharField(max_length=200, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.label or self.key
+
+
 class BiometricRecord(models.Model):
     timestamp = models.DateTimeField()
 
+    # Identity; indexed through the composite indexes below
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.SET_NULL,
+        null=True, blank=True, db_index=False, related_name="+",
+    )
+    device = models.ForeignKey(
+        "Device", on_delete=models.CASCADE,
+        null=True, blank=True, db_index=False, related_name="+",
+    )
+    session_id = models.CharField(max_length=64, blank=True, default="")
+
     # Typing metrics
     mean_iki_ms = models.FloatField(default=0)
     variance_iki = models.FloatField(default=0)
@@ -21,6 +57,7 @@ class BiometricRecord(models.Model):
     
     # ML output
     state_prediction = models.CharField(max_length=100, default="")
+    model_version = models.CharField(max_length=100, blank=True, default="")
     
     # Gaze
     gaze_x = models.FloatField(default=0)
@@ -28,14 +65,43 @@ class BiometricRecord(models.Model):
     screen_w = models.IntegerField(default=0)
     screen_h = models.IntegerField(default=0)
 
+    # Open windows: [[TaskEntry id, active], ...] in window order (see
+    # api/task_catalogue.py). NULL on records from before the catalogue,
+    # whose windows are UserTask rows.
+    task_refs = models.JSONField(null=True, blank=True)
 
     received_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # latest_state / latest_tasks: ORDER BY timestamp DESC LIMIT 1
+            models.Index(fields=["-timestamp"], name="bio_ts_desc_idx"),
+            # time-in-state history queries
+            models.Index(fields=["state_prediction", "timestamp"], name="bio_state_ts_idx"),
+            # per-user / per-device / per-session latest and range queries
+            models.Index(fields=["user", "-timestamp"], name="bio_user_ts_idx"),
+            models.Index(fields=["device", "-timestamp"], name="bio_device_ts_idx"),
+            models.Index(fields=["device", "session_id", "-timestamp"], name="bio_session_ts_idx"),
+        ]
+
     def __str__(self):
         return f"{self.timestamp} | state={self.state_prediction}"
 
 
+class TaskEntry(models.Model):
+    """One distinct (app, title, url) window, shared by every heartbeat that saw it."""
+    digest = models.CharField(max_length=32, unique=True)
+    app = models.CharField(max_length=200)
+    title = models.CharField(max_length=500)
+    url = models.CharField(max_length=1000, blank=True)
+    first_seen = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.app} | {self.title}"
+
+
 class UserTask(models.Model):
+    """Per-heartbeat window rows; legacy, new heartbeats use task_refs."""
     timestamp = models.DateTimeField()
     app = models.CharField(max_length=200)
     title = models.CharField(max_length=500)
@@ -49,18 +115,168 @@ class UserTask(models.Model):
         null=True,
         blank=True
     )
+    device = models.ForeignKey(
+        "Device", on_delete=models.CASCADE,
+        null=True, blank=True, db_index=False, related_name="+",
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["-timestamp"], name="task_ts_desc_idx"),
+            models.Index(fields=["device", "-timestamp"], name="task_device_ts_idx"),
+            # tasks of one heartbeat, in time order
+            models.Index(fields=["record", "timestamp"], name="task_record_ts_idx"),
+        ]
 
     def __str__(self):
         return f"{self.timestamp} | {self.app} | {self.title}"
     
 class GazeRecord(models.Model):
     timestamp = models.DateTimeField()
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.SET_NULL,
+        null=True, blank=True, db_index=False, related_name="+",
+    )
+    device = models.ForeignKey(
+        "Device", on_delete=models.CASCADE,
+        null=True, blank=True, db_index=False, related_name="+",
+    )
+    session_id = models.CharField(max_length=64, blank=True, default="")
     gaze_x = models.FloatField()
     gaze_y = models.FloatField()
     screen_w = models.FloatField()
     screen_h = models.FloatField()
     received_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # latest_gaze and keyset pagination over (timestamp, id)
+            models.Index(fields=["-timestamp", "-id"], name="gaze_ts_id_desc_idx"),
+            models.Index(fields=["user", "-timestamp", "-id"], name="gaze_user_ts_idx"),
+            models.Index(fields=["device", "-timestamp", "-id"], name="gaze_device_ts_idx"),
+            models.Index(fields=["device", "session_id", "-timestamp", "-id"], name="gaze_session_ts_idx"),
+        ]
+
     def __str__(self):
         return f"Gaze @ {self.timestamp}"
 
+
+
+# ===== Gaze retention tiers (see api/gaze_rollup.py) =====
+
+class GazeAggregate(models.Model):
+    """
+    Gaze samples of one device/user in one time bucket, stored as sums so
+    buckets can be merged (late samples, minute roll-ups) by adding.
+    """
+    bucket = models.DateTimeField()
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.SET_NULL,
+        null=True, blank=True, db_index=False, related_name="+",
+    )
+    device = models.ForeignKey(
+        "Device", on_delete=models.CASCADE,
+        null=True, blank=True, db_index=False, related_name="+",
+    )
+    count = models.IntegerField(default=0)
+    sum_x = models.FloatField(default=0)
+    sum_y = models.FloatField(default=0)
+    sum_xx = models.FloatField(default=0)
+    sum_yy = models.FloatField(default=0)
+    screen_w = models.FloatField(default=0)
+    screen_h = models.FloatField(default=0)
+    # sample counts per cell of a 3x3 screen grid, row-major from top-left
+    regions = models.JSONField(default=list)
+
+    class Meta:
+        abstract = True
+
+
+class GazeSecond(GazeAggregate):
+    class Meta:
+        indexes = [
+            models.Index(fields=["bucket"], name="gaze_sec_bucket_idx"),
+            models.Index(fields=["device", "bucket"], name="gaze_sec_device_idx"),
+            models.Index(fields=["user", "bucket"], name="gaze_sec_user_idx"),
+        ]
+
+
+class GazeMinute(GazeAggregate):
+    class Meta:
+        indexes = [
+            models.Index(fields=["bucket"], name="gaze_min_bucket_idx"),
+            models.Index(fields=["device", "bucket"], name="gaze_min_device_idx"),
+            models.Index(fields=["user", "bucket"], name="gaze_min_user_idx"),
+        ]
+
+
+class RollupState(models.Model):
+    """High-water mark of a roll-up job: source rows with id <= last_id are aggregated."""
+    name = models.CharField(max_length=50, unique=True)
+    last_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} @ {self.last_id}"
+
+
+# ===== Flow history aggregates (see api/history.py) =====
+
+class FlowAggregate(models.Model):
+    """
+    Heartbeats of one device/user in one time bucket. Every field is a sum
+    or a count, so buckets merge by adding.
+    """
+    bucket = models.DateTimeField()
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.SET_NULL,
+        null=True, blank=True, db_index=False, related_name="+",
+    )
+    device = models.ForeignKey(
+        "Device", on_delete=models.CASCADE,
+        null=True, blank=True, db_index=False, related_name="+",
+    )
+    heartbeats = models.IntegerField(default=0)
+    # {state_prediction: seconds}
+    seconds_by_state = models.JSONField(default=dict)
+    # {feature: sum over heartbeats}, FEATURE_FIELDS keys
+    metric_sums = models.JSONField(default=dict)
+    # {app: seconds as the active task}
+    app_seconds = models.JSONField(default=dict)
+
+    class Meta:
+        abstract = True
+
+
+class FlowHour(FlowAggregate):
+    class Meta:
+        indexes = [
+            models.Index(fields=["bucket"], name="flow_hour_bucket_idx"),
+            models.Index(fields=["device", "bucket"], name="flow_hour_device_idx"),
+            models.Index(fields=["user", "bucket"], name="flow_hour_user_idx"),
+        ]
+
+
+class FlowDay(FlowAggregate):
+    class Meta:
+        indexes = [
+            models.Index(fields=["bucket"], name="flow_day_bucket_idx"),
+            models.Index(fields=["device", "bucket"], name="flow_day_device_idx"),
+            models.Index(fields=["user", "bucket"], name="flow_day_user_idx"),
+        ]
+
+
+class ClientReceipt(models.Model):
+    """
+    A client-generated item id that has been ingested, so replays of the
+    same item are recognised (see ingest_bulk in api/views.py). Written in
+    the same transaction as the data.
+    """
+    client_id = models.CharField(max_length=64, unique=True)
+    kind = models.CharField(max_length=16)
+    record_id = models.BigIntegerField(null=True, blank=True)   # the BiometricRecord, for heartbeats
+    count = models.IntegerField(default=0)                       # rows stored
+    received_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.kind} {self.client_id}"
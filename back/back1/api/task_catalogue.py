@@ -0,0 +1,182 @@
+"""
+Catalogue of distinct open windows (app, title, url).
+
+Heartbeats used to store every open window as a new UserTask row, so
+storage grew with heartbeats x windows even when nothing changed. Now each
+distinct window is stored once as a TaskEntry, keyed by a digest of its
+content. A heartbeat keeps only ``task_refs``: a JSON list of
+``[entry_id, active]`` pairs in window order.
+
+Lookups in both directions (digest -> id for writes, id -> content for
+reads) go through an in-process LRU of FLOW_TASK_CACHE_SIZE entries. A
+steady desktop therefore costs no catalogue queries at all. Entries are
+immutable, so the caches never go stale. Rows are only cached once the
+transaction that saw them commits, so a rolled-back heartbeat can't leave
+the cache pointing at entries that don't exist. Don't delete TaskEntry
+rows that heartbeats still reference.
+
+Records written before the catalogue have ``task_refs`` NULL. Their
+UserTask rows are still read by ``windows_for()`` until
+``manage.py catalogue_tasks`` converts them.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import NamedTuple
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import TaskEntry
+
+MAX_LENGTHS = {f: TaskEntry._meta.get_field(f).max_length for f in ("app", "title", "url")}
+
+
+class Window(NamedTuple):
+    """One open window as sent in a heartbeat."""
+    app: str
+    title: str
+    url: str
+    active: bool
+
+    @classmethod
+    def from_dict(cls, t):
+        return cls(
+            str(t.get("app") or "")[:MAX_LENGTHS["app"]],
+            str(t.get("title") or "")[:MAX_LENGTHS["title"]],
+            str(t.get("url") or "")[:MAX_LENGTHS["url"]],
+            bool(t.get("active", False)),
+        )
+
+    @property
+    def content(self):
+        return (self.app, self.title, self.url)
+
+
+def digest(app, title, url):
+    return hashlib.blake2b(f"{app}\0{title}\0{url}".encode(), digest_size=16).hexdigest()
+
+
+class _LRU:
+    def __init__(self, size):
+        self.size = size
+        self._data = OrderedDict()
+
+    def get(self, key):
+        value = self._data.get(key)
+        if value is not None:
+            self._data.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.size:
+            self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class Catalogue:
+    def __init__(self, cache_size=50000):
+        self._ids = _LRU(cache_size)        # digest -> id
+        self._content = _LRU(cache_size)    # id -> (app, title, url)
+        self._lock = threading.Lock()
+        self.created = 0
+
+    @classmethod
+    def from_settings(cls):
+        return cls(cache_size=settings.FLOW_TASK_CACHE_SIZE)
+
+    def ids_for(self, contents):
+        """
+        Entry ids for (app, title, url) tuples, creating missing entries.
+        Returns (ids, number of entries created).
+        """
+        digests = [digest(*c) for c in contents]
+        with self._lock:
+            found = {d: self._ids.get(d) for d in digests}
+        missing = {d: c for d, c in zip(digests, contents) if found[d] is None}
+
+        new = []
+        if missing:
+            rows = dict(TaskEntry.objects.filter(digest__in=list(missing)).values_list("digest", "id"))
+            new = [
+                TaskEntry(digest=d, app=c[0], title=c[1], url=c[2])
+                for d, c in missing.items() if d not in rows
+            ]
+            if new:
+                # ignore_conflicts: another worker may insert the same window meanwhile
+                TaskEntry.objects.bulk_create(new, ignore_conflicts=True)
+                rows.update(TaskEntry.objects.filter(digest__in=[e.digest for e in new])
+                            .values_list("digest", "id"))
+            with self._lock:
+                self.created += len(new)
+            # inside a transaction the new entries may still be rolled back:
+            # only cache them once they are committed
+            transaction.on_commit(lambda: self._remember(rows, missing))
+            found.update(rows)
+        return [found[d] for d in digests], len(new)
+
+    def _remember(self, rows, contents):
+        with self._lock:
+            for d, pk in rows.items():
+                self._ids.put(d, pk)
+                self._content.put(pk, contents[d])
+
+    def _remember_contents(self, rows):
+        with self._lock:
+            for pk, content in rows.items():
+                self._content.put(pk, content)
+
+    def assign(self, pairs):
+        """
+        Set ``task_refs`` on unsaved records from their windows: ``pairs`` is
+        [(record, windows), ...]. One catalogue lookup for the whole batch.
+        Returns how many new entries were created.
+        """
+        contents = list({w.content: None for _, windows in pairs for w in windows})
+        ids, created = self.ids_for(contents) if contents else ([], 0)
+        ids = dict(zip(contents, ids))
+        for record, windows in pairs:
+            record.task_refs = [[ids[w.content], int(w.active)] for w in windows]
+        return created
+
+    def contents(self, ids):
+        """{id: (app, title, url)} for entry ids; unknown ids are left out."""
+        out, missing = {}, []
+        with self._lock:
+            for pk in ids:
+                content = self._content.get(pk)
+                if content is None:
+                    missing.append(pk)
+                else:
+                    out[pk] = content
+        if missing:
+            rows = {
+                pk: (app, title, url)
+                for pk, app, title, url in TaskEntry.objects.filter(id__in=missing)
+                .values_list("id", "app", "title", "url")
+            }
+            transaction.on_commit(lambda: self._remember_contents(rows))
+            out.update(rows)
+        return out
+
+    def windows(self, refs):
+        contents = self.contents({pk for pk, _ in refs})
+        return [Window(*contents[pk], bool(active)) for pk, active in refs if pk in contents]
+
+    def stats(self):
+        with self._lock:
+            return {"cached_ids": len(self._ids), "cached_entries": len(self._content), "created": self.created}
+
+
+catalogue = Catalogue.from_settings()
+
+
+def windows_for(record):
+    """A stored heartbeat's windows, from task_refs or (older rows) UserTask rows."""
+    if record.task_refs is not None:
+        return catalogue.windows(record.task_refs)
+    return [Window(t.app, t.title, t.url, t.active) for t in record.tasks.order_by("id")]
@@ -1,3 +1,1309 @@
-from django.test import TestCase
+import asyncio
+import importlib.util
+import io
+import json
+import math
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from pathlib import Path
+from unittest import mock, skipUnless
+
+import numpy as np
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import IntegrityError, transaction
+from django.test import (
+    AsyncClient, AsyncRequestFactory, Client, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase,
+    override_settings,
+)
+from django.utils import timezone
+
+from back1 import settings as project_settings
+
+from . import (
+    codecs, feature_engine, features, gaze_analysis, gaze_rollup, history, identity, ingest_queue, latest_cache, live,
+    metrics, model_registry, task_catalogue, views,
+)
+from .inference import InferenceBatcher, ShadowScorer
+from .models import (
+    BiometricRecord, ClientReceipt, Device, FlowHour, GazeMinute, GazeRecord, GazeSecond, TaskEntry, UserTask,
+)
+
+T0 = datetime(2025, 1, 6, 9, 0, tzinfo=dt_timezone.utc)
+
+
+def heartbeat(seconds=0, **typing):
+    return {
+        "timestamp": (T0 + timedelta(seconds=seconds)).isoformat().replace("+00:00", "Z"),
+        "typing": {"mean_iki_ms": 120.5, "total_keys": 40, "backspace_rate": 0.1, **typing},
+        "mouse": {"distance_px": 800, "click_rate_per_sec": 0.4, "mouse_clicks": 2},
+        "idle_time_ms": 1500,
+        "gaze": {"x": 400.0, "y": 300.0, "screen_w": 1920, "screen_h": 1080},
+        "tasks": [{"app": "code", "title": "tests.py", "url": "", "active": True}],
+    }
+
+
+def queued_heartbeat(seconds=0, client_id=""):
+    record, windows, raw = views._build_heartbeat(heartbeat(seconds))
+    return "heartbeat", (record, windows, raw, client_id)
+
+
+def gaze_row(seconds, x=960.0, y=540.0):
+    return GazeRecord(
+        timestamp=T0 + timedelta(seconds=seconds),
+        gaze_x=x, gaze_y=y, screen_w=1920.0, screen_h=1080.0,
+    )
+
+
+class FlowTestCase(TestCase):
+    """Fresh in-process state per test: latest cache, device ids, feature sessions."""
+
+    def setUp(self):
+        caches[settings.FLOW_LATEST_CACHE].clear()
+        identity._devices.clear()
+        feature_engine.engine._sessions.clear()
+
+    def post_json(self, url, body, **headers):
+        return self.client.post(url, json.dumps(body), content_type="application/json", headers=headers)
+
+
+# ===== Feature schema =====
+
+class FeatureDecodeTests(SimpleTestCase):
+    def test_decodes_in_schema_order(self):
+        batch = features.decode([heartbeat(), {}])
+        self.assertEqual(batch.X.dtype, np.float32)
+        self.assertEqual(batch.X.shape, (2, features.N_FEATURES))
+        self.assertEqual(batch.errors, {})
+        row = dict(zip(features.NAMES, batch.X[0].tolist()))
+        self.assertAlmostEqual(row["mean_iki_ms"], 120.5)
+        self.assertEqual(row["distance_px"], 800)
+        self.assertEqual(row["idle_time_ms"], 1500)
+        # missing inputs are 0
+        self.assertEqual(batch.X[1].tolist(), [0.0] * features.N_FEATURES)
+
+    def test_fields_keep_the_values_as_sent(self):
+        batch = features.decode([heartbeat(total_keys=41.9, mean_iki_ms=123.45)])
+        values = batch.fields(0)
+        self.assertEqual(values["mean_iki_ms"], 123.45)     # not float32-rounded
+        self.assertEqual(values["total_keys"], 41)          # integer fields truncate
+        self.assertIsInstance(values["total_keys"], int)
+
+    def test_rejects_invalid_inputs(self):
+        cases = {
+            "string": heartbeat(mean_iki_ms="120"),
+            "bool": heartbeat(total_keys=True),
+            "nan": heartbeat(variance_iki=math.nan),
+            "inf": heartbeat(burstiness=math.inf),
+            "negative": heartbeat(mean_iki_ms=-1),
+            "rate above 1": heartbeat(backspace_rate=1.5),
+            "past int32": heartbeat(total_keys=2 ** 31),
+            "past float32": heartbeat(mean_iki_ms=1e39),
+            "past float64": heartbeat(total_keys=10 ** 400),
+            "typing not an object": {**heartbeat(), "typing": [1, 2]},
+            "not an object": [heartbeat()],
+        }
+        batch = features.decode(list(cases.values()) + [heartbeat()])
+        self.assertEqual(sorted(batch.errors), list(range(len(cases))), batch.errors)
+        # rejected rows are zeroed, the valid one is kept
+        self.assertFalse(batch.X[:len(cases)].any())
+        self.assertTrue(batch.X[len(cases)].any())
+
+    def test_decode_one_raises(self):
+        with self.assertRaisesMessage(ValueError, "backspace_rate"):
+            features.decode_one(heartbeat(backspace_rate=2))
+
+    def test_validate_matrix(self):
+        X = features.empty(3)
+        X[1, features.NAMES.index("backspace_rate")] = 2
+        X[2, 0] = np.nan
+        self.assertEqual(sorted(features.validate(X)), [1, 2])
+
+    def test_from_rows_and_struct_share_the_order(self):
+        rows = [(7, "focused", *range(features.N_FEATURES))]
+        X = features.from_rows(rows, offset=2)
+        self.assertEqual(X.tolist(), [list(map(float, range(features.N_FEATURES)))])
+        self.assertEqual(features.from_rows([], offset=2).shape, (0, features.N_FEATURES))
+        self.assertEqual(codecs.HEARTBEAT_DTYPE.names[1:1 + features.N_FEATURES], features.NAMES)
+
+
+@override_settings(FLOW_INFERENCE_BATCHING=False)
+class BiometricTests(FlowTestCase):
+    def test_json_heartbeat(self):
+        response = self.post_json("/api/biometric/", heartbeat(total_keys=41.9))
+        self.assertEqual(response.status_code, 200, response.content)
+        record = BiometricRecord.objects.get()
+        self.assertEqual(record.total_keys, 41)
+        self.assertEqual(record.mean_iki_ms, 120.5)
+        self.assertEqual(record.model_version, response.json()["model_version"])
+
+    def test_invalid_heartbeats_answer_400(self):
+        cases = [
+            heartbeat(mean_iki_ms="abc"),
+            heartbeat(backspace_rate=7),
+            {**heartbeat(), "gaze": {"x": "abc"}},
+            {**heartbeat(), "gaze": {"screen_w": True}},
+            {**heartbeat(), "gaze": [1]},
+            {**heartbeat(), "timestamp": 1e20},
+            "abc",
+        ]
+        for body in cases:
+            with self.subTest(body=body):
+                self.assertEqual(self.post_json("/api/biometric/", body).status_code, 400)
+        self.assertFalse(BiometricRecord.objects.exists())
+
+
+# ===== Gaze ingestion =====
+
+class GazeIngestTests(FlowTestCase):
+    def test_single_sample(self):
+        response = self.post_json("/api/gaze/", {"gaze": {"timestamp": T0.timestamp(), "gaze_x": 3}})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(GazeRecord.objects.get().gaze_x, 3)
+
+    def test_batch_rejects_bad_samples_individually(self):
+        ts = T0.timestamp()
+        response = self.post_json("/api/gaze/", [
+            {"timestamp": ts, "gaze_x": 1},
+            {"timestamp": 1e20},
+            {"timestamp": ts, "gaze_x": "abc"},
+            {"timestamp": ts + 1, "gaze_x": 2},
+        ])
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual((body["saved"], body["rejected"]), (2, 2))
+        self.assertEqual([e["index"] for e in body["errors"]], [1, 2])
+        self.assertEqual(sorted(GazeRecord.objects.values_list("gaze_x", flat=True)), [1, 2])
+
+    def test_body_must_be_an_object_or_array(self):
+        self.assertEqual(self.post_json("/api/gaze/", "abc").status_code, 400)
+        self.assertEqual(self.post_json("/api/gaze/", {"gaze": {"timestamp": 1e20}}).status_code, 400)
+
+    def test_ndjson_rejects_bad_lines_individually(self):
+        ts = T0.timestamp()
+        body = "\n".join([
+            json.dumps({"timestamp": ts, "gaze_x": 1}),
+            "",
+            "{not json",
+            json.dumps({"timestamp": ts + 1, "gaze_x": 2}),
+            "[1, 2]",
+        ])
+        response = self.client.post("/api/gaze/", body, content_type="application/x-ndjson")
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual((body["status"], body["saved"], body["rejected"]), ("partial", 2, 2))
+        self.assertEqual([e["index"] for e in body["errors"]], [1, 3])
+        self.assertIn("invalid JSON", body["errors"][0]["error"])
+
+
+# ===== Binary codecs =====
+
+class CodecTests(SimpleTestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def request(self, body, content_type):
+        return self.factory.post("/", body, content_type=content_type)
+
+    def heartbeat_struct(self, **values):
+        row = np.zeros(1, codecs.HEARTBEAT_DTYPE)
+        row["timestamp"] = T0.timestamp()
+        for name, value in values.items():
+            row[name] = value
+        return row
+
+    def test_heartbeat_struct(self):
+        row = self.heartbeat_struct(total_keys=12, mean_iki_ms=150.25, gaze_x=10)
+        body = row.tobytes() + json.dumps([{"app": "code", "title": "x"}]).encode()
+        record, windows, raw = codecs.decode_heartbeat(self.request(body, codecs.HEARTBEAT_TYPE))
+        self.assertEqual(record.timestamp, T0)
+        self.assertEqual(record.total_keys, 12)
+        self.assertEqual(record.mean_iki_ms, 150.25)
+        self.assertEqual(record.gaze_x, 10)
+        self.assertEqual(len(windows), 1)
+        self.assertEqual(raw.dtype, np.float32)
+
+    def test_malformed_heartbeat_structs(self):
+        short = self.heartbeat_struct().tobytes()[:-1]
+        bad = {
+            "short": short,
+            "out of range": self.heartbeat_struct(backspace_rate=3).tobytes(),
+            "nan": self.heartbeat_struct(mean_iki_ms=np.nan).tobytes(),
+            "huge timestamp": self.heartbeat_struct(timestamp=1e15).tobytes(),
+            "tail not a list": self.heartbeat_struct().tobytes() + b'{"app": "x"}',
+        }
+        for label, body in bad.items():
+            with self.subTest(label), self.assertRaises(ValueError):
+                codecs.decode_heartbeat(self.request(body, codecs.HEARTBEAT_TYPE))
+
+    def test_unknown_version(self):
+        body = self.heartbeat_struct().tobytes()
+        with self.assertRaises(codecs.UnsupportedPayload):
+            codecs.decode_heartbeat(self.request(body, codecs.HEARTBEAT_TYPE + "; v=2"))
+
+    def test_gaze_frames(self):
+        samples = np.zeros(4, codecs.GAZE_DTYPE)
+        samples["timestamp"] = [T0.timestamp(), np.nan, 1e15, T0.timestamp() + 1]
+        samples["gaze_x"] = [1, 2, 3, 4]
+        decoded = codecs.decode_gaze(self.request(samples.tobytes(), codecs.GAZE_TYPE))
+        records, errors = codecs.gaze_records(decoded)
+        self.assertEqual([r.gaze_x for r in records], [1, 4])
+        self.assertEqual(records[1].timestamp, T0 + timedelta(seconds=1))
+        self.assertEqual([e["index"] for e in errors], [1, 2])
+
+    def test_truncated_gaze_frame(self):
+        body = np.zeros(2, codecs.GAZE_DTYPE).tobytes()[:-3]
+        with self.assertRaises(ValueError):
+            codecs.decode_gaze(self.request(body, codecs.GAZE_TYPE))
+
+    def test_unix_datetime(self):
+        self.assertEqual(codecs.unix_datetime(T0.timestamp()), T0)
+        for value in (1e20, -1, math.nan, math.inf, True, "1700000000"):
+            with self.subTest(value), self.assertRaises(ValueError):
+                codecs.unix_datetime(value)
+
+
+
+@override_settings(FLOW_INFERENCE_BATCHING=False)
+class BinaryIngestTests(FlowTestCase):
+    def test_binary_heartbeat(self):
+        row = np.zeros(1, codecs.HEARTBEAT_DTYPE)
+        row["timestamp"] = T0.timestamp()
+        response = self.client.post("/api/biometric/", row.tobytes(), content_type=codecs.HEARTBEAT_TYPE)
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(BiometricRecord.objects.get().timestamp, T0)
+
+    def test_unknown_version_answers_415(self):
+        row = np.zeros(1, codecs.HEARTBEAT_DTYPE)
+        response = self.client.post("/api/biometric/", row.tobytes(), content_type=codecs.HEARTBEAT_TYPE + "; v=2")
+        self.assertEqual(response.status_code, 415)
+
+    def test_gaze_frame_rejects_bad_samples_individually(self):
+        samples = np.zeros(3, codecs.GAZE_DTYPE)
+        samples["timestamp"] = [T0.timestamp(), 1e15, T0.timestamp() + 1]
+        samples["gaze_x"] = [1, 2, 3]
+        response = self.client.post("/api/gaze/", samples.tobytes(), content_type=codecs.GAZE_TYPE)
+        self.assertEqual(response.status_code, 200, response.content)
+        body = response.json()
+        self.assertEqual((body["saved"], body["rejected"]), (2, 1))
+        self.assertEqual([e["index"] for e in body["errors"]], [1])
+        self.assertEqual(sorted(GazeRecord.objects.values_list("gaze_x", flat=True)), [1, 3])
+
+    @skipUnless(importlib.util.find_spec("msgpack"), "msgpack is not installed")
+    def test_msgpack_heartbeat(self):
+        import msgpack
+
+        body = msgpack.packb(heartbeat(total_keys=12))
+        response = self.client.post("/api/biometric/", body, content_type=codecs.MSGPACK_TYPE)
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(BiometricRecord.objects.get().total_keys, 12)
+
+
+# ===== Rolling features =====
+
+@override_settings(FLOW_INFERENCE_BATCHING=False, FLOW_FEATURE_ENGINE=True)
+class FeatureEngineTests(FlowTestCase):
+    headers = {"X-Flow-Device": "laptop", "X-Flow-Client-Id": "hb-1"}
+
+    def window(self):
+        return feature_engine.engine.snapshot("laptop:default")[0]
+
+    def test_off_by_default(self):
+        self.assertFalse(project_settings.FLOW_FEATURE_ENGINE)
+        with self.settings(FLOW_FEATURE_ENGINE=False):
+            self.post_json("/api/biometric/", heartbeat(), **self.headers)
+        self.assertEqual(len(feature_engine.engine._sessions), 0)
+
+    def test_heartbeats_extend_the_inputs(self):
+        raw = features.decode_one(heartbeat())[0]
+        vector = feature_engine.engine.update("laptop:default", raw)
+        self.assertEqual(len(vector), feature_engine.engine.stats()["width"])
+        np.testing.assert_array_equal(vector[:features.N_FEATURES], raw)
+
+    def test_replay_is_a_duplicate_and_skips_the_features(self):
+        first = self.post_json("/api/biometric/", heartbeat(), **self.headers).json()
+        pushed = self.window().t
+
+        again = self.post_json("/api/biometric/", heartbeat(), **self.headers).json()
+        self.assertEqual(again, {"status": "duplicate", "id": first["id"]})
+        self.assertEqual(self.window().t, pushed)
+        self.assertEqual(BiometricRecord.objects.count(), 1)
+
+    def test_lost_insert_race_restores_the_features(self):
+        self.post_json("/api/biometric/", heartbeat(), **self.headers)
+        feature_engine.engine.add_gaze("laptop:default", [(T0.timestamp() + 1, 0.5, 0.5, 1, 1)])
+        before = self.window()
+
+        with mock.patch("api.views._save_heartbeat", side_effect=IntegrityError):
+            with mock.patch("api.views._receipt", side_effect=[None, (1,)]):
+                response = self.post_json("/api/biometric/", heartbeat(5, mean_iki_ms=900),
+                                          **{**self.headers, "X-Flow-Client-Id": "hb-2"})
+        self.assertEqual(response.json()["status"], "duplicate")
+        after = self.window()
+        self.assertEqual(after.t, before.t)
+        np.testing.assert_array_equal(after.mean, before.mean)
+        # the gaze the lost heartbeat consumed is buffered again
+        self.assertEqual(len(feature_engine.engine.snapshot("laptop:default")[1]), 1)
+
+    def test_bulk_conflict_restores_the_features(self):
+        def bulk(items):
+            return self.post_json("/api/ingest/bulk/", {"items": items}, **{"X-Flow-Device": "laptop"})
+
+        bulk([{"client_id": "a", "kind": "heartbeat", "data": heartbeat(0)}])
+        pushed = self.window().t
+
+        items = [{"client_id": c, "kind": "heartbeat", "data": heartbeat(i)} for i, c in enumerate("bc", 1)]
+        with mock.patch("api.ingest_queue.write_batch", side_effect=IntegrityError):
+            self.assertEqual(bulk(items).status_code, 409)
+        self.assertEqual(self.window().t, pushed)
+        self.assertEqual(bulk(items).json()["saved"], 2)
+        self.assertEqual(self.window().t, pushed + 2)
+
+
+# ===== Offline replay =====
+
+@override_settings(FLOW_INFERENCE_BATCHING=False)
+class BulkIngestTests(FlowTestCase):
+    def bulk(self, items, **headers):
+        return self.post_json("/api/ingest/bulk/", {"items": items}, **headers)
+
+    def test_saved_duplicate_rejected(self):
+        items = [
+            {"client_id": "a", "kind": "heartbeat", "data": heartbeat(0)},
+            {"client_id": "b", "kind": "gaze", "data": [{"timestamp": T0.timestamp()}]},
+            {"client_id": "c", "kind": "heartbeat", "data": heartbeat(5, mean_iki_ms="x")},
+            {"client_id": "d", "kind": "gaze", "data": {"timestamp": 1e20}},
+            {"client_id": "a", "kind": "heartbeat", "data": heartbeat(0)},
+            {"kind": "heartbeat", "data": heartbeat(10)},
+        ]
+        response = self.bulk(items)
+        self.assertEqual(response.status_code, 200, response.content)
+        statuses = [r["status"] for r in response.json()["results"]]
+        self.assertEqual(statuses, ["saved", "saved", "rejected", "rejected", "duplicate", "rejected"])
+        self.assertEqual(BiometricRecord.objects.count(), 1)
+        self.assertEqual(GazeRecord.objects.count(), 1)
+        self.assertEqual(ClientReceipt.objects.count(), 2)
+
+        # the client never saw the answer and sends everything again
+        again = self.bulk(items[:2]).json()
+        self.assertEqual([r["status"] for r in again["results"]], ["duplicate", "duplicate"])
+        self.assertEqual(again["results"][0]["id"], BiometricRecord.objects.get().pk)
+        self.assertEqual(BiometricRecord.objects.count(), 1)
+
+    def test_unparseable_items_are_rejected_one_by_one(self):
+        items = [
+            "not an item",
+            {"client_id": "a", "kind": "mouse", "data": {}},
+            {"client_id": "b", "kind": "heartbeat", "data": "abc"},
+            {"client_id": "c", "kind": "heartbeat", "data": heartbeat(0)},
+        ]
+        response = self.bulk(items)
+        self.assertEqual(response.status_code, 200, response.content)
+        statuses = [r["status"] for r in response.json()["results"]]
+        self.assertEqual(statuses, ["rejected", "rejected", "rejected", "saved"])
+        self.assertEqual(BiometricRecord.objects.count(), 1)
+
+    def test_body_must_list_items(self):
+        self.assertEqual(self.post_json("/api/ingest/bulk/", {"items": "abc"}).status_code, 400)
+        self.assertEqual(self.post_json("/api/ingest/bulk/", [1]).status_code, 400)
+
+
+# ===== Async ingestion =====
+
+@override_settings(FLOW_INFERENCE_BATCHING=False, FLOW_FEATURE_ENGINE=True)
+class AsyncIngestTests(FlowTestCase):
+    headers = {"X-Flow-Device": "laptop", "X-Flow-Client-Id": "hb-1"}
+
+    def pushed(self):
+        return feature_engine.engine.snapshot("laptop:default")[0].t
+
+    def test_replay_is_a_duplicate(self):
+        first = self.post_json("/api/async/biometric/", heartbeat(), **self.headers)
+        self.assertEqual(first.json()["status"], "saved")
+        pushed = self.pushed()
+
+        again = self.post_json("/api/async/biometric/", heartbeat(), **self.headers)
+        self.assertEqual(again.json(), {"status": "duplicate", "id": BiometricRecord.objects.get().pk})
+        self.assertEqual(self.pushed(), pushed)
+        self.assertEqual(ClientReceipt.objects.get().client_id, "hb-1")
+
+    def test_replay_of_a_queued_heartbeat(self):
+        ingest_queue.pipeline.pending.add("hb-1")
+        self.addCleanup(ingest_queue.pipeline.pending.discard, "hb-1")
+        response = self.post_json("/api/async/biometric/", heartbeat(), **self.headers)
+        self.assertEqual(response.json(), {"status": "duplicate", "id": None})
+        self.assertEqual(self.pushed(), 0)
+
+    def test_full_queue_leaves_the_features_alone(self):
+        self.post_json("/api/async/biometric/", heartbeat(), **{"X-Flow-Device": "laptop"})
+        state = feature_engine.engine.snapshot("laptop:default")
+
+        with mock.patch.object(ingest_queue.pipeline, "submit", mock.AsyncMock(return_value=False)) as submit:
+            response = async_to_sync(AsyncClient().post)(
+                "/api/async/biometric/", json.dumps(heartbeat(5)), content_type="application/json",
+                headers=self.headers,
+            )
+        self.assertEqual(response.status_code, 503)
+        (kind, [(_, _, _, client_id)]), _ = submit.call_args
+        self.assertEqual((kind, client_id), ("heartbeat", "hb-1"))
+        self.assertEqual(self.pushed(), state[0].t)
+        np.testing.assert_array_equal(feature_engine.engine.snapshot("laptop:default")[0].mean, state[0].mean)
+
+
+@override_settings(FLOW_INFERENCE_BATCHING=False)
+class IngestQueueTests(TestCase):
+    def test_failed_items_are_dropped_alone(self):
+        items = [("gaze", gaze_row(0)), ("gaze", gaze_row(1, x="abc")), queued_heartbeat(client_id="hb-1")]
+        with self.assertLogs("api.ingest_queue", "ERROR") as logs:
+            self.assertEqual(ingest_queue.write_each(items), 2)
+        self.assertEqual(len(logs.records), 1)
+        self.assertEqual(GazeRecord.objects.count(), 1)
+        self.assertEqual(ClientReceipt.objects.get().record_id, BiometricRecord.objects.get().pk)
+
+    def test_writers_score_the_shadow_model(self):
+        scorer, shadow = ShadowScorer(), FakeModel()
+        with mock.patch.object(ingest_queue, "shadow_scorer", scorer), \
+                mock.patch.object(model_registry, "get_shadow", return_value=shadow):
+            ingest_queue.write_batch(*ingest_queue.unpack([queued_heartbeat(0), queued_heartbeat(5)]))
+        self.assertEqual(shadow.batches, [2])
+        self.assertEqual(scorer.stats()["rows"], 2)
+
+
+@override_settings(FLOW_INFERENCE_BATCHING=False)
+class IngestPipelineTests(TransactionTestCase):
+    def test_replay_queued_twice_is_stored_once(self):
+        pipeline = ingest_queue.IngestPipeline(batch_size=10, flush_interval_ms=20)
+
+        async def run():
+            items = [queued_heartbeat(0, "hb-1"), queued_heartbeat(0, "hb-1"), ("gaze", gaze_row(0))]
+            for kind, item in items:
+                self.assertTrue(await pipeline.submit(kind, [item]))
+            self.assertEqual(pipeline.pending, {"hb-1"})
+            await pipeline.drain()
+
+        with self.assertLogs("api.ingest_queue", "ERROR"):     # the batch, before the retry
+            asyncio.run(run())
+        stats = pipeline.stats()
+        self.assertEqual((stats["written"], stats["failed"]), (3, 0))
+        self.assertEqual(pipeline.pending, set())
+        self.assertEqual(BiometricRecord.objects.count(), 1)
+        self.assertEqual(GazeRecord.objects.count(), 1)
+
+
+# ===== Window catalogue =====
+
+class CatalogueTests(TestCase):
+    content = ("code", "tests.py", "")
+
+    def test_entries_are_cached_once_committed(self):
+        catalogue = task_catalogue.Catalogue()
+        with self.captureOnCommitCallbacks(execute=True):
+            ids, created = catalogue.ids_for([self.content])
+        self.assertEqual(created, 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(catalogue.ids_for([self.content]), (ids, 0))
+            self.assertEqual(catalogue.contents(ids), {ids[0]: self.content})
+
+    def test_rolled_back_entries_are_not_cached(self):
+        catalogue = task_catalogue.Catalogue()
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            catalogue.ids_for([self.content])
+            raise IntegrityError
+        self.assertFalse(TaskEntry.objects.exists())
+        self.assertEqual(catalogue.stats()["cached_ids"], 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ids, created = catalogue.ids_for([self.content])
+        self.assertEqual(created, 1)
+        self.assertTrue(TaskEntry.objects.filter(id=ids[0]).exists())
+
+    @override_settings(FLOW_INFERENCE_BATCHING=False)
+    def test_failed_heartbeat_insert_keeps_no_entries(self):
+        record, windows, _ = views._build_heartbeat(heartbeat())
+        views._save_heartbeat(record, windows, client_id="hb-1")
+        entries = TaskEntry.objects.count()
+
+        record, windows, _ = views._build_heartbeat(heartbeat(5))
+        windows = [task_catalogue.Window("editor", "new.py", "", True)]
+        with self.assertRaises(IntegrityError):
+            views._save_heartbeat(record, windows, client_id="hb-1")
+        self.assertEqual(TaskEntry.objects.count(), entries)
+        self.assertEqual(BiometricRecord.objects.count(), 1)
+
+    def test_command_converts_legacy_rows(self):
+        legacy = BiometricRecord.objects.create(timestamp=T0)
+        current = BiometricRecord.objects.create(timestamp=T0, task_refs=[])
+        UserTask.objects.bulk_create([
+            UserTask(timestamp=T0, app="code", title="a.py", active=True, record=legacy),
+            UserTask(timestamp=T0, app="code", title="b.py", record=legacy),
+        ])
+        before = task_catalogue.windows_for(legacy)
+
+        out = io.StringIO()
+        with mock.patch.object(latest_cache, "invalidate") as invalidate:
+            call_command("catalogue_tasks", "--delete", stdout=out)
+        self.assertIn("converted 1 heartbeats (2 windows, 2 new catalogue entries), deleted 2", out.getvalue())
+        invalidate.assert_not_called()
+
+        legacy.refresh_from_db()
+        self.assertFalse(UserTask.objects.exists())
+        self.assertEqual(task_catalogue.windows_for(legacy), before)
+        current.refresh_from_db()
+        self.assertEqual(current.task_refs, [])
+
+
+# ===== Fixations =====
+
+def screen_samples(t, x, y):
+    """(t, x, y, w, h) rows on a 1920x1080 screen from normalised positions."""
+    return np.column_stack([t, x * 1920, y * 1080, np.full_like(t, 1920), np.full_like(t, 1080)])
+
+
+def fixation_data(noise=0.0):
+    # 100 Hz: 300 ms at one point, a 50 ms jump, 300 ms at another
+    t = np.arange(65) / 100.0
+    x = np.where(t < 0.325, 0.2, 0.8)
+    y = np.where(t < 0.325, 0.3, 0.7)
+    x[30:35] = np.linspace(0.2, 0.8, 5)
+    y[30:35] = np.linspace(0.3, 0.7, 5)
+    rng = np.random.default_rng(1)
+    return t, x + rng.normal(0, noise, len(t)), y + rng.normal(0, noise, len(t))
+
+
+class FixationTests(SimpleTestCase):
+
+    def test_both_detectors_find_two_fixations(self):
+        t, x, y = fixation_data(noise=0.002)
+        for method in gaze_analysis.METHODS:
+            with self.subTest(method):
+                params = gaze_analysis.Params.from_settings(method=method)
+                fixations, starts, ends = gaze_analysis.detect(t, x, y, params)
+                self.assertEqual(len(fixations), 2)
+                self.assertEqual(len(gaze_analysis.saccades(fixations, params, None)), 1)
+
+    def test_idt_on_pure_noise(self):
+        rng = np.random.default_rng(2)
+        t = np.arange(6000) / 120.0
+        x, y = rng.uniform(0, 1, len(t)), rng.uniform(0, 1, len(t))
+        params = gaze_analysis.Params.from_settings(method="idt")
+        self.assertEqual(len(gaze_analysis.detect(t, x, y, params)[0]), 0)
+
+    def test_stream_reports_each_fixation_once(self):
+        t, x, y = fixation_data(noise=0.002)
+        samples = screen_samples(t, x, y)
+        params = gaze_analysis.Params.from_settings(method="ivt")
+        whole = gaze_analysis.detect(t, x, y, params)[0]
+
+        stream = gaze_analysis.FixationStream(params)
+        found = np.concatenate([stream.feed(chunk)[0] for chunk in np.array_split(samples, 7)])
+        # the second fixation lasts until the last sample, so it is still held back
+        self.assertEqual(len(found), 1)
+        np.testing.assert_allclose(found[0].tolist(), whole[0].tolist())
+
+
+class FixationEndpointTests(FlowTestCase):
+    def test_windows_and_fixations(self):
+        t, x, y = fixation_data(noise=0.002)
+        GazeRecord.objects.bulk_create([
+            GazeRecord(timestamp=T0 + timedelta(seconds=float(s)), gaze_x=gx, gaze_y=gy, screen_w=w, screen_h=h)
+            for s, gx, gy, w, h in screen_samples(t, x, y).tolist()
+        ])
+        response = self.client.get("/api/gaze/fixations/", {
+            "since": T0.isoformat(), "until": (T0 + timedelta(seconds=1)).isoformat(), "fixations": "1",
+        })
+        self.assertEqual(response.status_code, 200, response.content)
+        body = response.json()
+        self.assertEqual((body["samples"], body["fixation_count"], body["saccade_count"]), (65, 2, 1))
+        self.assertEqual(len(body["fixations"]), 2)
+        self.assertEqual(len(body["windows"]), 1)
+
+    def test_bad_parameters(self):
+        since = T0.isoformat()
+        for params in ({}, {"since": since, "method": "nope"}, {"since": since, "window": "0.1"},
+                       {"since": since, "until": (T0 + timedelta(days=30)).isoformat()}):
+            with self.subTest(params):
+                self.assertEqual(self.client.get("/api/gaze/fixations/", params).status_code, 400)
+
+
+# ===== Training data export =====
+
+@skipUnless(importlib.util.find_spec("pyarrow"), "export_training needs pyarrow")
+class ExportTrainingTests(TestCase):
+    def setUp(self):
+        self.out = Path(tempfile.mkdtemp())
+        BiometricRecord.objects.bulk_create([
+            BiometricRecord(timestamp=T0 + timedelta(hours=12 * i), total_keys=i, mean_iki_ms=100.5 + i,
+                            state_prediction="flow", task_refs=[[7, True], [8, False]] if i else None)
+            for i in range(3)
+        ])
+
+    def export(self):
+        call_command("export_training", out=str(self.out), stdout=io.StringIO())
+        import pyarrow.parquet as pq
+
+        return pq.read_table(self.out / "biometrics").sort_by("id")
+
+    def test_round_trip(self):
+        table = self.export()
+        self.assertEqual(sorted(p.name for p in (self.out / "biometrics").iterdir()),
+                         ["date=2025-01-06", "date=2025-01-07"])
+        for name in ("id", "timestamp", *features.NAMES, "state_prediction", "task_ids", "active_task_ids"):
+            self.assertIn(name, table.column_names)
+        self.assertNotIn("task_refs", table.column_names)
+
+        rows = table.to_pylist()
+        stored = list(BiometricRecord.objects.order_by("id"))
+        self.assertEqual([r["id"] for r in rows], [r.pk for r in stored])
+        self.assertEqual([r["timestamp"] for r in rows], [r.timestamp for r in stored])
+        self.assertEqual([r["total_keys"] for r in rows], [0, 1, 2])
+        self.assertEqual([r["mean_iki_ms"] for r in rows], [100.5, 101.5, 102.5])
+        self.assertEqual([r["task_ids"] for r in rows], [None, [7, 8], [7, 8]])
+        self.assertEqual([r["active_task_ids"] for r in rows], [None, [7], [7]])
+
+    def test_only_new_rows_are_exported_again(self):
+        self.export()
+        BiometricRecord.objects.create(timestamp=T0 + timedelta(days=1, hours=1), total_keys=9)
+        table = self.export()
+        self.assertEqual(table.num_rows, 4)     # three from the first run, one new
+        self.assertEqual(table.column("total_keys").to_pylist(), [0, 1, 2, 9])
+
+
+# ===== Reads =====
+
+class KeysetPaginationTests(FlowTestCase):
+    def setUp(self):
+        super().setUp()
+        # pairs of samples share a timestamp, so paging has to break ties on id
+        GazeRecord.objects.bulk_create([gaze_row(i // 2, x=i) for i in range(25)])
+        self.newest_first = list(GazeRecord.objects.order_by("-timestamp", "-id").values_list("id", flat=True))
+
+    def page(self, **params):
+        response = self.client.get("/api/gaze/all/", {"limit": 10, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_round_trip(self):
+        pages, params = [], {}
+        while True:
+            page = self.page(**params)
+            pages.append(page)
+            if not page["next_cursor"]:
+                break
+            params = {"before": page["next_cursor"]}
+        ids = [row["id"] for page in pages for row in page["gaze"]]
+        self.assertEqual(ids, self.newest_first)
+        self.assertEqual([len(p["gaze"]) for p in pages], [10, 10, 5])
+        self.assertIsNone(pages[0]["prev_cursor"])
+
+        # and back up again from the last page
+        back = self.page(after=pages[-1]["prev_cursor"])
+        self.assertEqual([row["id"] for row in back["gaze"]], self.newest_first[10:20])
+        top = self.page(after=back["prev_cursor"])
+        self.assertEqual([row["id"] for row in top["gaze"]], self.newest_first[:10])
+        self.assertIsNone(top["prev_cursor"])
+
+    def test_stream_covers_the_range_oldest_first(self):
+        response = self.client.get("/api/gaze/all/", {"stream": "ndjson"})
+        ids = [json.loads(line)["id"] for line in b"".join(response.streaming_content).splitlines()]
+        self.assertEqual(ids, self.newest_first[::-1])
+
+    def test_bad_cursor(self):
+        self.assertEqual(self.client.get("/api/gaze/all/", {"before": "!!"}).status_code, 400)
+
+
+class ReadScopeTests(FlowTestCase):
+    def setUp(self):
+        super().setUp()
+        users = get_user_model().objects
+        self.users = {
+            "owner": users.create_user("owner"),
+            "other": users.create_user("other"),
+            "staff": users.create_user("staff", is_staff=True),
+        }
+        self.owner = self.users["owner"]
+        Device.objects.create(key="owned", user=self.owner)
+        Device.objects.create(key="loose")
+        GazeRecord.objects.bulk_create([gaze_row(0), gaze_row(1)])
+        GazeRecord.objects.filter(pk=GazeRecord.objects.order_by("id").first().pk).update(user=self.owner)
+
+    def get(self, url, login=None):
+        self.client.logout()
+        if login:
+            self.client.force_login(self.users[login])
+        return self.client.get(url)
+
+    def test_user_scope_needs_that_users_login(self):
+        url = f"/api/gaze/all/?user={self.owner.pk}"
+        for login, status in ((None, 403), ("other", 403), ("owner", 200), ("staff", 200)):
+            self.assertEqual(self.get(url, login).status_code, status, login)
+        self.assertEqual(self.get("/api/gaze/all/?user=abc", "owner").status_code, 400)
+
+    def test_public_reads_by_default(self):
+        self.assertTrue(project_settings.FLOW_PUBLIC_READS)
+        self.assertEqual(len(self.get("/api/gaze/all/").json()["gaze"]), 2)
+        self.assertEqual(self.get("/api/gaze/all/?device=owned").status_code, 200)
+
+    @override_settings(FLOW_PUBLIC_READS=False)
+    def test_private_reads(self):
+        self.assertEqual(self.get("/api/gaze/all/").status_code, 403)
+        self.assertEqual(self.get("/api/latest_state/").status_code, 403)
+        self.assertEqual(len(self.get("/api/gaze/all/", "owner").json()["gaze"]), 1)
+        self.assertEqual(self.get("/api/gaze/all/", "other").json()["gaze"], [])
+        self.assertEqual(len(self.get("/api/gaze/all/", "staff").json()["gaze"]), 2)
+
+        for login, status in ((None, 403), ("other", 403), ("owner", 200), ("staff", 200)):
+            self.assertEqual(self.get("/api/gaze/all/?device=owned", login).status_code, status, login)
+        self.assertEqual(self.get("/api/gaze/all/?device=loose", "owner").status_code, 403)
+        self.assertEqual(self.get("/api/gaze/all/?device=loose", "staff").status_code, 200)
+
+    @override_settings(FLOW_PUBLIC_READS=False)
+    def test_private_live_stream(self):
+        request = AsyncRequestFactory().get("/api/live/")
+        response = async_to_sync(views.live_stream)(request)
+        self.assertEqual(response.status_code, 403)
+
+
+# ===== Gaze retention =====
+
+def settle():
+    """A ``now`` past FLOW_ROLLUP_LAG_S for everything inserted so far."""
+    return timezone.now() + timedelta(seconds=settings.FLOW_ROLLUP_LAG_S + 1)
+
+
+class GazeRollupTests(TestCase):
+    def test_buckets_match_raw_counts(self):
+        rng = np.random.default_rng(0)
+        offsets = np.sort(rng.uniform(0, 150, 400))
+        GazeRecord.objects.bulk_create([gaze_row(float(s), x=float(s) * 10) for s in offsets])
+        self.assertEqual(gaze_rollup.rollup(chunk_size=64, now=settle()), 400)
+
+        seconds = np.floor(offsets).astype(int)
+        expected = dict(zip(*np.unique(seconds, return_counts=True)))
+        stored = {
+            int((b - T0).total_seconds()): n
+            for b, n in GazeSecond.objects.values_list("bucket", "count")
+        }
+        self.assertEqual(stored, {int(k): int(v) for k, v in expected.items()})
+        self.assertEqual(sum(GazeMinute.objects.values_list("count", flat=True)), 400)
+
+        # rows the roll-up hasn't reached yet are merged in when reading
+        GazeRecord.objects.bulk_create([gaze_row(30.5), gaze_row(200.0)])
+        result = gaze_rollup.query_range({}, T0, T0 + timedelta(minutes=5), "minute")
+        counts = [b["count"] for b in result["buckets"]]
+        self.assertEqual(sum(counts), 402)
+        self.assertEqual(counts[0], int((offsets < 60).sum()) + 1)
+
+    def test_recent_rows_wait_for_the_lag(self):
+        GazeRecord.objects.bulk_create([gaze_row(s) for s in range(3)])
+        self.assertEqual(gaze_rollup.rollup(), 0)
+        self.assertEqual(gaze_rollup.watermark(), 0)
+        self.assertEqual(gaze_rollup.rollup(now=settle()), 3)
+
+    def test_mark_stops_below_a_row_still_in_flight(self):
+        rows = GazeRecord.objects.bulk_create([gaze_row(s) for s in range(5)])
+        ids = [r.id for r in rows]
+        now = settle()
+        # ids[2] stands for a lower id whose transaction commits late
+        GazeRecord.objects.filter(id=ids[2]).update(received_at=now)
+
+        self.assertEqual(gaze_rollup.rollup(now=now), 2)
+        self.assertEqual(gaze_rollup.watermark(), ids[1])
+
+        # expired by timestamp, but not rolled up yet: prune keeps them
+        deleted = gaze_rollup.prune(now=T0 + timedelta(days=365))
+        self.assertEqual(deleted["raw"], 2)
+        self.assertEqual(sorted(GazeRecord.objects.values_list("id", flat=True)), ids[2:])
+
+        later = now + timedelta(seconds=settings.FLOW_ROLLUP_LAG_S + 1)
+        self.assertEqual(gaze_rollup.rollup(now=later), 3)
+        self.assertEqual(sum(GazeMinute.objects.values_list("count", flat=True)), 5)
+
+
+# ===== Flow history =====
+
+@override_settings(FLOW_INFERENCE_BATCHING=False)
+class FlowHistoryTests(FlowTestCase):
+    span = {"device": "laptop", "since": "2025-01-06T00:00:00Z", "until": "2025-01-08T00:00:00Z"}
+
+    def post_heartbeats(self, *offsets):
+        ids = []
+        for seconds in offsets:
+            response = self.post_json("/api/biometric/", heartbeat(seconds), **{"X-Flow-Device": "laptop"})
+            ids.append(response.json()["id"])
+        return ids
+
+    def history(self, **params):
+        response = self.client.get("/api/history/", {**self.span, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_aggregates_answer_like_the_raw_heartbeats(self):
+        self.post_heartbeats(0, 10, 3600, 86400)
+        raw = self.history(granularity="hour")
+        self.assertEqual(history.compact(now=settle()), 4)
+        self.assertEqual(self.history(granularity="hour"), raw)
+
+        step = settings.FLOW_HEARTBEAT_SECONDS
+        buckets = raw["buckets"]
+        self.assertEqual([b["heartbeats"] for b in buckets], [2, 1, 1])
+        self.assertEqual(sum(buckets[0]["seconds_by_state"].values()), 2 * step)
+        self.assertEqual(buckets[0]["top_apps"], [{"app": "code", "seconds": 2 * step}])
+        self.assertAlmostEqual(raw["total"]["means"]["mean_iki_ms"], 120.5)
+
+        days = self.history(granularity="day")["buckets"]
+        self.assertEqual([b["heartbeats"] for b in days], [3, 1])
+
+    def test_recent_heartbeats_wait_for_the_lag(self):
+        self.post_heartbeats(0, 10)
+        self.assertEqual(history.compact(), 0)
+        self.assertEqual(self.history()["total"]["heartbeats"], 2)
+
+    def test_mark_stops_below_a_heartbeat_still_in_flight(self):
+        ids = self.post_heartbeats(0, 10, 20)
+        now = settle()
+        BiometricRecord.objects.filter(id=ids[1]).update(received_at=now)
+
+        self.assertEqual(history.compact(now=now), 1)
+        self.assertEqual(history.watermark(), ids[0])
+        self.assertEqual(self.history()["total"]["heartbeats"], 3)
+
+        later = now + timedelta(seconds=settings.FLOW_ROLLUP_LAG_S + 1)
+        self.assertEqual(history.compact(now=later), 2)
+        self.assertEqual(sum(FlowHour.objects.values_list("heartbeats", flat=True)), 3)
+        self.assertEqual(self.history()["total"]["heartbeats"], 3)
+
+
+# ===== Latest-state cache =====
+
+@override_settings(FLOW_INFERENCE_BATCHING=False)
+class LatestCacheTests(FlowTestCase):
+    urls = ("/api/latest_state/", "/api/latest_tasks/", "/api/gaze/latest/")
+
+    def ingest(self, timestamp, **typing):
+        body = {**heartbeat(**typing), "timestamp": timestamp,
+                "gaze": {"x": 400, "y": 300, "screen_w": 1920, "screen_h": 1080}}
+        self.assertEqual(self.post_json("/api/biometric/", body).status_code, 200)
+        self.post_json("/api/gaze/", {"gaze": {"timestamp": 1736150400, "gaze_x": 5, "gaze_y": 6,
+                                               "screen_w": 1920, "screen_h": 1080}})
+
+    def read_all(self):
+        return [self.client.get(url) for url in self.urls]
+
+    def test_hit_equals_miss(self):
+        # an offset timestamp and integer values, which the database returns as UTC and floats
+        self.ingest("2025-01-06T11:00:00.123456+02:00", mean_iki_ms=120, variance_iki=3)
+        hits = self.read_all()
+        caches[settings.FLOW_LATEST_CACHE].clear()
+        misses = self.read_all()
+        for url, hit, miss in zip(self.urls, hits, misses):
+            with self.subTest(url):
+                self.assertEqual(hit.status_code, 200)
+                self.assertEqual(hit.content, miss.content)
+                self.assertEqual(hit["ETag"], miss["ETag"])
+        state = hits[0].json()
+        self.assertEqual(state["timestamp"], "2025-01-06T09:00:00.123Z")
+        self.assertEqual((state["mean_iki_ms"], state["screen_w"]), (120.0, 1920))
+
+    def test_naive_timestamps_are_stored_as_utc(self):
+        with self.assertWarns(RuntimeWarning):     # Django's naive datetime warning on save
+            self.ingest("2025-01-06T09:00:00")
+        hit = self.client.get("/api/latest_state/")
+        caches[settings.FLOW_LATEST_CACHE].clear()
+        self.assertEqual(hit.content, self.client.get("/api/latest_state/").content)
+        self.assertEqual(hit.json()["timestamp"], "2025-01-06T09:00:00Z")
+
+    def test_unchanged_poll_is_not_modified(self):
+        self.ingest("2025-01-06T09:00:00Z")
+        etag = self.client.get("/api/latest_state/")["ETag"]
+        response = self.client.get("/api/latest_state/", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+
+        self.ingest("2025-01-06T09:00:05Z")
+        response = self.client.get("/api/latest_state/", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_older_heartbeat_does_not_replace_the_entry(self):
+        self.ingest("2025-01-06T09:00:05Z", total_keys=5)
+        self.ingest("2025-01-06T09:00:00Z", total_keys=1)
+        self.assertEqual(self.client.get("/api/latest_state/").json()["total_keys"], 5)
+
+    def test_reads_come_from_the_cache(self):
+        self.ingest("2025-01-06T09:00:00Z")
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get("/api/latest_state/").status_code, 200)
+        self.assertEqual(self.client.get("/api/latest_state/").content,
+                         latest_cache.get_body(latest_cache.STATE))
+
+    def test_no_data(self):
+        self.assertEqual(self.client.get("/api/latest_state/").status_code, 404)
+        self.assertEqual(self.client.get("/api/latest_tasks/").json(), {"tasks": []})
+
+
+# ===== Live stream =====
+
+class LiveStreamTests(FlowTestCase):
+    async def open(self, path="/api/live/"):
+        response = await views.live_stream(AsyncRequestFactory().get(path))
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        return response.streaming_content
+
+    async def closed(self, stream, subscribers):
+        """Disconnect the client; True once the stream has unsubscribed."""
+        await stream.aclose()
+        for _ in range(50):
+            if live.broadcaster.subscribers == subscribers:
+                return True
+            await asyncio.sleep(0.01)
+        return False
+
+    async def test_subscribe_publish_disconnect(self):
+        await sync_to_async(latest_cache.put)(latest_cache.STATE, {"state_prediction": "flow"})
+        before = live.broadcaster.subscribers
+        stream = await self.open()
+
+        self.assertEqual(await anext(stream), b"retry: 3000\n\n")
+        self.assertEqual(await anext(stream), b'event: state\ndata: {"state_prediction": "flow"}\n\n')
+        self.assertEqual(live.broadcaster.subscribers, before + 1)
+
+        # ingestion publishes from another thread
+        await asyncio.to_thread(live.broadcaster.publish, "tasks", b'{"tasks": []}')
+        self.assertEqual(await asyncio.wait_for(anext(stream), 5), b'event: tasks\ndata: {"tasks": []}\n\n')
+
+        self.assertTrue(await self.closed(stream, before))
+
+    async def test_scoped_stream_only_gets_its_scope(self):
+        device = await Device.objects.acreate(key="laptop")
+        stream = await self.open("/api/live/?device=laptop")
+        self.assertEqual(await anext(stream), b"retry: 3000\n\n")     # nothing cached for it yet
+
+        live.broadcaster.publish("state", b"{}", "")
+        live.broadcaster.publish("state", b'{"mine": 1}', f"d:{device.pk}")
+        self.assertEqual(await asyncio.wait_for(anext(stream), 5), b'event: state\ndata: {"mine": 1}\n\n')
+        self.assertTrue(await self.closed(stream, 0))
+
+    @override_settings(FLOW_LIVE_KEEPALIVE_S=0.05)
+    async def test_keepalive(self):
+        stream = await self.open()
+        await anext(stream)
+        self.assertEqual(await asyncio.wait_for(anext(stream), 5), b": keepalive\n\n")
+        self.assertTrue(await self.closed(stream, 0))
+
+    def test_needs_asgi(self):
+        self.assertEqual(self.client.get("/api/live/").status_code, 501)
+
+
+# ===== Inference =====
+
+class FakeModel:
+    """Labels each row with its first feature and records the batch sizes it ran."""
+    n_features = 10
+    version = "fake@000000000000"
+
+    def __init__(self, gate=None):
+        self.batches = []
+        self.gate = gate
+        self.running = threading.Event()
+
+    def run(self, X):
+        self.running.set()
+        if self.gate is not None:
+            self.gate.wait(5)
+        self.batches.append(len(X))
+        return [f"s{int(v)}" for v in X[:, 0]]
+
+
+class InferenceBatcherTests(SimpleTestCase):
+    def batcher(self, model, **kwargs):
+        batcher = InferenceBatcher(lambda: model, **kwargs)
+        self.addCleanup(batcher.close, timeout=5)
+        return batcher
+
+    def test_concurrent_callers_share_a_batch(self):
+        model = FakeModel()
+        batcher = self.batcher(model, max_batch_size=8, max_wait_ms=500)
+        start = threading.Barrier(5)
+        results = {}
+
+        def call(i):
+            start.wait()
+            results[i] = batcher.predict(np.full(10, i), timeout=5)
+
+        threads = [threading.Thread(target=call, args=(i,)) for i in range(5)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(model.batches, [5])
+        self.assertEqual(results, {i: (f"s{i}", model.version) for i in range(5)})
+        self.assertEqual(batcher.stats()["batch_size_histogram"], {"5": 1})
+
+    def test_batches_are_capped(self):
+        gate = threading.Event()
+        model = FakeModel(gate)
+        batcher = self.batcher(model, max_batch_size=2, max_wait_ms=0)
+        first = batcher.submit(np.zeros(10))
+        model.running.wait(5)
+        # queued while the worker is busy
+        rest = [batcher.submit(np.full(10, i)) for i in range(1, 6)]
+        gate.set()
+        self.assertEqual([f.result(5)[0] for f in [first, *rest]], [f"s{i}" for i in range(6)])
+        self.assertEqual(model.batches, [1, 2, 2, 1])
+
+    def test_flushes_after_max_wait(self):
+        model = FakeModel()
+        batcher = self.batcher(model, max_batch_size=100, max_wait_ms=50)
+        started = time.perf_counter()
+        self.assertEqual(batcher.predict(np.zeros(10), timeout=5)[0], "s0")
+        elapsed = time.perf_counter() - started
+        self.assertGreaterEqual(elapsed, 0.045)
+        self.assertLess(elapsed, 2)
+        self.assertEqual(model.batches, [1])
+
+    def test_model_errors_reach_every_caller(self):
+        model = FakeModel()
+        batcher = self.batcher(model, max_batch_size=8, max_wait_ms=100)
+        with mock.patch.object(model, "run", side_effect=RuntimeError("boom")):
+            futures = [batcher.submit(np.zeros(10)) for _ in range(3)]
+            for fut in futures:
+                with self.assertRaisesMessage(RuntimeError, "boom"):
+                    fut.result(5)
+        # the worker survives and serves the next batch
+        self.assertEqual(batcher.predict(np.ones(10), timeout=5)[0], "s1")
+
+    def test_close_answers_queued_rows(self):
+        gate = threading.Event()
+        model = FakeModel(gate)
+        batcher = InferenceBatcher(lambda: model, max_batch_size=2, max_wait_ms=0)
+        futures = [batcher.submit(np.zeros(10))]
+        model.running.wait(5)
+        futures += [batcher.submit(np.full(10, i)) for i in range(1, 4)]
+
+        closer = threading.Thread(target=batcher.close, kwargs={"timeout": 5})
+        closer.start()
+        gate.set()
+        closer.join()
+
+        self.assertEqual([f.result(0)[0] for f in futures], ["s0", "s1", "s2", "s3"])
+        self.assertFalse(batcher._thread.is_alive())
+        with self.assertRaises(RuntimeError):
+            batcher.submit(np.zeros(10))
+        batcher.close()     # closing twice is harmless
+
+    def test_shadow_agreement(self):
+        live, shadow = FakeModel(), FakeModel()
+        shadow.version = "shadow@000000000000"
+        batcher = InferenceBatcher(lambda: live, lambda: shadow, max_batch_size=4, max_wait_ms=0)
+        batcher.predict(np.zeros(10), timeout=5)
+        batcher.close(timeout=5)
+        stats = batcher.stats()["shadow"]
+        self.assertEqual((stats["version"], stats["rows"], stats["agreement_rate"]), (shadow.version, 1, 1.0))
+
+
+# ===== Model versions =====
+
+class ModelVersionTests(FlowTestCase):
+    def setUp(self):
+        super().setUp()
+        staff = get_user_model().objects.create_user("staff", is_staff=True)
+        self.client = Client(enforce_csrf_checks=True)
+        self.client.force_login(staff)
+        self.token = "a" * 32
+        self.client.cookies["csrftoken"] = self.token
+
+    def post(self, body, token=True):
+        headers = {"X-CSRFToken": self.token} if token else {}
+        return self.client.post("/api/models/", body, content_type="application/json", headers=headers)
+
+    def test_version_has_a_content_hash(self):
+        name = model_registry.default_version()
+        digest = model_registry.file_digest(model_registry.version_path(name))
+        self.assertEqual(model_registry.load_model().version, f"{name}@{digest}")
+
+    def test_post_needs_the_csrf_token(self):
+        body = json.dumps({"role": "shadow", "version": None})
+        self.assertEqual(self.post(body, token=False).status_code, 403)
+        self.assertEqual(self.post(body).status_code, 200)
+
+    def test_post_is_staff_only(self):
+        self.client.logout()
+        self.assertEqual(self.post(json.dumps({"role": "shadow", "version": None})).status_code, 403)
+
+    def test_invalid_bodies_answer_400(self):
+        for body in ("garbage", "[1]", '{"version": 5}', '{"version": "../etc"}', '{"role": "both", "version": "x"}'):
+            with self.subTest(body=body):
+                self.assertEqual(self.post(body).status_code, 400)
+
+
+@override_settings(FLOW_INFERENCE_BATCHING=False)
+class RescoreTests(TestCase):
+    def setUp(self):
+        BiometricRecord.objects.bulk_create([
+            BiometricRecord(timestamp=T0 + timedelta(seconds=5 * i), total_keys=i, model_version="old")
+            for i in range(30)
+        ])
+        self.checkpoint = Path(tempfile.mkdtemp()) / "rescore.json"
+        self.version = model_registry.load_model().version
+
+    def rescore(self, **opts):
+        call_command("rescore", checkpoint=str(self.checkpoint), chunk_size=10, stdout=io.StringIO(), **opts)
+
+    def test_completed_run_removes_its_checkpoint(self):
+        self.rescore()
+        self.assertFalse(self.checkpoint.exists())
+        self.assertEqual(set(BiometricRecord.objects.values_list("model_version", flat=True)), {self.version})
+
+    def test_interrupted_run_resumes(self):
+        ids = list(BiometricRecord.objects.order_by("id").values_list("id", flat=True))
+        self.checkpoint.write_text(json.dumps({"version": self.version, "last_id": ids[9], "rows": 10}))
+        self.rescore()
+        versions = list(BiometricRecord.objects.order_by("id").values_list("model_version", flat=True))
+        self.assertEqual(versions, ["old"] * 10 + [self.version] * 20)
+        self.assertFalse(self.checkpoint.exists())
+
+    def test_checkpoint_of_other_model_contents_is_ignored(self):
+        ids = list(BiometricRecord.objects.order_by("id").values_list("id", flat=True))
+        self.checkpoint.write_text(json.dumps({"version": "flow_model@000000000000", "last_id": ids[-1]}))
+        self.rescore()
+        self.assertEqual(BiometricRecord.objects.filter(model_version=self.version).count(), 30)
+
+    def test_drops_cached_states_but_keeps_model_activations(self):
+        device = Device.objects.create(key="laptop")
+        for scope in identity.scopes_for(device.id, None):
+            latest_cache.put(latest_cache.STATE, {"state_prediction": "old"}, T0, scope)
+        latest_cache.put(latest_cache.GAZE, {"gaze_x": 1}, T0)
+        shared = caches[settings.FLOW_LATEST_CACHE]
+        shared.set("flow:models:active", {"live": {"version": "v2"}}, timeout=None)
+        self.addCleanup(shared.delete, "flow:models:active")
+
+        self.rescore()
+        for scope in identity.scopes_for(device.id, None):
+            self.assertIsNone(latest_cache.get_body(latest_cache.STATE, scope))
+        self.assertIsNotNone(latest_cache.get_body(latest_cache.GAZE))
+        self.assertEqual(shared.get("flow:models:active"), {"live": {"version": "v2"}})
+
+
+# ===== Metrics and profiling =====
+
+class MetricsTests(FlowTestCase):
+    def test_payload_content_type_is_a_fixed_label(self):
+        body = json.dumps({"gaze": {"timestamp": T0.timestamp()}})
+        self.client.post("/api/gaze/", body, content_type="application/json")
+        self.client.post("/api/gaze/", body, content_type="text/x-anything-goes-1")
+        exposition = self.client.get("/metrics").content.decode()
+        labels = {
+            line.split('content_type="')[1].split('"')[0]
+            for line in exposition.splitlines()
+            if line.startswith("flow_payload_bytes_count") and 'endpoint="gaze"' in line
+        }
+        # metrics are per process, so earlier tests' requests show up too
+        self.assertLessEqual({"json", "other"}, labels)
+        self.assertLessEqual(labels, {"json", "ndjson", "msgpack", "struct", "other"})
+        self.assertNotIn("anything-goes", exposition)
+
+
+class ProfileTests(FlowTestCase):
+    def setUp(self):
+        super().setUp()
+        users = get_user_model().objects
+        self.staff = users.create_user("staff", is_staff=True)
+        self.member = users.create_user("member")
+        self.client = Client(enforce_csrf_checks=True)
+        self.token = "a" * 32
+        self.client.cookies["csrftoken"] = self.token
+
+    def post(self, body, token=True):
+        headers = {"X-CSRFToken": self.token} if token else {}
+        return self.client.post("/api/profile/", body, content_type="application/json", headers=headers)
+
+    def test_reads_are_staff_only(self):
+        self.assertEqual(self.client.get("/api/profile/", {"format": "folded"}).status_code, 403)
+        self.client.force_login(self.member)
+        self.assertEqual(self.client.get("/api/profile/", {"format": "folded"}).status_code, 403)
+        self.client.force_login(self.staff)
+        self.assertEqual(self.client.get("/api/profile/").status_code, 200)
+        self.assertEqual(self.client.get("/api/profile/", {"format": "folded"}).status_code, 200)
+
+    def test_post_needs_the_csrf_token(self):
+        self.client.force_login(self.staff)
+        body = json.dumps({"action": "stop"})
+        self.assertEqual(self.post(body, token=False).status_code, 403)
+        self.assertEqual(self.post(body).status_code, 200)
+
+    def test_start_is_capped(self):
+        self.client.force_login(self.staff)
+        with mock.patch.object(metrics.profiler, "start", return_value=True) as start:
+            response = self.post(json.dumps({"seconds": 1e9, "interval_ms": 0}))
+        self.assertEqual(response.status_code, 202)
+        start.assert_called_once_with(settings.FLOW_PROFILE_MAX_SECONDS, 1.0)
+
+    def test_bad_bodies_answer_400(self):
+        self.client.force_login(self.staff)
+        for body in ("garbage", "[1]", '{"seconds": NaN}', '{"seconds": -1}',
+                     '{"interval_ms": "inf"}', '{"seconds": null}', '{"action": "pause"}'):
+            with self.subTest(body=body):
+                self.assertEqual(self.post(body).status_code, 400)
+
+
+# ===== Admin =====
+
+class AdminChangelistTests(TestCase):
+    url = "/admin/api/biometricrecord/"
+
+    def setUp(self):
+        admin_user = get_user_model().objects.create_user("admin", is_staff=True, is_superuser=True)
+        self.client.force_login(admin_user)
+        self.records = BiometricRecord.objects.bulk_create([
+            BiometricRecord(timestamp=T0 + timedelta(hours=h)) for h in (0, 1, 26, 24 * 40)
+        ])
+
+    def changelist(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200, params)
+        return response.context["cl"]
+
+    def test_search_terms(self):
+        pk = self.records[1].pk
+        cases = {
+            str(pk): [pk],
+            "2025-01-06T10": [pk],
+            "2025-01-06T10:00": [pk],
+            "99999999999999999999999999": [],   # too large for an id: a device key
+            "9" * 5000: [],
+            "²": [],
+            "9999-12-31T23:59:59": [],
+            "9999-12": [],
+        }
+        for term, expected in cases.items():
+            with self.subTest(term=term[:30]):
+                self.assertEqual([r.pk for r in self.changelist(q=term).result_list], expected)
+
+    def test_drill_down(self):
+        def choices(**params):
+            spec = self.changelist(**params).filter_specs[0]
+            return [value for value, _ in spec.lookup_choices]
+
+        self.assertEqual(choices(), ["2025"])
+        self.assertEqual(choices(period="2025"), ["2025", "2025-01", "2025-02"])
+        self.assertEqual(choices(period="2025-01"), ["2025", "2025-01", "2025-01-06", "2025-01-07"])
+        self.assertEqual(len(self.changelist(period="2025-01-06").result_list), 2)
+        # the day after 9999-12-31 doesn't exist: an invalid period, not a 500
+        self.assertIn(self.client.get(self.url, {"period": "9999-12-31"}).status_code, (200, 302))
+
+    def test_estimated_count(self):
+        with self.settings(FLOW_ADMIN_EXACT_COUNT=2):
+            self.assertEqual(self.changelist().result_count, 4)
+            self.assertEqual(self.changelist(period="2025").result_count, 2)
+        self.assertEqual(self.changelist(period="2025").result_count, 4)
+
+        # unfiltered beyond the limit: the id range stands in for COUNT(*)
+        BiometricRecord.objects.filter(pk=self.records[1].pk).delete()
+        with self.settings(FLOW_ADMIN_EXACT_COUNT=2):
+            self.assertEqual(self.changelist().result_count, 4)
 
-# Create your tests here.
@@ -1,5 +1,11 @@
 from django.urls import path
-from .views import biometric, latest_state, latest_tasks, receive_gaze, latest_gaze, all_gaze
+from .views import (
+    biometric, latest_state, latest_tasks, receive_gaze, latest_gaze, all_gaze,
+    gaze_range, gaze_fixations, flow_history,
+    inference_stats, model_versions,
+    biometric_async, receive_gaze_async, ingest_stats, live_stream,
+    profile, ingest_bulk,
+)
 
 urlpatterns = [
     path('biometric/', biometric),
@@ -8,4 +14,15 @@ urlpatterns = [
     path("gaze/", receive_gaze),
     path("gaze/latest/", latest_gaze),
     path("gaze/all/", all_gaze),
+    path("gaze/range/", gaze_range),
+    path("gaze/fixations/", gaze_fixations),
+    path("history/", flow_history),
+    path("inference/stats/", inference_stats),
+    path("models/", model_versions),
+    path("async/biometric/", biometric_async),
+    path("async/gaze/", receive_gaze_async),
+    path("ingest/stats/", ingest_stats),
+    path("ingest/bulk/", ingest_bulk),
+    path("live/", live_stream),
+    path("profile/", profile),
 ]
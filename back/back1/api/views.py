@@ -1,204 +1,1049 @@
-from django.http import JsonResponse
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.core.handlers.asgi import ASGIRequest
 from django.views.decorators.csrf import csrf_exempt
+from django.utils import timezone
+from asgiref.sync import sync_to_async
+from django.db import IntegrityError, transaction
+import asyncio
+import atexit
+import base64
+import functools
 import json
-from .models import BiometricRecord, UserTask, GazeRecord
-from datetime import datetime
+import math
+from .models import BiometricRecord, ClientReceipt, Device, GazeRecord
+from datetime import datetime, timezone as dt_timezone
 import numpy as np
-import onnxruntime as ort
-
-sess = ort.InferenceSession("flow_model.onnx")
-
-def all_gaze(request):
-    records = GazeRecord.objects.all().order_by("-timestamp")
-
-    data = []
-    for r in records:
-        data.append({
-            "timestamp": r.timestamp,
-            "gaze_x": r.gaze_x,
-            "gaze_y": r.gaze_y,
-            "screen_w": r.screen_w,
-            "screen_h": r.screen_h,
-            "received_at": r.received_at,
-        })
+from . import (
+    codecs, feature_engine, features, gaze_analysis, gaze_rollup, history, identity, ingest_queue,
+    latest_cache, live, metrics, model_registry, task_catalogue,
+)
+from .inference import InferenceBatcher, shadow_scorer
+
+batcher = InferenceBatcher(
+    model_registry.get_model,
+    model_registry.get_shadow,
+    max_batch_size=settings.FLOW_INFERENCE_MAX_BATCH,
+    max_wait_ms=settings.FLOW_INFERENCE_MAX_WAIT_MS,
+    shadow_scorer=shadow_scorer,
+)
+atexit.register(batcher.close, timeout=5.0)
+
+GAZE_FIELDS = ("id", "timestamp", "gaze_x", "gaze_y", "screen_w", "screen_h", "received_at")
+
+
+def _encode_cursor(timestamp, pk):
+    raw = f"{timestamp.isoformat()}|{pk}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
 
-    return JsonResponse({"gaze": data})
+def _decode_cursor(cursor):
+    padded = cursor + "=" * (-len(cursor) % 4)
+    ts, pk = base64.urlsafe_b64decode(padded).decode().split("|")
+    return datetime.fromisoformat(ts), int(pk)
 
 
-def latest_gaze(request):
-    last = GazeRecord.objects.order_by("-timestamp").first()
-    if not last:
+def scoped_read(view):
+    """Resolve ?device= / ?user= / ?session= and pass (filters, cache scope) to the view."""
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        try:
+            filters, scope = identity.read_scope(request)
+        except Device.DoesNotExist:
+            return JsonResponse({"error": "unknown device"}, status=404)
+        except PermissionDenied as exc:
+            return JsonResponse({"error": str(exc)}, status=403)
+        except ValueError:
+            return JsonResponse({"error": "user must be an id; session needs device"}, status=400)
+        return view(request, filters, scope, *args, **kwargs)
+    return wrapper
+
+
+def _gaze_range(request, filters):
+    """GazeRecord queryset for the read scope, limited by optional ?since= / ?until= ISO datetimes."""
+    qs = GazeRecord.objects.filter(**filters)
+    since = request.GET.get("since")
+    until = request.GET.get("until")
+    if since:
+        qs = qs.filter(timestamp__gte=datetime.fromisoformat(since.replace("Z", "+00:00")))
+    if until:
+        qs = qs.filter(timestamp__lt=datetime.fromisoformat(until.replace("Z", "+00:00")))
+    return qs
+
+
+def _stream_gaze(qs, fmt):
+    """Yield rows oldest-first in constant memory, as NDJSON or one chunked JSON object."""
+    rows = (
+        qs.order_by("timestamp", "id")
+        .values_list(*GAZE_FIELDS)
+        .iterator(chunk_size=settings.FLOW_GAZE_STREAM_CHUNK)
+    )
+    encoder = DjangoJSONEncoder()
+
+    if fmt == "ndjson":
+        for row in rows:
+            yield encoder.encode(dict(zip(GAZE_FIELDS, row))) + "\n"
+        return
+
+    yield '{"gaze": ['
+    sep = ""
+    for row in rows:
+        yield sep + encoder.encode(dict(zip(GAZE_FIELDS, row)))
+        sep = ","
+    yield "]}"
+
+
+@scoped_read
+def all_gaze(request, filters, scope):
+    """
+    Gaze samples, newest first, one keyset page at a time.
+
+    ?limit=N          page size (default FLOW_GAZE_PAGE_SIZE, max FLOW_GAZE_PAGE_MAX)
+    ?before=<cursor>  the page of older samples (use "next_cursor")
+    ?after=<cursor>   the page of newer samples (use "prev_cursor")
+    ?since= / ?until= ISO datetime bounds
+    ?device= / ?user= / ?session= only this device, user or device session
+    ?stream=ndjson|json  stream the whole range oldest-first instead of paging
+    """
+    try:
+        qs = _gaze_range(request, filters)
+    except ValueError:
+        return JsonResponse({"error": "since/until must be ISO datetimes"}, status=400)
+
+    stream = request.GET.get("stream")
+    if stream:
+        if stream not in ("ndjson", "json"):
+            return JsonResponse({"error": "stream must be ndjson or json"}, status=400)
+        content_type = "application/x-ndjson" if stream == "ndjson" else "application/json"
+        return StreamingHttpResponse(_stream_gaze(qs, stream), content_type=content_type)
+
+    try:
+        limit = int(request.GET.get("limit", settings.FLOW_GAZE_PAGE_SIZE))
+        before = request.GET.get("before")
+        after = request.GET.get("after")
+        cursor = _decode_cursor(before or after) if (before or after) else None
+    except (ValueError, UnicodeDecodeError):
+        return JsonResponse({"error": "invalid limit or cursor"}, status=400)
+    limit = max(1, min(limit, settings.FLOW_GAZE_PAGE_MAX))
+
+    if after:
+        ts, pk = cursor
+        qs = qs.filter(Q(timestamp__gt=ts) | Q(timestamp=ts, id__gt=pk)).order_by("timestamp", "id")
+    else:
+        if before:
+            ts, pk = cursor
+            qs = qs.filter(Q(timestamp__lt=ts) | Q(timestamp=ts, id__lt=pk))
+        qs = qs.order_by("-timestamp", "-id")
+
+    # one extra row tells us whether there is another page
+    rows = list(qs.values_list(*GAZE_FIELDS)[:limit + 1])
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if after:
+        rows.reverse()
+
+    data = [dict(zip(GAZE_FIELDS, row)) for row in rows]
+    first, last = (rows[0], rows[-1]) if rows else (None, None)
+    has_older = more if not after else True
+    has_newer = more if after else bool(before)
+
+    return JsonResponse({
+        "gaze": data,
+        "next_cursor": _encode_cursor(last[1], last[0]) if last and has_older else None,
+        "prev_cursor": _encode_cursor(first[1], first[0]) if first and has_newer else None,
+    })
+
+
+@scoped_read
+def latest_gaze(request, filters, scope):
+    def build():
+        last = GazeRecord.objects.filter(**filters).order_by("-timestamp").first()
+        return (latest_cache.gaze_payload(last), last.timestamp) if last else None
+
+    response = latest_cache.respond(request, latest_cache.GAZE, build, scope)
+    if response is None:
         return JsonResponse({"error": "no gaze data"}, status=404)
+    return response
+
+
+@scoped_read
+def gaze_range(request, filters, scope):
+    """
+    Gaze over ?since= .. ?until= (default now) from the cheapest tier.
+
+    ?resolution=auto|raw|second|minute  auto picks raw for short recent
+    spans, then per-second, then per-minute buckets (see gaze_rollup).
+    Session-scoped reads only exist at raw resolution.
+    """
+    try:
+        since = datetime.fromisoformat(request.GET["since"].replace("Z", "+00:00"))
+        until = request.GET.get("until")
+        until = datetime.fromisoformat(until.replace("Z", "+00:00")) if until else timezone.now()
+    except (KeyError, ValueError):
+        return JsonResponse({"error": "since (and until) must be ISO datetimes"}, status=400)
+    if since.tzinfo is None or until.tzinfo is None:
+        return JsonResponse({"error": "since/until need a UTC offset"}, status=400)
+
+    resolution = request.GET.get("resolution", "auto")
+    if resolution == "auto":
+        resolution = "raw" if "session_id" in filters else gaze_rollup.choose_tier(since, until)
+    if resolution not in ("raw", *gaze_rollup.TIERS):
+        return JsonResponse({"error": "resolution must be auto, raw, second or minute"}, status=400)
+    if resolution != "raw" and "session_id" in filters:
+        return JsonResponse({"error": "session reads are raw only"}, status=400)
 
     return JsonResponse({
-        "timestamp": last.timestamp,
-        "gaze_x": last.gaze_x,
-        "gaze_y": last.gaze_y,
-        "screen_w": last.screen_w,
-        "screen_h": last.screen_h,
-        "received_at": last.received_at,
+        "since": since,
+        "until": until,
+        **gaze_rollup.query_range(filters, since, until, resolution),
     })
 
-def predict_flow(features):
-    X = np.array([features], dtype=np.float32)
 
-    input_name = sess.get_inputs()[0].name
-    pred = sess.run(None, {input_name: X})[0]
+@scoped_read
+def gaze_fixations(request, filters, scope):
+    """
+    Fixations and saccades over ?since= .. ?until= (default now), with
+    fixation / saccade / region-dwell metrics per ?window= seconds
+    (default 5, one heartbeat). ?method=ivt|idt overrides
+    FLOW_FIXATION_METHOD; ?fixations=1 also lists every fixation.
+    Works on raw samples, so only within the raw retention period.
+    """
+    try:
+        since = datetime.fromisoformat(request.GET["since"].replace("Z", "+00:00"))
+        until = request.GET.get("until")
+        until = datetime.fromisoformat(until.replace("Z", "+00:00")) if until else timezone.now()
+    except (KeyError, ValueError):
+        return JsonResponse({"error": "since (and until) must be ISO datetimes"}, status=400)
+    if since.tzinfo is None or until.tzinfo is None:
+        return JsonResponse({"error": "since/until need a UTC offset"}, status=400)
+    try:
+        window = float(request.GET.get("window", 5))
+        params = gaze_analysis.Params.from_settings(
+            method=request.GET.get("method", settings.FLOW_FIXATION_METHOD)
+        )
+    except ValueError as exc:
+        return JsonResponse({"error": str(exc)}, status=400)
+    if not 0.5 <= window <= 3600:
+        return JsonResponse({"error": "window must be between 0.5 and 3600 seconds"}, status=400)
+    if (until - since).total_seconds() > settings.FLOW_FIXATION_MAX_SPAN_S:
+        return JsonResponse(
+            {"error": f"span too long (max {settings.FLOW_FIXATION_MAX_SPAN_S} s)"}, status=400
+        )
+
+    with metrics.stage("fixations", "query"):
+        rows = (
+            GazeRecord.objects.filter(**filters, timestamp__gte=since, timestamp__lt=until)
+            .order_by("timestamp", "id")
+            .values_list("timestamp", "gaze_x", "gaze_y", "screen_w", "screen_h")
+            .iterator(chunk_size=settings.FLOW_GAZE_STREAM_CHUNK)
+        )
+        samples = np.array([(ts.timestamp(), x, y, w, h) for ts, x, y, w, h in rows], dtype=np.float64)
+    with metrics.stage("fixations", "detect"):
+        fixations, moves, table, origin = gaze_analysis.analyse(
+            samples, params, window, since=since.timestamp()
+        )
+
+    payload = {
+        "since": since,
+        "until": until,
+        "method": params.method,
+        "samples": len(samples),
+        "fixation_count": len(fixations),
+        "saccade_count": len(moves),
+        "windows": [
+            {"start": datetime.fromtimestamp(origin + i * window, tz=dt_timezone.utc),
+             **dict(zip(gaze_analysis.METRICS, row))}
+            for i, row in enumerate(table.tolist())
+        ],
+    }
+    if request.GET.get("fixations") == "1":
+        payload["fixations"] = gaze_analysis.fixation_payload(fixations)
+    return JsonResponse(payload)
 
-    return pred[0]
+def predict_flow(vector):
+    """Return (label, model_version) for one feature vector."""
+    if settings.FLOW_INFERENCE_BATCHING:
+        return batcher.predict(vector)
 
-def latest_tasks(request):
-    last_record = BiometricRecord.objects.order_by("-timestamp").first()
-    if not last_record:
-        return JsonResponse({"tasks": []})
+    model = model_registry.get_model()
+    X = np.array([vector], dtype=np.float32)
+    with metrics.inference_seconds.time("live"):
+        pred = model.run(X[:, :model.n_features])
+    metrics.inference_batch_rows.observe(1, "live")
 
-    tasks = [
-        {
-            "timestamp": t.timestamp,
-            "app": t.app,
-            "title": t.title,
-            "url": t.url,
-            "active": t.active,
-        }
-        for t in last_record.tasks.all()
-    ]
+    return pred[0], model.version
 
-    return JsonResponse({"tasks": tasks})
 
+def inference_stats(request):
+    return JsonResponse(batcher.stats())
 
-def latest_state(request):
-    last = BiometricRecord.objects.order_by("-timestamp").first()
-    if not last:
-        return JsonResponse({"error": "no data"}, status=404)
+
+def model_versions(request):
+    """
+    GET: live/shadow model versions and shadow agreement stats.
+    POST (staff only, with the CSRF token): {"version": "...", "role":
+    "live" | "shadow"} loads that version in the background and swaps it
+    in; {"role": "shadow", "version": null} stops shadow scoring.
+    """
+    if request.method == "POST":
+        if not request.user.is_staff:
+            return JsonResponse({"error": "staff only"}, status=403)
+
+        try:
+            data = json.loads(request.body or b"{}")
+            role = data.get("role", "live")
+            version = data.get("version")
+            if version is not None and not isinstance(version, str):
+                raise TypeError
+        except (ValueError, TypeError, AttributeError):
+            return JsonResponse({"error": "invalid payload"}, status=400)
+
+        if role == "shadow" and not version:
+            model_registry.clear_shadow()
+        else:
+            try:
+                model_registry.activate(version, role=role)
+            except ValueError as exc:
+                return JsonResponse({"error": str(exc)}, status=400)
+            return JsonResponse({"status": "loading", "version": version, "role": role}, status=202)
 
     return JsonResponse({
-        "timestamp": last.timestamp,
-        "received_at": last.received_at,
-
-        # Typing metrics
-        "mean_iki_ms": last.mean_iki_ms,
-        "variance_iki": last.variance_iki,
-        "burstiness": last.burstiness,
-        "total_keys": last.total_keys,
-        "backspace_rate": last.backspace_rate,
-        "backspaces": last.backspaces,
-
-        # Mouse metrics
-        "distance_px": last.distance_px,
-        "click_rate_per_sec": last.click_rate_per_sec,
-        "mouse_clicks": last.mouse_clicks,
-
-        # System metrics
-        "idle_time_ms": last.idle_time_ms,
-
-        # ML output
-        "state_prediction": last.state_prediction,
-        
-        # gaze
-        "gaze_x": last.gaze_x,
-        "gaze_y": last.gaze_y,
-        "screen_w": last.screen_w,
-        "screen_h": last.screen_h,
+        **model_registry.status(),
+        "shadow_stats": batcher.stats()["shadow"],
     })
 
+@scoped_read
+def latest_tasks(request, filters, scope):
+    def build():
+        last_record = BiometricRecord.objects.filter(**filters).order_by("-timestamp").first()
+        if not last_record:
+            return latest_cache.tasks_payload(None, []), None
+        windows = task_catalogue.windows_for(last_record)
+        return latest_cache.tasks_payload(last_record.timestamp, windows), last_record.timestamp
+
+    return latest_cache.respond(request, latest_cache.TASKS, build, scope)
+
+
+@scoped_read
+def latest_state(request, filters, scope):
+    def build():
+        last = BiometricRecord.objects.filter(**filters).order_by("-timestamp").first()
+        return (latest_cache.state_payload(last), last.timestamp) if last else None
+
+    response = latest_cache.respond(request, latest_cache.STATE, build, scope)
+    if response is None:
+        return JsonResponse({"error": "no data"}, status=404)
+    return response
+
+@scoped_read
+def flow_history(request, filters, scope):
+    """
+    Time per state, mean metrics and top apps per hour or day.
+
+    ?since= / ?until= ISO datetimes (default: today, UTC, until now)
+    ?granularity=hour|day  (default hour for spans up to 2 days, else day)
+    ?device= / ?user= as for the other read endpoints
+    """
+    if "session_id" in filters:
+        return JsonResponse({"error": "history is per device or user, not session"}, status=400)
+    try:
+        now = timezone.now()
+        since = request.GET.get("since")
+        until = request.GET.get("until")
+        since = (datetime.fromisoformat(since.replace("Z", "+00:00")) if since
+                 else now.replace(hour=0, minute=0, second=0, microsecond=0))
+        until = datetime.fromisoformat(until.replace("Z", "+00:00")) if until else now
+    except ValueError:
+        return JsonResponse({"error": "since/until must be ISO datetimes"}, status=400)
+    if since.tzinfo is None or until.tzinfo is None:
+        return JsonResponse({"error": "since/until need a UTC offset"}, status=400)
+
+    granularity = request.GET.get("granularity") or (
+        "hour" if (until - since).total_seconds() <= 2 * 86400 else "day"
+    )
+    if granularity not in history.GRANULARITIES:
+        return JsonResponse({"error": "granularity must be hour or day"}, status=400)
+
+    return JsonResponse({"since": since, "until": until, **history.query(filters, since, until, granularity)})
+
+
+def _finite(value, field):
+    """``value`` as a float; ValueError unless it is a finite number."""
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+        raise ValueError(f"{field} must be a finite number")
+    return float(value)
+
+
+def _build_heartbeat(data, decoded=None):
+    """
+    Turn a heartbeat payload into an unsaved BiometricRecord, its Windows
+    and the float32 feature vector. ``decoded`` is the payload's
+    (vector, fields) when it was already decoded in a batch.
+    """
+    raw, values = decoded if decoded is not None else features.decode_one(data)
+    tasks = data.get("tasks", [])
+    gaze = data.get("gaze", {})
+    if not isinstance(gaze, dict):
+        raise ValueError("gaze must be an object")
+
+    timestamp_str = data.get("timestamp")
+    if isinstance(timestamp_str, (int, float)):
+        # unix seconds, as binary / msgpack clients send it
+        timestamp = codecs.unix_datetime(timestamp_str)
+    else:
+        timestamp = datetime.fromisoformat(timestamp_str.replace("Z", "+00:00"))
+
+    record = BiometricRecord(
+        timestamp=timestamp,
+
+        # Typing, mouse and system metrics (the model inputs)
+        **values,
+
+        # Gaze
+        gaze_x=_finite(gaze.get("x", 0), "gaze.x"),
+        gaze_y=_finite(gaze.get("y", 0), "gaze.y"),
+        screen_w=_finite(gaze.get("screen_w", 0), "gaze.screen_w"),
+        screen_h=_finite(gaze.get("screen_h", 0), "gaze.screen_h"),
+    )
+
+    return record, [task_catalogue.Window.from_dict(t) for t in tasks], raw
+
+
+def _read_heartbeat(request):
+    """
+    Decode a heartbeat body (JSON, msgpack or x-flow-heartbeat struct).
+
+    Returns (record, windows, data, raw): ``data`` is the decoded dict
+    (empty for the struct), ``raw`` the float32 feature vector.
+    """
+    if request.content_type == codecs.HEARTBEAT_TYPE:
+        record, windows, raw = codecs.decode_heartbeat(request)
+        return record, windows, {}, raw
+    data = codecs.load(request)
+    if not isinstance(data, dict):
+        raise ValueError("heartbeat must be an object")
+    record, windows, raw = _build_heartbeat(data)
+    return record, windows, data, raw
+
+
+def _model_features(ident, raw):
+    """Raw features, extended with the session's rolling features when enabled."""
+    if not settings.FLOW_FEATURE_ENGINE:
+        return raw
+    return feature_engine.engine.update(ident.feature_key, raw)
+
+
+def _feature_snapshot(ident):
+    """Session feature state to put back if the heartbeats fed next are not stored."""
+    if not settings.FLOW_FEATURE_ENGINE:
+        return None
+    return feature_engine.engine.snapshot(ident.feature_key)
+
+
+def _restore_features(ident, snapshot):
+    if snapshot is not None:
+        feature_engine.engine.restore(ident.feature_key, snapshot)
+
+
+def _buffer_gaze(ident, records):
+    """Hand stored gaze samples to the feature engine for the next heartbeat."""
+    if settings.FLOW_FEATURE_ENGINE and records:
+        feature_engine.engine.add_gaze(
+            ident.feature_key,
+            [(r.timestamp.timestamp(), r.gaze_x, r.gaze_y, r.screen_w, r.screen_h) for r in records],
+        )
+
+
+def _client_id(request, data):
+    """The client-generated item id (X-Flow-Client-Id or "client_id"), or ""."""
+    client_id = request.headers.get("X-Flow-Client-Id") or data.get("client_id") or ""
+    if not isinstance(client_id, str) or len(client_id) > 64:
+        raise ValueError("client_id must be a string of at most 64 characters")
+    return client_id
+
+
+def _receipt(client_id):
+    """(record id,) stored for ``client_id``, or None when it is new."""
+    return ClientReceipt.objects.filter(client_id=client_id).values_list("record_id").first()
+
+
+def _save_heartbeat(record, windows, endpoint="biometric", client_id=""):
+    """
+    Resolve the windows to catalogue ids and INSERT the record (plus its
+    ClientReceipt when the client sent an id) in one transaction, so a
+    failed insert leaves no catalogue entries behind. Raises
+    IntegrityError when that id was already ingested.
+    """
+    with transaction.atomic():
+        with metrics.stage(endpoint, "catalogue"):
+            created = task_catalogue.catalogue.assign([(record, windows)])
+        with metrics.stage(endpoint, "insert_record"):
+            record.save()
+            if client_id:
+                ClientReceipt.objects.create(client_id=client_id, kind="heartbeat", record_id=record.pk, count=1)
+    metrics.rows_written.inc("task_entry", amount=created)
+    metrics.rows_written.inc("biometric_record")
+    with metrics.stage(endpoint, "cache"):
+        latest_cache.record_heartbeat(record, windows)
+
+
 @csrf_exempt
+@metrics.instrument("biometric")
 def biometric(request):
     if request.method == "POST":
-        data = json.loads(request.body)
-
-        typing = data.get("typing", {})
-        mouse = data.get("mouse", {})
-        tasks = data.get("tasks", []) 
-        gaze = data.get("gaze", {})
-
-        timestamp_str = data.get("timestamp")
-        timestamp = datetime.fromisoformat(timestamp_str.replace("Z", ""))
-
-        # Create biometric record
-        record = BiometricRecord.objects.create(
-            timestamp=timestamp,
-
-            # Typing metrics
-            mean_iki_ms=typing.get("mean_iki_ms", 0),
-            variance_iki=typing.get("variance_iki", 0),
-            burstiness=typing.get("burstiness", 0),
-            total_keys=int(typing.get("total_keys", 0)),
-            backspace_rate=typing.get("backspace_rate", 0),
-            backspaces=int(typing.get("backspaces", 0)),
-
-            # Mouse metrics
-            distance_px=int(mouse.get("distance_px", 0)),
-            click_rate_per_sec=mouse.get("click_rate_per_sec", 0),
-            mouse_clicks=int(mouse.get("mouse_clicks", 0)),
-
-            # System metrics
-            idle_time_ms=int(data.get("idle_time_ms", 0)),
-            
-            # Gaze
-            gaze_x=gaze.get("x", 0),
-            gaze_y=gaze.get("y", 0),
-            screen_w=gaze.get("screen_w", 0),
-            screen_h=gaze.get("screen_h", 0),
-        )
+        try:
+            with metrics.stage("biometric", "parse"):
+                record, windows, data, raw = _read_heartbeat(request)
+                client_id = _client_id(request, data)
+        except codecs.UnsupportedPayload as exc:
+            return JsonResponse({"error": str(exc)}, status=415)
+        except (ValueError, TypeError, AttributeError) as exc:
+            return JsonResponse({"error": f"invalid heartbeat: {exc}"}, status=400)
+        with metrics.stage("biometric", "identity"):
+            ident = identity.from_request(request, data)
+            ident.apply(record)
+
+        # a replay of a heartbeat we already have (the client missed our
+        # answer) must not reach the session's rolling features again
+        snapshot = None
+        if client_id:
+            with metrics.stage("biometric", "dedupe"):
+                existing = _receipt(client_id)
+            if existing is not None:
+                return JsonResponse({"status": "duplicate", "id": existing[0]})
+            snapshot = _feature_snapshot(ident)
+
+        # ===== ML Prediction (before the insert, so the row is written once) =====
+        with metrics.stage("biometric", "features"):
+            inputs = _model_features(ident, raw)
+        with metrics.stage("biometric", "inference"):
+            record.state_prediction, record.model_version = predict_flow(inputs)
 
-        # ===== ML Prediction =====
-        features = [
-            record.mean_iki_ms,
-            record.variance_iki,
-            record.burstiness,
-            record.total_keys,
-            record.backspace_rate,
-            record.backspaces,
-            record.distance_px,
-            record.click_rate_per_sec,
-            record.mouse_clicks,
-            record.idle_time_ms,
-        ]
-
-        state = predict_flow(features)
-        record.state_prediction = state
-        record.save()
-
-        # ===== STORE TASKS =====
-        for t in tasks:
-            UserTask.objects.create(
-                timestamp=timestamp,
-                app=t.get("app", ""),
-                title=t.get("title", ""),
-                url=t.get("url", ""),
-                active=t.get("active", False),
-                record=record,   # link to biometrics
-            )
+        # ===== STORE RECORD + WINDOWS =====
+        try:
+            _save_heartbeat(record, windows, client_id=client_id)
+        except IntegrityError:
+            # the same replay stored by a concurrent request since the check
+            _restore_features(ident, snapshot)
+            return JsonResponse({"status": "duplicate", "id": _receipt(client_id)[0]})
 
         return JsonResponse({
             "status": "saved",
             "id": record.id,
-            "state_prediction": record.state_prediction
+            "state_prediction": record.state_prediction,
+            "model_version": record.model_version,
         })
 
     return JsonResponse({"error": "POST only"}, status=405)
 
+def _parse_gaze_sample(gaze):
+    """Validate one gaze sample dict and return an unsaved GazeRecord."""
+    if not isinstance(gaze, dict) or not gaze:
+        raise ValueError("sample must be a non-empty object")
+
+    timestamp = codecs.unix_datetime(gaze.get("timestamp"))
+
+    values = {field: _finite(gaze.get(field, 0), field) for field in codecs.GAZE_VALUES}
+
+    return GazeRecord(timestamp=timestamp, **values)
+
+
+def _ndjson_samples(body):
+    """
+    One sample per non-blank line. A line that isn't valid JSON becomes its
+    ValueError, so the batch rejects that sample alone.
+    """
+    samples = []
+    for line in body.splitlines():
+        if not line.strip():
+            continue
+        try:
+            samples.append(json.loads(line))
+        except ValueError as exc:
+            samples.append(ValueError(f"invalid JSON: {exc}"))
+    return samples
+
+
+def _read_gaze_samples(request):
+    """
+    Return (samples, batched, envelope) from a gaze POST body.
+
+    Accepted shapes:
+      {"gaze": {...}}             single sample (original format)
+      {"gaze": [{...}, ...]}      batch
+      [{...}, ...]                batch
+      one JSON object per line    batch, Content-Type application/x-ndjson
+      packed structs              batch, Content-Type application/x-flow-gaze;
+                                  samples is then a structured array
+    The object shapes may also be sent as application/msgpack.
+
+    ``envelope`` is the outer object when there is one, so device_id /
+    session_id can ride along with the samples.
+    """
+    if request.content_type == codecs.GAZE_TYPE:
+        return codecs.decode_gaze(request), True, {}
+
+    if request.content_type in ("application/x-ndjson", "application/jsonl"):
+        return _ndjson_samples(request.body), True, {}
+
+    data = codecs.load(request)
+    if isinstance(data, list):
+        return data, True, {}
+    if not isinstance(data, dict):
+        raise ValueError("body must be an object or an array")
+
+    gaze = data.get("gaze", {})
+    if isinstance(gaze, list):
+        return gaze, True, data
+    return [gaze], False, data
+
+
+def _parse_gaze_batch(samples):
+    """Validate a batch; returns (unsaved GazeRecords, per-index errors)."""
+    if isinstance(samples, np.ndarray):
+        return codecs.gaze_records(samples)
+
+    records = []
+    errors = []
+    for i, sample in enumerate(samples):
+        try:
+            if isinstance(sample, ValueError):
+                raise sample
+            records.append(_parse_gaze_sample(sample))
+        except ValueError as exc:
+            errors.append({"index": i, "error": str(exc)})
+    return records, errors
+
+
 @csrf_exempt
+@metrics.instrument("gaze")
 def receive_gaze(request):
     if request.method != "POST":
         return JsonResponse({"error": "POST only"}, status=405)
 
-    data = json.loads(request.body)
-    gaze = data.get("gaze", {})
+    try:
+        with metrics.stage("gaze", "parse"):
+            samples, batched, envelope = _read_gaze_samples(request)
+    except codecs.UnsupportedPayload as exc:
+        return JsonResponse({"error": str(exc)}, status=415)
+    except (ValueError, UnicodeDecodeError):
+        return JsonResponse({"error": "invalid payload"}, status=400)
+    ident = identity.from_request(request, envelope)
 
-    if not gaze:
-        return JsonResponse({"error": "no gaze data"}, status=400)
+    if not batched:
+        if not samples[0]:
+            return JsonResponse({"error": "no gaze data"}, status=400)
+        try:
+            rec = _parse_gaze_sample(samples[0])
+        except ValueError as exc:
+            return JsonResponse({"error": str(exc)}, status=400)
+        ident.apply(rec)
+        with metrics.stage("gaze", "insert"):
+            rec.save()
+        metrics.rows_written.inc("gaze_record")
+        latest_cache.record_gaze([rec])
+        _buffer_gaze(ident, [rec])
+        return JsonResponse({"status": "saved", "id": rec.id})
 
-    ts = gaze.get("timestamp")
-    from datetime import datetime
-    timestamp = datetime.fromtimestamp(ts)
+    if len(samples) > settings.FLOW_GAZE_BATCH_MAX:
+        return JsonResponse(
+            {"error": f"batch too large (max {settings.FLOW_GAZE_BATCH_MAX} samples)"},
+            status=413,
+        )
 
-    rec = GazeRecord.objects.create(
-        timestamp=timestamp,
-        gaze_x=gaze.get("gaze_x", 0),
-        gaze_y=gaze.get("gaze_y", 0),
-        screen_w=gaze.get("screen_w", 0),
-        screen_h=gaze.get("screen_h", 0),
+    with metrics.stage("gaze", "validate"):
+        records, errors = _parse_gaze_batch(samples)
+        ident.apply(*records)
+
+    # One INSERT and one commit for the whole batch
+    with metrics.stage("gaze", "insert"), transaction.atomic():
+        GazeRecord.objects.bulk_create(records)
+    metrics.rows_written.inc("gaze_record", amount=len(records))
+    with metrics.stage("gaze", "cache"):
+        latest_cache.record_gaze(records)
+    with metrics.stage("gaze", "features"):
+        _buffer_gaze(ident, records)
+
+    return JsonResponse({
+        "status": "saved" if not errors else "partial",
+        "saved": len(records),
+        "rejected": len(errors),
+        "errors": errors,
+    }, status=200 if records or not errors else 400)
+
+
+
+# ===== Bulk replay =====
+
+def _decode_bulk_heartbeats(items):
+    """
+    Decode the features of every heartbeat item in one batch. Returns
+    {item index: (vector, fields)}, or the error message for invalid ones.
+    """
+    index = [
+        i for i, item in enumerate(items)
+        if isinstance(item, dict) and item.get("kind") == "heartbeat" and isinstance(item.get("data"), dict)
+    ]
+    batch = features.decode([items[i]["data"] for i in index])
+    return {
+        i: batch.errors[n] if n in batch.errors else (batch.X[n], batch.fields(n))
+        for n, i in enumerate(index)
+    }
+
+
+def _bulk_item(ident, item, decoded=None):
+    """
+    Parse one replayed item into ("heartbeat", (record, windows, features))
+    or ("gaze", [GazeRecord, ...]). Raises ValueError when it is unusable.
+    """
+    kind = item.get("kind")
+    data = item.get("data")
+    if kind == "heartbeat":
+        if not isinstance(data, dict):
+            raise ValueError("heartbeat data must be an object")
+        if isinstance(decoded, str):
+            raise ValueError(decoded)
+        record, windows, raw = _build_heartbeat(data, decoded)
+        ident.apply(record)
+        return kind, (record, windows, _model_features(ident, raw))
+    if kind == "gaze":
+        samples = data if isinstance(data, list) else [data]
+        if len(samples) > settings.FLOW_GAZE_BATCH_MAX:
+            raise ValueError(f"too many samples (max {settings.FLOW_GAZE_BATCH_MAX})")
+        records, errors = _parse_gaze_batch(samples)
+        if errors:
+            raise ValueError(f"sample {errors[0]['index']}: {errors[0]['error']}")
+        ident.apply(*records)
+        return kind, records
+    raise ValueError("kind must be heartbeat or gaze")
+
+
+@csrf_exempt
+@metrics.instrument("bulk")
+def ingest_bulk(request):
+    """
+    Replay items a client buffered while offline, oldest first.
+
+    {"device_id": ..., "session_id": ..., "items": [
+        {"client_id": "<uuid>", "kind": "heartbeat" | "gaze", "data": {...}}, ...]}
+
+    ``data`` is a heartbeat payload, or one gaze sample / a list of them.
+    Each client_id is stored once: an item already ingested comes back as
+    "duplicate" instead of being written again, so a client that never saw
+    our answer can simply resend. Everything new is written in a single
+    transaction together with its receipts. The answer lists one result
+    per item; the client drops "saved", "duplicate" and "rejected" items
+    from its buffer alike.
+    """
+    if request.method != "POST":
+        return JsonResponse({"error": "POST only"}, status=405)
+
+    try:
+        with metrics.stage("bulk", "parse"):
+            data = codecs.load(request)
+            items = data.get("items")
+            if not isinstance(items, list):
+                raise ValueError
+    except codecs.UnsupportedPayload as exc:
+        return JsonResponse({"error": str(exc)}, status=415)
+    except (ValueError, TypeError, AttributeError, UnicodeDecodeError):
+        return JsonResponse({"error": "invalid payload"}, status=400)
+    if len(items) > settings.FLOW_BULK_MAX_ITEMS:
+        return JsonResponse(
+            {"error": f"too many items (max {settings.FLOW_BULK_MAX_ITEMS})"},
+            status=413,
+        )
+
+    ident = identity.from_request(request, data)
+    ids = [item.get("client_id") if isinstance(item, dict) else None for item in items]
+    with metrics.stage("bulk", "dedupe"):
+        seen = dict(
+            ClientReceipt.objects.filter(client_id__in=[i for i in ids if isinstance(i, str)])
+            .values_list("client_id", "record_id")
+        )
+
+    results, heartbeats, gaze, receipts = [], [], [], []
+    snapshot = _feature_snapshot(ident)
+    with metrics.stage("bulk", "validate"):
+        decoded = _decode_bulk_heartbeats(items)
+        for i, (client_id, item) in enumerate(zip(ids, items)):
+            if not isinstance(client_id, str) or not client_id or len(client_id) > 64:
+                results.append({"client_id": client_id, "status": "rejected",
+                                "error": "client_id must be a string of 1-64 characters"})
+                continue
+            if client_id in seen:
+                results.append({"client_id": client_id, "status": "duplicate", "id": seen[client_id]})
+                continue
+            try:
+                kind, parsed = _bulk_item(ident, item, decoded.get(i))
+            except (ValueError, TypeError, AttributeError, OverflowError, OSError) as exc:
+                results.append({"client_id": client_id, "status": "rejected", "error": str(exc)})
+                continue
+
+            seen[client_id] = None      # a repeat later in this request is a duplicate
+            receipt = ClientReceipt(client_id=client_id, kind=kind)
+            if kind == "heartbeat":
+                heartbeats.append(parsed)
+                receipt.count = 1
+                receipts.append((receipt, parsed[0]))
+            else:
+                gaze.extend(parsed)
+                receipt.count = len(parsed)
+                receipts.append((receipt, None))
+            results.append({"client_id": client_id, "status": "saved", "kind": kind, "count": receipt.count})
+
+    try:
+        ingest_queue.write_batch(heartbeats, gaze, receipts)
+    except IntegrityError:
+        # another request stored one of these ids after our check; the
+        # retry will see it as a duplicate, and nothing here was stored
+        _restore_features(ident, snapshot)
+        response = JsonResponse({"error": "conflicting replay, retry"}, status=409)
+        response["Retry-After"] = "1"
+        return response
+    _buffer_gaze(ident, gaze)
+
+    by_id = {receipt.client_id: receipt.record_id for receipt, _ in receipts}
+    for result in results:
+        if result["status"] == "saved" and result["kind"] == "heartbeat" or result.get("id", 0) is None:
+            result["id"] = by_id.get(result["client_id"])
+    counts = {status: sum(r["status"] == status for r in results) for status in ("saved", "duplicate", "rejected")}
+    return JsonResponse({"status": "ok", **counts, "results": results})
+
+
+# ===== Async ingestion (ASGI) =====
+
+async def _enqueue(request, kind, items):
+    """
+    Queue items for the background writers: 202 when queued, 503 when full.
+    Under WSGI they are written inline, which raises IntegrityError for a
+    heartbeat whose client id was stored since the view checked it.
+    """
+    if not isinstance(request, ASGIRequest):
+        # No long-lived event loop under WSGI, so write inline instead
+        await sync_to_async(ingest_queue.write_batch)(*ingest_queue.unpack((kind, item) for item in items))
+        return JsonResponse({"status": "saved", "count": len(items)})
+
+    if not await ingest_queue.pipeline.submit(kind, items):
+        return JsonResponse({"error": "ingest queue full, retry later"}, status=503)
+    return JsonResponse({"status": "queued", "count": len(items)}, status=202)
+
+
+@csrf_exempt
+@metrics.instrument("async_biometric")
+async def biometric_async(request):
+    if request.method != "POST":
+        return JsonResponse({"error": "POST only"}, status=405)
+
+    try:
+        with metrics.stage("async_biometric", "parse"):
+            record, windows, data, raw = _read_heartbeat(request)
+            client_id = _client_id(request, data)
+    except codecs.UnsupportedPayload as exc:
+        return JsonResponse({"error": str(exc)}, status=415)
+    except (ValueError, TypeError, AttributeError) as exc:
+        return JsonResponse({"error": f"invalid heartbeat: {exc}"}, status=400)
+
+    # request.user and unseen devices need the ORM, hence the thread hop
+    with metrics.stage("async_biometric", "identity"):
+        ident = await sync_to_async(identity.from_request)(request, data)
+    ident.apply(record)
+
+    # a replay must not reach the rolling features again (see biometric);
+    # one still in the queue has no record id yet
+    if client_id:
+        if client_id in ingest_queue.pipeline.pending:
+            return JsonResponse({"status": "duplicate", "id": None})
+        with metrics.stage("async_biometric", "dedupe"):
+            existing = await sync_to_async(_receipt)(client_id)
+        if existing is not None:
+            return JsonResponse({"status": "duplicate", "id": existing[0]})
+
+    # computed here, not in the writer, so per-session state sees arrival
+    # order; put back when the heartbeat isn't taken, so a retry counts once
+    snapshot = _feature_snapshot(ident)
+    with metrics.stage("async_biometric", "features"):
+        inputs = _model_features(ident, raw)
+    try:
+        with metrics.stage("async_biometric", "enqueue"):
+            response = await _enqueue(request, "heartbeat", [(record, windows, inputs, client_id)])
+    except IntegrityError:
+        _restore_features(ident, snapshot)
+        existing = await sync_to_async(_receipt)(client_id)
+        return JsonResponse({"status": "duplicate", "id": existing[0]})
+    if response.status_code == 503:
+        _restore_features(ident, snapshot)
+    return response
+
+
+@csrf_exempt
+@metrics.instrument("async_gaze")
+async def receive_gaze_async(request):
+    if request.method != "POST":
+        return JsonResponse({"error": "POST only"}, status=405)
+
+    try:
+        with metrics.stage("async_gaze", "parse"):
+            samples, _, envelope = _read_gaze_samples(request)
+    except codecs.UnsupportedPayload as exc:
+        return JsonResponse({"error": str(exc)}, status=415)
+    except (ValueError, UnicodeDecodeError):
+        return JsonResponse({"error": "invalid payload"}, status=400)
+    if len(samples) > settings.FLOW_GAZE_BATCH_MAX:
+        return JsonResponse(
+            {"error": f"batch too large (max {settings.FLOW_GAZE_BATCH_MAX} samples)"},
+            status=413,
+        )
+
+    with metrics.stage("async_gaze", "validate"):
+        records, errors = _parse_gaze_batch(samples)
+    if not records:
+        return JsonResponse({"error": "no valid gaze samples", "errors": errors}, status=400)
+
+    ident = await sync_to_async(identity.from_request)(request, envelope)
+    ident.apply(*records)
+    _buffer_gaze(ident, records)
+    with metrics.stage("async_gaze", "enqueue"):
+        response = await _enqueue(request, "gaze", records)
+    if errors and response.status_code < 300:
+        body = json.loads(response.content)
+        body.update({"rejected": len(errors), "errors": errors})
+        return JsonResponse(body, status=response.status_code)
+    return response
+
+
+async def live_stream(request):
+    """
+    Server-Sent Events stream of "state", "tasks" and (downsampled) "gaze"
+    events, pushed as soon as ingestion stores them. Starts with the
+    current cached state. ASGI only.
+
+    ?device=<key> or ?user=<id> only streams that device's or user's updates.
+    """
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({"error": "live stream needs the ASGI server"}, status=501)
+    if request.GET.get("session"):
+        return JsonResponse({"error": "live stream scopes are device or user"}, status=400)
+
+    try:
+        _, scope = await sync_to_async(identity.read_scope)(request)
+    except Device.DoesNotExist:
+        return JsonResponse({"error": "unknown device"}, status=404)
+    except PermissionDenied as exc:
+        return JsonResponse({"error": str(exc)}, status=403)
+    except ValueError:
+        return JsonResponse({"error": "user must be an id"}, status=400)
+
+    sub = live.broadcaster.subscribe(scope)
+    snapshot = await sync_to_async(latest_cache.get_body)(latest_cache.STATE, scope)
+    keepalive = settings.FLOW_LIVE_KEEPALIVE_S
+
+    async def events():
+        try:
+            yield b"retry: 3000\n\n"
+            if snapshot:
+                yield b"event: state\ndata: " + snapshot + b"\n\n"
+            while True:
+                try:
+                    yield await asyncio.wait_for(sub.queue.get(), keepalive)
+                except asyncio.TimeoutError:
+                    yield b": keepalive\n\n"
+        finally:
+            live.broadcaster.unsubscribe(sub)
+
+    response = StreamingHttpResponse(events(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+def ingest_stats(request):
+    return JsonResponse(ingest_queue.pipeline.stats())
+
+
+# ===== Metrics & profiling =====
+
+def _runtime_gauges():
+    """Gauges read from the batcher, ingest pipeline and live broadcaster at scrape time."""
+    inference = batcher.stats()
+    ingest = ingest_queue.pipeline.stats()
+    shadow = inference["shadow"]
+    lines = []
+    lines += metrics.gauge(
+        "flow_queue_depth", "Items waiting in an in-process queue.",
+        [(("inference",), inference["queue_depth"]), (("ingest",), ingest["queue_depth"])],
+        ("queue",),
     )
+    lines += metrics.gauge("flow_ingest_queue_max", "Capacity of the async ingest queue.",
+                           [((), ingest["queue_max"])])
+    lines += metrics.gauge("flow_ingest_writers", "Running async ingest writer tasks.",
+                           [((), ingest["writers"])])
+    lines += metrics.gauge(
+        "flow_ingest_items", "Async ingest items by outcome since the worker started.",
+        [((k,), ingest[k]) for k in ("enqueued", "written", "rejected", "failed")],
+        ("outcome",),
+    )
+    lines += metrics.gauge("flow_live_subscribers", "Connected /api/live/ streams.",
+                           [((), live.broadcaster.subscribers)])
+    lines += metrics.gauge("flow_feature_sessions", "Sessions tracked by the feature engine.",
+                           [((), feature_engine.engine.stats()["sessions"])])
+    if shadow is not None:
+        lines += metrics.gauge(
+            "flow_shadow_agreement_ratio", "Share of rows where the shadow model agrees with the live one.",
+            [((shadow["version"],), shadow["agreement_rate"])], ("version",),
+        )
+        lines += metrics.gauge(
+            "flow_shadow_errors", "Shadow batches that raised, for the current shadow version.",
+            [((shadow["version"],), shadow["errors"])], ("version",),
+        )
+    return lines
+
+
+def prometheus_metrics(request):
+    """Prometheus text exposition of this worker's metrics (see api/metrics.py)."""
+    return HttpResponse(
+        metrics.render(_runtime_gauges()),
+        content_type="text/plain; version=0.0.4; charset=utf-8",
+    )
+
+
+def profile(request):
+    """
+    Sampling profiler for this worker, staff only (the stacks expose code
+    paths of live requests).
+
+    GET: profiler status; ?format=folded returns the collapsed stacks
+    (flamegraph.pl / speedscope input).
+    POST: {"action": "start", "seconds": 30, "interval_ms": 10} or
+    {"action": "stop"}. Needs the CSRF token of the staff session.
+    """
+    if not request.user.is_staff:
+        return JsonResponse({"error": "staff only"}, status=403)
+    if request.method == "POST":
+        try:
+            data = json.loads(request.body or b"{}")
+            action = data.get("action", "start")
+            seconds = float(data.get("seconds", 30))
+            interval_ms = float(data.get("interval_ms", 10))
+            if not (math.isfinite(seconds) and math.isfinite(interval_ms) and seconds > 0):
+                raise ValueError
+        except (ValueError, TypeError, AttributeError):
+            return JsonResponse({"error": "invalid payload"}, status=400)
+        seconds = min(seconds, settings.FLOW_PROFILE_MAX_SECONDS)
+        interval_ms = max(interval_ms, 1.0)
+
+        if action == "stop":
+            metrics.profiler.stop()
+        elif action == "start":
+            if not metrics.profiler.start(seconds, interval_ms):
+                return JsonResponse({"error": "profiler already running"}, status=409)
+            return JsonResponse({"status": "started", **metrics.profiler.status()}, status=202)
+        else:
+            return JsonResponse({"error": "action must be start or stop"}, status=400)
 
-    return JsonResponse({"status": "saved", "id": rec.id})
+    if request.GET.get("format") == "folded":
+        return HttpResponse(metrics.profiler.folded(), content_type="text/plain; charset=utf-8")
+    return JsonResponse(metrics.profiler.status())
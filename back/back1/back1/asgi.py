@@ -13,4 +13,22 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'back1.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from django.conf import settings  # noqa: E402
+
+if settings.FLOW_MODEL_WARMUP:
+    from api import model_registry
+
+    model_registry.warm_up()
+
+
+async def application(scope, receive, send):
+    # Django doesn't speak the lifespan protocol; handle it here so the
+    # ingest queue is drained on shutdown.
+    if scope["type"] == "lifespan":
+        from api.ingest_queue import lifespan
+
+        await lifespan(scope, receive, send)
+        return
+    await django_application(scope, receive, send)
@@ -10,8 +10,11 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
+from .database import database_config
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -86,12 +89,33 @@ WSGI_APPLICATION = 'back1.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
+# Tuned SQLite by default; FLOW_DATABASE_URL=postgres://... switches to
+# PostgreSQL with a connection pool (see back1/database.py).
 
 DATABASES = {
+    'default': database_config(BASE_DIR),
+}
+
+
+# Caches
+# The "latest" alias holds the write-through latest state/tasks/gaze served
+# to pollers (api/latest_cache.py). Set FLOW_REDIS_URL to share it between
+# workers; the local-memory default is per process.
+
+FLOW_REDIS_URL = os.environ.get('FLOW_REDIS_URL')
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'latest': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': FLOW_REDIS_URL,
+        'KEY_PREFIX': 'flow',
+    } if FLOW_REDIS_URL else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'flow-latest',
+    },
 }
 
 
@@ -135,3 +159,128 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Flow ingestion / inference
+
+# Upper bound on samples accepted by one batched /api/gaze/ POST
+FLOW_GAZE_BATCH_MAX = 5000
+
+# /api/gaze/all/ keyset page size, and rows fetched per DB round trip when streaming
+FLOW_GAZE_PAGE_SIZE = 1000
+FLOW_GAZE_PAGE_MAX = 10000
+FLOW_GAZE_STREAM_CHUNK = 2000
+
+# ONNX model, loaded lazily on first prediction (see api/model_registry.py)
+FLOW_MODEL_PATH = BASE_DIR / 'flow_model.onnx'
+# Other versions are activated by name: FLOW_MODEL_DIR / '<version>.onnx'
+FLOW_MODEL_DIR = BASE_DIR
+FLOW_ONNX_PROVIDERS = ['CPUExecutionProvider']
+FLOW_ONNX_SESSION_OPTIONS = {
+    'intra_op_num_threads': 1,
+    'inter_op_num_threads': 1,
+    'graph_optimization_level': 'all',   # disable | basic | extended | all
+    'execution_mode': 'sequential',      # sequential | parallel
+    'enable_mem_arena': True,
+}
+# Load the model and run a dummy batch when a WSGI/ASGI worker starts
+FLOW_MODEL_WARMUP = False
+# Workers look for model activations made by other workers this often
+# (shared through FLOW_LATEST_CACHE, so only with FLOW_REDIS_URL set)
+FLOW_MODEL_SYNC_SECONDS = 5
+
+# Micro-batched inference: requests arriving within MAX_WAIT_MS of each
+# other share one sess.run call of up to MAX_BATCH rows.
+FLOW_INFERENCE_BATCHING = True
+FLOW_INFERENCE_MAX_BATCH = 32
+FLOW_INFERENCE_MAX_WAIT_MS = 2.0
+
+# Rolling per-session features appended to the raw model inputs
+# (see api/feature_engine.py). Window is in heartbeats (5 s each).
+# Off by default: the shipped model reads only the 10 raw inputs, and the
+# extended vector is neither stored nor exported, so no model can use it
+# yet. Turn it on together with a model trained on the wider input.
+FLOW_FEATURE_ENGINE = False
+FLOW_FEATURE_WINDOW = 12
+FLOW_FEATURE_EWMA_ALPHA = 0.3
+FLOW_FEATURE_MAX_SESSIONS = 1000
+# Gaze speed (screen fractions / second) below which a sample counts as fixation
+FLOW_FIXATION_VELOCITY = 0.5
+# Fixation / saccade detection (see api/gaze_analysis.py): "ivt" (velocity)
+# or "idt" (dispersion). Speed is measured over VELOCITY_WINDOW_MS to smooth
+# tracker noise; DISPERSION is x spread + y spread in screen fractions.
+# Fixations shorter than MIN_MS are dropped, a tracking gap longer than
+# FLOW_GAZE_MAX_GAP_MS ends one, and fixations further apart than
+# FLOW_SACCADE_MAX_MS are not joined by a saccade.
+FLOW_FIXATION_METHOD = "ivt"
+FLOW_FIXATION_VELOCITY_WINDOW_MS = 80
+FLOW_FIXATION_DISPERSION = 0.1
+FLOW_FIXATION_MIN_MS = 100
+FLOW_GAZE_MAX_GAP_MS = 100
+FLOW_SACCADE_MAX_MS = 500
+# Longest span /api/gaze/fixations/ analyses in one request
+FLOW_FIXATION_MAX_SPAN_S = 3600
+
+# Latest-state cache alias and entry TTL in seconds. Without Redis each
+# worker has its own copy, so the TTL bounds cross-worker staleness.
+FLOW_LATEST_CACHE = 'latest'
+FLOW_LATEST_CACHE_TTL = 300 if FLOW_REDIS_URL else 5
+
+# Live SSE stream (/api/live/): per-subscriber buffer, gaze push rate limit,
+# and keep-alive comment interval
+FLOW_LIVE_QUEUE_SIZE = 16
+FLOW_LIVE_GAZE_INTERVAL_MS = 100
+FLOW_LIVE_KEEPALIVE_S = 15
+
+# Async ingestion queue (ASGI only, see api/ingest_queue.py)
+FLOW_INGEST_QUEUE_SIZE = 10000       # items; beyond this submit() waits, then 503
+FLOW_INGEST_PUT_TIMEOUT_MS = 100
+FLOW_INGEST_BATCH_SIZE = 500         # items per bulk write
+FLOW_INGEST_FLUSH_MS = 50            # max wait to fill a batch
+FLOW_INGEST_WRITERS = 1
+
+# /api/ingest/bulk/: items per request, and how long client ids are
+# remembered for de-duplication (manage.py prune_receipts)
+FLOW_BULK_MAX_ITEMS = 500
+FLOW_RECEIPT_RETENTION_DAYS = 7
+
+# Admin changelists of the large tables count exactly up to this many rows,
+# then estimate (see api/admin.py)
+FLOW_ADMIN_EXACT_COUNT = 10000
+
+# Device key -> id lookups kept in memory per process (see api/identity.py)
+FLOW_DEVICE_CACHE_SIZE = 10000
+# True keeps reads as they were: without ?device= / ?user= the read
+# endpoints and /api/live/ return everyone's latest data to anyone, and a
+# device key alone reads that device. False requires a login: unscoped
+# reads are then the caller's own data (everything for staff), and
+# ?device= needs the device owner's login or staff.
+FLOW_PUBLIC_READS = True
+
+# Distinct open windows (app, title, url) cached per process, see api/task_catalogue.py
+FLOW_TASK_CACHE_SIZE = 50000
+
+# Gaze retention tiers (see api/gaze_rollup.py, manage.py rollup_gaze).
+# Raw samples are kept RAW_RETENTION_DAYS, per-second buckets
+# SECOND_RETENTION_DAYS, per-minute buckets forever.
+FLOW_GAZE_RAW_RETENTION_DAYS = 7
+FLOW_GAZE_SECOND_RETENTION_DAYS = 90
+FLOW_GAZE_ROLLUP_CHUNK = 50000       # raw rows aggregated per transaction
+FLOW_GAZE_PRUNE_BATCH = 5000         # rows per DELETE
+# Roll-ups skip rows received less than this long ago: ids can commit out
+# of order, and a lower id showing up after the high-water mark passed it
+# would never be rolled up (and then pruned). Keep it above the longest
+# ingestion transaction.
+FLOW_ROLLUP_LAG_S = 60
+# /api/gaze/range/ answers from raw rows up to this span, then per-second
+# buckets, then per-minute buckets
+FLOW_GAZE_RAW_MAX_SPAN_S = 300
+FLOW_GAZE_SECOND_MAX_SPAN_S = 6 * 3600
+
+# Flow history aggregates (see api/history.py, manage.py compact_history)
+FLOW_HEARTBEAT_SECONDS = 5           # time one heartbeat stands for
+FLOW_HISTORY_CHUNK = 20000           # heartbeats folded per transaction
+FLOW_HISTORY_MAX_APPS = 50           # apps kept per aggregate bucket
+
+# Longest run accepted by the sampling profiler (POST /api/profile/)
+FLOW_PROFILE_MAX_SECONDS = 300
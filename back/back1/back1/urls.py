@@ -18,6 +18,8 @@ from django.contrib import admin
 from django.urls import path, include
 from django.http import JsonResponse
 
+from api.views import prometheus_metrics
+
 def home(request):
     return JsonResponse({"message": "API is running"})
 
@@ -26,4 +28,5 @@ urlpatterns = [
     path("", home),
     path('admin/', admin.site.urls),
     path('api/', include('api.urls')),
+    path('metrics', prometheus_metrics),
 ]
@@ -1,3 +1,6 @@
+# Full CSV dump of the model features, kept for the training notebooks.
+# For incremental, day-partitioned Parquet/Arrow exports use:
+#   python manage.py export_training --out exports [--with-tasks] [--with-gaze]
 import os
 import django
 import csv
@@ -6,31 +9,27 @@ from pathlib import Path
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "back1.settings")
 django.setup()
 
+from api import features as schema
 from api.models import BiometricRecord
 
-features = [
-    "mean_iki_ms",
-    "variance_iki",
-    "burstiness",
-    "total_keys",
-    "backspace_rate",
-    "backspaces",
-    "distance_px",
-    "click_rate_per_sec",
-    "mouse_clicks", 
-    "idle_time_ms",
-]
-
-qs = BiometricRecord.objects.all().order_by("timestamp")
+features = list(schema.NAMES)
+
+# Stream plain tuples instead of building a model instance per row
+rows = (
+    BiometricRecord.objects.order_by("timestamp")
+    .values_list(*features)
+    .iterator(chunk_size=5000)
+)
 
 out_path = Path("biometrics_export.csv")
 
+count = 0
 with out_path.open("w", newline="", encoding="utf-8") as f:
     writer = csv.writer(f)
     writer.writerow(features)
 
-    for obj in qs:
-        row = [getattr(obj, field, "") for field in features]
+    for row in rows:
         writer.writerow(row)
+        count += 1
 
-print(f"Exported {qs.count()} rows → {out_path.resolve()}")
+print(f"Exported {count} rows → {out_path.resolve()}")
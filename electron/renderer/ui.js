@@ -82,7 +82,151 @@ window.addEventListener("mousedown", () => {
 
 // ----- Sending loop -----
 
-const backendUrl = "http://127.0.0.1:8000/biometric/"; 
+const apiBase = "http://127.0.0.1:8000/api/";
+const backendUrl = apiBase + "biometric/";
+const bulkUrl = apiBase + "ingest/bulk/";
+
+// Heartbeats go out as the backend's 64-byte binary struct
+// (application/x-flow-heartbeat, see back/back1/api/codecs.py) instead of
+// JSON. If the backend answers 415 we fall back to JSON for the session.
+let useBinary = true;
+
+// Order must match FEATURE_FIELDS in back/back1/api/models.py
+function featureValues(data) {
+  return [
+    data.typing.mean_iki_ms,
+    data.typing.variance_iki,
+    data.typing.burstiness,
+    data.typing.total_keys,
+    data.typing.backspace_rate,
+    data.typing.backspaces || 0,
+    data.mouse.distance_px,
+    data.mouse.click_rate_per_sec,
+    data.mouse.mouse_clicks || 0,
+    data.idle_time_ms
+  ];
+}
+
+function encodeHeartbeat(data) {
+  const buf = new ArrayBuffer(64);
+  const view = new DataView(buf);
+  view.setFloat64(0, Date.parse(data.timestamp) / 1000, true);
+  featureValues(data).forEach((v, i) => view.setFloat32(8 + 4 * i, v, true));
+  // gaze_x, gaze_y, screen_w, screen_h: not tracked here, left at 0
+  return buf;
+}
+
+// clientId lets the backend recognise a heartbeat it already stored when
+// the same one is replayed from the outbox
+async function postHeartbeat(data, clientId) {
+  if (useBinary) {
+    const res = await fetch(backendUrl, {
+      method: "POST",
+      headers: {
+        "Content-Type": "application/x-flow-heartbeat; v=1",
+        "X-Flow-Client-Id": clientId
+      },
+      body: encodeHeartbeat(data)
+    });
+    if (res.status !== 415) return res;
+    useBinary = false;
+  }
+  return fetch(backendUrl, {
+    method: "POST",
+    headers: { "Content-Type": "application/json", "X-Flow-Client-Id": clientId },
+    body: JSON.stringify(data)
+  });
+}
+
+// ----- Offline outbox -----
+
+// Heartbeats that could not be sent wait in localStorage and are replayed,
+// oldest first, through /api/ingest/bulk/. Every item carries a client id,
+// so a batch that was stored but whose answer got lost is answered with
+// "duplicate" on the retry instead of being stored twice.
+const OUTBOX_KEY = "flow.outbox.v1";
+const OUTBOX_MAX = 17280;     // a day of 5 s heartbeats; the oldest go first
+const FLUSH_BATCH = 200;      // items per bulk request
+const RETRY_BASE_MS = 5000;
+const RETRY_MAX_MS = 5 * 60 * 1000;
+
+let outbox = loadOutbox();
+let flushing = false;
+let retryDelay = 0;
+let nextFlushAt = 0;
+
+function loadOutbox() {
+  try {
+    const items = JSON.parse(localStorage.getItem(OUTBOX_KEY) || "[]");
+    return Array.isArray(items) ? items : [];
+  } catch (err) {
+    return [];
+  }
+}
+
+function saveOutbox() {
+  try {
+    localStorage.setItem(OUTBOX_KEY, JSON.stringify(outbox));
+  } catch (err) {
+    // quota exceeded: keep the newer half in memory and on disk
+    outbox = outbox.slice(Math.floor(outbox.length / 2));
+    localStorage.setItem(OUTBOX_KEY, JSON.stringify(outbox));
+  }
+}
+
+function enqueue(kind, data, clientId) {
+  outbox.push({ client_id: clientId, kind, data });
+  if (outbox.length > OUTBOX_MAX) outbox.splice(0, outbox.length - OUTBOX_MAX);
+  saveOutbox();
+}
+
+// Exponential backoff with full jitter; a Retry-After header wins
+function backOff(res) {
+  const retryAfter = res && Number(res.headers.get("Retry-After"));
+  retryDelay = Math.min(RETRY_MAX_MS, retryDelay ? retryDelay * 2 : RETRY_BASE_MS);
+  nextFlushAt = Date.now() + (retryAfter > 0 ? retryAfter * 1000 : Math.random() * retryDelay);
+}
+
+async function flushOutbox() {
+  if (flushing || !outbox.length || Date.now() < nextFlushAt) return;
+  flushing = true;
+  const batch = outbox.slice(0, FLUSH_BATCH);
+  try {
+    const res = await fetch(bulkUrl, {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify({ items: batch })
+    });
+    if (res.ok || res.status === 400 || res.status === 413) {
+      // saved, duplicate and rejected items are all done with; a whole
+      // batch the backend refuses to parse would otherwise block the queue
+      const done = new Set(batch.map((item) => item.client_id));
+      outbox = outbox.filter((item) => !done.has(item.client_id));
+      saveOutbox();
+      retryDelay = 0;
+      nextFlushAt = 0;
+    } else {
+      backOff(res);
+    }
+  } catch (err) {
+    backOff(null);
+  } finally {
+    flushing = false;
+  }
+  showQueued();
+}
+
+function showQueued() {
+  if (outbox.length) {
+    document.getElementById("status").innerText = outbox.length + " queued ⏳";
+  }
+}
+
+window.addEventListener("online", () => {
+  retryDelay = 0;
+  nextFlushAt = 0;
+  flushOutbox();
+});
 
 async function sendMetrics() {
   const now = Date.now();
@@ -125,23 +269,34 @@ async function sendMetrics() {
   document.getElementById("idle").innerText = data.idle_time_ms;
   document.getElementById("time").innerText = data.timestamp;
 
-  // Send to backend
+  // Send to backend; while older heartbeats are still queued this one
+  // queues behind them, so the backend receives them in order
+  const clientId = crypto.randomUUID();
+  if (outbox.length) {
+    enqueue("heartbeat", data, clientId);
+    showQueued();
+    return;
+  }
   try {
-    const res = await fetch(backendUrl, {
-      method: "POST",
-      headers: { "Content-Type": "application/json" },
-      body: JSON.stringify(data)
-    });
+    const res = await postHeartbeat(data, clientId);
     if (res.ok) {
       document.getElementById("status").innerText = "Sent ✅";
+    } else if (res.status >= 500 || res.status === 429) {
+      enqueue("heartbeat", data, clientId);
+      backOff(res);
+      showQueued();
     } else {
       document.getElementById("status").innerText =
         "Error: " + res.status + " ❌";
     }
   } catch (err) {
+    enqueue("heartbeat", data, clientId);
+    backOff(null);
     document.getElementById("status").innerText = "Backend unreachable ❌";
+    showQueued();
     console.log("Backend error:", err.message);
   }
 }
 
 setInterval(sendMetrics, 5000);
+setInterval(flushOutbox, 1000);